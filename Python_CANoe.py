@@ -6,25 +6,90 @@
 import os
 import sys
 import subprocess
-# import win32com.client
 import time
 import threading
-from win32com.client import *
-from win32com.client.connect import *
 
+import instrumentation
+
+# Write confirmation: readback is polled with a backoff from BACKOFF_START doubling up to BACKOFF_MAX seconds,
+# until every value matches or SET_TIMEOUT seconds have passed
+SET_TIMEOUT = 2.0
+BACKOFF_START = 0.001
+BACKOFF_MAX = 0.05
+
+def _matches(actual, expected):
+    if actual == expected:
+        return True
+    try:
+        return abs(float(actual) - float(expected)) <= 1e-6 * max(abs(float(expected)), 1.0)
+    except (TypeError, ValueError):
+        return False
+
+'''
+    Writes values (name -> value) to their COM objects (name -> handle), then polls the readback of the ones not confirmed yet
+    with a bounded backoff. Returns name -> value read back, raises RuntimeError listing the names still wrong at the deadline.
+'''
+def _write_confirmed(handles, values, timeout):
+    for name, value in values.items():
+        handles[name].Value = value
+    instrumentation.count_com('confirmed.set', len(values))
+    deadline = time.perf_counter() + timeout
+    pending = dict(values)
+    readback = {}
+    backoff = BACKOFF_START
+    while True:
+        instrumentation.count_com('confirmed.get', len(pending))
+        for name in list(pending):
+            readback[name] = handles[name].Value
+            if _matches(readback[name], pending[name]):
+                del pending[name]
+        if not pending:
+            return readback
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise RuntimeError("CANoe did not confirm " + ", ".join(str(name) for name in pending) + " within " + str(timeout) + " s")
+        time.sleep(min(backoff, remaining))
+        backoff = min(backoff * 2, BACKOFF_MAX)
+
+
+# Application factory used by CANoe(), None dispatches the real CANoe COM server (see use_backend)
+BACKEND = None
+
+'''
+    Selects what CANoe() connects to.
+    backend is a callable returning an object with the CANoe.Application COM interface (Version, Measurement, GetBus, Environment,
+    System, Open, Quit), e.g. fake_canoe.FakeApplication for runs without CANoe. None goes back to the COM server.
+'''
+def use_backend(backend):
+    global BACKEND
+    BACKEND = backend
+
+# The real COM server, win32com is only needed (and imported) here
+def dispatch_canoe():
+    import win32com.client
+    return win32com.client.DispatchEx("CANoe.Application")
 
 
 # Vector Canoe Class
+# backend overrides the module BACKEND for this instance.
+# Resolved COM objects (Bus, Signal, Namespace, Variable, EnvVar) are cached, so a repeated get/set is a single COM call
+# instead of walking GetBus().GetSignal() or Namespaces().Variables() every time.
+# The cache is dropped when a configuration is opened or closed, cache_hits/cache_misses count the lookups.
 class CANoe:
-    def __init__(self):
+    def __init__(self, backend=None):
         self.application = None
+        self.handles = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
         # check if there is any instance of CANoe process
         # output = subprocess.check_output('tasklist', shell=True)
         # if CANoe process is still available, kill the process
         # if "CANoe32.exe" in str(output):
         #     os.system("taskkill /im CANoe32.exe /f 2>nul >nul")
         # re-dispatch object for CANoe Application
-        self.application = win32com.client.DispatchEx("CANoe.Application")
+        backend = backend or BACKEND
+        self.com = backend is None
+        self.application = dispatch_canoe() if self.com else backend()
         self.ver = self.application.Version
         print('Loaded CANoe version ',
             self.ver.major, '.',
@@ -39,6 +104,7 @@ class CANoe:
             # check for valid file and it is *.cfg file
             if os.path.isfile(cfgname) and (os.path.splitext(cfgname)[1] == ".cfg"):
                 self.application.Open(cfgname)
+                self.clear_cache()
             else:
                 raise RuntimeError("Can't find CANoe cfg file")
         else:
@@ -50,10 +116,45 @@ class CANoe:
             self.stop_Measurement()
             self.application.Quit()
         # make sure the CANoe is close properly, otherwise enforce taskkill
-        output = subprocess.check_output('tasklist', shell=True)
-        if "CANoe32.exe" in str(output):
-            os.system("taskkill /im CANoe32.exe /f 2>nul >nul")
+        if self.com:
+            output = subprocess.check_output('tasklist', shell=True)
+            if "CANoe32.exe" in str(output):
+                os.system("taskkill /im CANoe32.exe /f 2>nul >nul")
         self.application = None
+        self.clear_cache()
+    
+    def clear_cache(self):
+        self.handles = {}
+    
+    def cache_stats(self):
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 'size': len(self.handles)}
+    
+    def _cached(self, key, resolve):
+        handle = self.handles.get(key)
+        if handle is None:
+            self.cache_misses += 1
+            # Only misses cross the COM boundary, counted per handle kind
+            instrumentation.count_com(key[0] + '.resolve')
+            handle = self.handles[key] = resolve()
+        else:
+            self.cache_hits += 1
+        return handle
+    
+    def get_Bus(self, bus_type="CAN"):
+        return self._cached(('bus', bus_type), lambda: self.application.GetBus(bus_type))
+    
+    def get_Signal(self, channel_num, msg_name, sig_name, bus_type="CAN"):
+        return self._cached(('signal', bus_type, channel_num, msg_name, sig_name),
+                            lambda: self.get_Bus(bus_type).GetSignal(channel_num, msg_name, sig_name))
+    
+    def get_Namespace(self, ns_name):
+        return self._cached(('namespace', ns_name), lambda: self.application.System.Namespaces(ns_name))
+    
+    def get_Variable(self, ns_name, sysvar_name):
+        return self._cached(('sysvar', ns_name, sysvar_name), lambda: self.get_Namespace(ns_name).Variables(sysvar_name))
+    
+    def get_Environment(self, var):
+        return self._cached(('envvar', var), lambda: self.application.Environment.GetVariable(var))
     
     def start_Measurement(self):
         retry = 0
@@ -74,21 +175,35 @@ class CANoe:
     
     def get_EnvVar(self, var):
         if (self.application != None):
-            result = self.application.Environment.GetVariable(var)
+            result = self.get_Environment(var)
+            instrumentation.count_com('envvar.get')
             return result.Value
         else:
             raise RuntimeError("CANoe is not open,unable to GetVariable")
     
-    def set_EnvVar(self, var, value):
-        result = None
+    def set_EnvVar(self, var, value, timeout=SET_TIMEOUT):
+        # set the environment varible and check it is set properly, RuntimeError if not within timeout seconds
+        self.set_EnvVars({var: value}, timeout)
+    
+    def get_EnvVars(self, names):
+        # {name: value} of several environment variables
+        if (self.application != None):
+            instrumentation.count_com('envvar.get', len(names))
+            return {name: self.get_Environment(name).Value for name in names}
+        else:
+            raise RuntimeError("CANoe is not open,unable to GetVariable")
+    
+    def set_EnvVars(self, values, timeout=SET_TIMEOUT):
+        # Sets every {name: value}, then waits until all of them read back (see _write_confirmed), returns {name: value read back}
+        # timeout=None writes without checking
         if (self.application != None):
-            # set the environment varible
-            result = self.application.Environment.GetVariable(var)
-            result.Value = value
-            checker = self.get_EnvVar(var)
-            # check the environment varible is set properly?
-            while (checker != value):
-                checker = self.get_EnvVar(var)
+            handles = {name: self.get_Environment(name) for name in values}
+            if timeout is None:
+                for name, value in values.items():
+                    handles[name].Value = value
+                instrumentation.count_com('envvar.set', len(values))
+                return dict(values)
+            return _write_confirmed(handles, values, timeout)
         else:
             raise RuntimeError("CANoe is not open,unable to SetVariable")
     
@@ -106,26 +221,25 @@ class CANoe:
         @exception None
         """
         if (self.application != None):
-            result = self.application.GetBus(bus_type).GetSignal(channel_num, msg_name, sig_name)
+            result = self.get_Signal(channel_num, msg_name, sig_name, bus_type)
+            instrumentation.count_com('signal.get')
             return result.Value
         else:
             raise RuntimeError("CANoe is not open,unable to GetVariable")
     
     def get_SysVar(self, ns_name, sysvar_name):
         if (self.application != None):
-            systemCAN = self.application.System.Namespaces
-            sys_namespace = systemCAN(ns_name)
-            sys_value = sys_namespace.Variables(sysvar_name)
+            sys_value = self.get_Variable(ns_name, sysvar_name)
+            instrumentation.count_com('sysvar.get')
             return sys_value.Value
         else:
             raise RuntimeError("CANoe is not open,unable to GetVariable")
     
     def set_SysVar(self, ns_name, sysvar_name, var):
         if (self.application != None):
-            systemCAN = self.application.System.Namespaces
-            sys_namespace = systemCAN(ns_name)
-            sys_value = sys_namespace.Variables(sysvar_name)
+            sys_value = self.get_Variable(ns_name, sysvar_name)
             sys_value.Value = var
+            instrumentation.count_com('sysvar.set')
             # print(sys_value)
             # result = sys_value(sys_name)
             #
@@ -133,21 +247,47 @@ class CANoe:
         else:
             raise RuntimeError("CANoe is not open,unable to GetVariable")
     
+    def get_SysVars(self, ns_name, names=None):
+        # {name: value} of several system variables of a namespace, names=None reads every variable of it
+        if (self.application != None):
+            if names is None:
+                values = {sys.Name: sys.Value for sys in self.get_Namespace(ns_name).Variables}
+            else:
+                values = {name: self.get_Variable(ns_name, name).Value for name in names}
+            instrumentation.count_com('sysvar.get', len(values))
+            return values
+        else:
+            raise RuntimeError("CANoe is not open,unable to GetVariable")
+    
+    def set_SysVars(self, ns_name, values, timeout=SET_TIMEOUT):
+        # Sets every {name: value} of a namespace, then waits until all of them read back, returns {name: value read back}
+        # timeout=None writes without checking
+        if (self.application != None):
+            handles = {name: self.get_Variable(ns_name, name) for name in values}
+            if timeout is None:
+                for name, value in values.items():
+                    handles[name].Value = value
+                instrumentation.count_com('sysvar.set', len(values))
+                return dict(values)
+            return _write_confirmed(handles, values, timeout)
+        else:
+            raise RuntimeError("CANoe is not open,unable to SetVariable")
+    
     def set_GetSigVal(self, channel_num, msg_name, sig_name, bus_type="CAN"):
         if self.application is not None:
-            result = self.application.GetBus(bus_type).GetSignal(channel_num, msg_name, sig_name)
+            result = self.get_Signal(channel_num, msg_name, sig_name, bus_type)
             return result
         return None
     
     def get_all_SysVar(self, ns_name):
         if (self.application != None):
             sysvars=[]
-            systemCAN = self.application.System.Namespaces
-            sys_namespace = systemCAN(ns_name)
+            sys_namespace = self.get_Namespace(ns_name)
             sys_value = sys_namespace.Variables
             for sys in sys_value:
                 sysvars.append(sys.Name)
                 sysvars.append(sys.Value)
+            instrumentation.count_com('sysvar.get', len(sysvars) // 2)
             return sysvars
         else:
             raise RuntimeError("CANoe is not open,unable to GetVariable")
@@ -0,0 +1,75 @@
+from bisect import bisect_right
+
+import numpy as np
+
+'''
+    Acceleration distribution.
+    The speed is sampled once per second and the difference to the previous sample (unit/s) is counted in ACCEL_BINS.
+    add_sample is the per-sample version ParseThread uses while a trip is replayed in real time, accel_distribution does the
+    same for a whole trip offline: the (delta ms, speed) series is resampled onto the 1 s grid with searchsorted and all the
+    differences are binned with one bincount, so a trip takes microseconds instead of its own duration.
+'''
+
+# Bin edges in unit/s, counts[i] holds ACCEL_BINS[i - 1] <= diff < ACCEL_BINS[i], counts[0] and counts[-1] are the open ends
+ACCEL_BINS = tuple(range(-10, 11))
+
+# Sampling period of the distribution
+PERIOD_MS = 1000
+
+def empty_counts():
+    return [0] * (len(ACCEL_BINS) + 1)
+
+# Counts one speed difference, counts starts as an empty list
+def add_sample(counts, speed_diff):
+    if not counts:
+        counts.extend(empty_counts())
+    counts[bisect_right(ACCEL_BINS, speed_diff)] += 1
+
+def histogram(speed_diffs):
+    return np.bincount(np.searchsorted(ACCEL_BINS, speed_diffs, side='right'), minlength=len(ACCEL_BINS) + 1)
+
+'''
+    Speed seen at every PERIOD_MS tick of a replay of time_speed.
+    Input: delta ms array, speed array (one trip of parse_file / trip_speeds)
+    Output: speed at 1 s, 2 s, ... until the tick after the last event, 0.0 before the first event
+    Ticks are the ones ParseThread takes: it samples while the replay is running, so the last tick is the first one at or after the end.
+'''
+def resample(delta_ms, speeds, period_ms=PERIOD_MS):
+    offsets = np.cumsum(np.asarray(delta_ms, np.float64))
+    speeds = np.asarray(speeds, np.float64)
+    if len(offsets) == 0:
+        return np.zeros(0)
+    ticks = np.arange(1, int(np.ceil(offsets[-1] / period_ms)) + 1) * period_ms
+    last = np.searchsorted(offsets, ticks, side='right') - 1
+    return np.where(last >= 0, speeds[np.maximum(last, 0)], 0.0)
+
+'''
+    Offline version of the ParseThread distribution for one trip.
+    Input: [(20, 0.0), (20, 1.0), ...] or (delta ms array, speed array)
+    Output: (mph counts, kph counts), lists like the ones ParseThread builds (empty if no tick was taken)
+    kph_factor is the divisor ParseThread applies to the (MPH) speed for the kph distribution.
+'''
+def accel_distribution(time_speed, kph_factor):
+    if isinstance(time_speed, tuple):
+        delta_ms, speeds = time_speed
+    else:
+        pairs = np.asarray(time_speed, np.float64).reshape(-1, 2)
+        delta_ms, speeds = pairs[:, 0], pairs[:, 1]
+    samples = resample(delta_ms, speeds)
+    if len(samples) == 0:
+        return [], []
+    before = np.concatenate([[0.0], samples[:-1]])
+    mph = histogram(samples - before)
+    kph = histogram(samples / kph_factor - before / kph_factor)
+    return mph.tolist(), kph.tolist()
+
+# Sum of the distributions of several trips
+def trips_distribution(trips, kph_factor):
+    mph = np.zeros(len(ACCEL_BINS) + 1, np.int64)
+    kph = np.zeros(len(ACCEL_BINS) + 1, np.int64)
+    for time_speed in trips:
+        trip_mph, trip_kph = accel_distribution(time_speed, kph_factor)
+        if trip_mph:
+            mph += trip_mph
+            kph += trip_kph
+    return mph.tolist(), kph.tolist()
@@ -0,0 +1,158 @@
+import argparse
+import datetime
+
+import numpy as np
+
+'''
+    Synthetic .asc log generator, for benchmarks and for trying the tools without a vehicle log.
+    Writes the same layout CANoe exports (header lines parse_file / save_to_csv read, one frame per line, a few ErrorFrame lines)
+    with a configurable size, ID mix, channel count and trip count.
+    The speed and engine messages carry real signals (BENCH_DBC, write_dbc writes it next to the log):
+    during a trip the engine turns and the speed follows a smooth drive profile, between trips both are 0.
+    Usage: python asc_generator.py out.asc --lines 1000000 --trips 5
+'''
+
+SPEED_ID = 0x100
+ENGINE_ID = 0x200
+
+BENCH_DBC = '''VERSION ""
+
+BO_ 256 SPEED_MSG: 8 ECU1
+ SG_ VehSpeed : 0|16@1+ (0.01,0) [0|655.35] "mph" Vector__XXX
+ SG_ SpeedUnit : 16|1@1+ (1,0) [0|1] "" Vector__XXX
+
+BO_ 512 ENGINE_MSG: 8 ECU2
+ SG_ Rpm : 7|16@0+ (0.25,0) [0|16000] "rpm" Vector__XXX
+ SG_ Ign : 24|2@1+ (1,0) [0|3] "" Vector__XXX
+
+VAL_ 512 Ign 0 "Off" 1 "Acc" 2 "Run" 3 "Start" ;
+'''
+
+# Roles for driving_info_speed.use_dbc(dbc, BENCH_SIGNALS)
+BENCH_SIGNALS = {
+    'speed': ('SPEED_MSG', 'VehSpeed'),
+    'speed_unit': ('SPEED_MSG', 'SpeedUnit'),
+    'rpm': ('ENGINE_MSG', 'Rpm'),
+    'ign': ('ENGINE_MSG', 'Ign')
+}
+
+# Frames per second of log time
+RATE = 2000
+# One ErrorFrame line every this many frames
+ERROR_EVERY = 5000
+# Lines formatted per write
+CHUNK = 1 << 16
+
+_HEX = ['%02X' % i for i in range(256)]
+_DATE = "%a %b %d %I:%M:%S"
+
+def write_dbc(filename):
+    with open(filename, 'w') as file:
+        file.write(BENCH_DBC)
+
+'''
+    Default ID mix: the speed and engine messages plus `others` background IDs, as {id: weight}.
+    Weights are relative shares of the frames, like a 10 ms speed message among 50-100 ms body messages.
+'''
+def default_ids(others=40, seed=0):
+    rng = np.random.default_rng(seed)
+    background = rng.choice(np.setdiff1d(np.arange(0x800), [SPEED_ID, ENGINE_ID]), others, replace=False)
+    ids = {SPEED_ID: 10.0, ENGINE_ID: 5.0}
+    ids.update({int(id): float(rng.uniform(0.5, 2.0)) for id in background})
+    return ids
+
+def _header(start_time):
+    stamp = start_time.strftime(_DATE) + '.' + '%03d' % (start_time.microsecond // 1000) + ' ' \
+            + start_time.strftime('%p').lower() + ' ' + str(start_time.year)
+    return ("date " + stamp + "\nbase hex  timestamps absolute\ninternal events logged\n"
+            "// version 9.0.0\nBegin Triggerblock " + stamp + "\n   0.000000 Start of measurement\n")
+
+# Engine on/off and speed (mph) at every time, trips engine on periods separated by engine off gaps over duration seconds
+def _drive(time, duration, trips):
+    if trips <= 0:
+        return np.zeros(len(time), bool), np.zeros(len(time))
+    # Each trip slot is 80 % driving, 20 % parked
+    slot = duration / trips
+    phase = (time % slot) / slot
+    on = phase < 0.8
+    profile = np.sin(np.pi * phase / 0.8)
+    speed = np.where(on, 70.0 * profile * (0.8 + 0.2 * np.sin(time / 7.0)), 0.0)
+    return on, np.maximum(speed, 0.0)
+
+def _payloads(id, on, speed, rng):
+    data = rng.integers(0, 256, (len(id), 8), dtype=np.uint8)
+    is_speed = id == SPEED_ID
+    raw = np.round(speed[is_speed] * 100).astype(np.uint16)
+    data[is_speed, 0] = raw & 0xFF
+    data[is_speed, 1] = raw >> 8
+    # SpeedUnit = MI
+    data[is_speed, 2] = 1
+    is_engine = id == ENGINE_ID
+    rpm = np.where(on[is_engine], 800 + speed[is_engine] * 35, 0.0)
+    raw = np.round(rpm / 0.25).astype(np.uint16)
+    data[is_engine, 0] = raw >> 8
+    data[is_engine, 1] = raw & 0xFF
+    data[is_engine, 3] = np.where(on[is_engine], 2, 0)
+    return data
+
+'''
+    Writes a synthetic log of `lines` frames.
+    ids is {id: weight} (default_ids()), signal messages always have dlc 8, the others a random dlc.
+    trips engine on periods are spread over the log, channels frames are spread over channels 1..channels.
+    Returns the number of lines written (frames + ErrorFrame lines + header + footer).
+'''
+def generate_asc(filename, lines=1000000, trips=3, ids=None, channels=1, start_time=None, seed=0, rate=RATE):
+    rng = np.random.default_rng(seed)
+    ids = default_ids(seed=seed) if ids is None else ids
+    id_values = np.array(list(ids), np.uint32)
+    weights = np.array(list(ids.values()), np.float64)
+    weights /= weights.sum()
+    dlc_choices = np.array([8, 8, 8, 6, 4, 2, 0])
+    start_time = start_time or datetime.datetime(2019, 12, 19, 13, 32, 7, 156000)
+    duration = lines / rate
+    written = 0
+    time = 0.0
+    with open(filename, 'w', newline='\n') as file:
+        header = _header(start_time)
+        file.write(header)
+        written += header.count('\n')
+        for first in range(0, lines, CHUNK):
+            n = min(CHUNK, lines - first)
+            times = time + np.cumsum(rng.exponential(1.0 / rate, n))
+            time = float(times[-1])
+            id = rng.choice(id_values, n, p=weights)
+            dlc = rng.choice(dlc_choices, n)
+            dlc[(id == SPEED_ID) | (id == ENGINE_ID)] = 8
+            channel = rng.integers(1, channels + 1, n)
+            on, speed = _drive(times, duration, trips)
+            data = _payloads(id, on, speed, rng)
+            out = []
+            for i, (t, c, frame_id, length, row) in enumerate(zip(times.tolist(), channel.tolist(), id.tolist(),
+                                                                   dlc.tolist(), data.tolist())):
+                payload = ' '.join([_HEX[b] for b in row[:length]])
+                out.append("%11.6f %d  %-15X Rx   d %d %s  Length = 0 BitCount = 0 ID = %d\n" % (t, c, frame_id, length, payload, frame_id))
+                if (first + i) % ERROR_EVERY == ERROR_EVERY - 1:
+                    out.append("%11.6f %d  ErrorFrame\n" % (t, c))
+            file.write(''.join(out))
+            written += len(out)
+        file.write("End TriggerBlock\n")
+        written += 1
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes a synthetic CANoe .asc log")
+    parser.add_argument('filename')
+    parser.add_argument('--lines', type=int, default=1000000, help="frames to write")
+    parser.add_argument('--trips', type=int, default=3)
+    parser.add_argument('--ids', type=int, default=40, help="background IDs besides the speed and engine messages")
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dbc', help="also write the DBC of the speed/engine messages there")
+    args = parser.parse_args()
+    written = generate_asc(args.filename, args.lines, args.trips, default_ids(args.ids, args.seed), args.channels, seed=args.seed)
+    if args.dbc:
+        write_dbc(args.dbc)
+    print(args.filename + ": " + str(written) + " lines")
+
+if __name__ == '__main__':
+    main()
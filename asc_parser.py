@@ -0,0 +1,834 @@
+import datetime
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import instrumentation
+from time_index import TimeIndexBuilder
+
+'''
+    Columnar .asc parser.
+    The file is read in large blocks and every block is tokenized with NumPy instead of calling split()/float()/int() per line.
+    The result is a FrameTable, a set of parallel columns:
+        time      float64 seconds offset from measurement start
+        channel   uint8   CAN channel (1 based, as in the log)
+        id        uint32  arbitration ID
+        direction uint8   RX or TX
+        dlc       uint8   data length code
+        data      uint8   (n, PAYLOAD_WIDTH) payload matrix, bytes past dlc are 0
+    Lines that are not CAN data frames (header, "Start of measurement", error frames, comments...) are dropped.
+'''
+
+# .asc format file has a header, first line is the measurement start time
+HEADER_LINES = 3
+# Classic CAN payload
+PAYLOAD_WIDTH = 8
+# Bytes read from disk at once
+BLOCK_SIZE = 1 << 24
+# Bytes per range handed to a worker in parallel mode
+RANGE_SIZE = 1 << 26
+
+RX = 0
+TX = 1
+
+# Widest timestamp / channel / ID token we decode
+_TIME_CHARS = 17
+_CHANNEL_CHARS = 3
+_ID_CHARS = 8
+_PADDING = b'\n' * 32
+# Bytes of a line searched for the tokens up to the first payload byte, one bit each in a uint64
+_LAYOUT_CHARS = 64
+# Bytes of a line copied for decoding it, the layout bytes and the payload after them
+_WINDOW_CHARS = _LAYOUT_CHARS + 3 * PAYLOAD_WIDTH
+# Lines searched for the layout of the first data line, layouts tried per block
+_SAMPLE_LINES = 64
+_LAYOUTS = 4
+# Bytes searched for newlines at once
+_SCAN_BYTES = 1 << 18
+# Lines decoded at once by the layout path, so the columns of a batch stay in the CPU cache
+_BATCH_LINES = 1 << 14
+_ONE = np.uint64(1)
+_GATHER = np.uint64(0x0102040810204080)
+_FULL = np.uint64(0xFFFFFFFFFFFFFFFF)
+# 'Tx' / 'Rx' read as little endian uint16
+_TX = int.from_bytes(b'Tx', 'little')
+_RX = int.from_bytes(b'Rx', 'little')
+# Byte masks of the uint64 words of 8 chars: '0' / 0x80 in every byte, and the limits added to find the bytes above 9
+# and above ' ' in their 0x80 bit
+_DIGITS = np.uint64(0x3030303030303030)
+_HIGH_BITS = np.uint64(0x8080808080808080)
+# 0x100 in every uint16 of a word of 4 char pairs, see _PAIRS
+_PAIR_BITS = np.uint64(0x0100010001000100)
+_DIGIT_LIMIT = np.uint64(0x7676767676767676)
+_SPACE_LIMIT = np.uint64(0x5F5F5F5F5F5F5F5F)
+
+# ASCII -> hex digit lookup, -1 for anything that is not a hex digit
+_HEX = np.full(256, -1, dtype=np.int64)
+for _i, _c in enumerate(b'0123456789abcdef'):
+    _HEX[_c] = _i
+for _i, _c in enumerate(b'ABCDEF'):
+    _HEX[_c] = _i + 10
+# Char pair (first char in the low byte of a uint16) -> byte value of the 2 hex digits, _BAD_PAIR if either is not one
+_BAD_PAIR = 0x100
+_PAIRS = np.full(1 << 16, _BAD_PAIR, np.uint16)
+_i = np.arange(1 << 16)
+_i = _i[(_HEX[_i & 255] >= 0) & (_HEX[_i >> 8] >= 0)]
+_PAIRS[_i] = _HEX[_i & 255] * 16 + _HEX[_i >> 8]
+
+
+class FrameTable:
+    def __init__(self, time, channel, id, direction, dlc, data, start_time=None):
+        self.time = time
+        self.channel = channel
+        self.id = id
+        self.direction = direction
+        self.dlc = dlc
+        self.data = data
+        # datetime of the measurement start (header 'date' line), None if unknown
+        self.start_time = start_time
+
+    def __len__(self):
+        return len(self.time)
+
+    # Rows selected by a boolean mask or an index array
+    def take(self, index):
+        return FrameTable(self.time[index], self.channel[index], self.id[index],
+                          self.direction[index], self.dlc[index], self.data[index], self.start_time)
+
+    # Payload of row i trimmed to its dlc
+    def frame(self, i):
+        return self.data[i, :self.dlc[i]]
+
+    @staticmethod
+    def empty(start_time=None):
+        return FrameTable(np.empty(0, np.float64), np.empty(0, np.uint8), np.empty(0, np.uint32),
+                          np.empty(0, np.uint8), np.empty(0, np.uint8),
+                          np.empty((0, PAYLOAD_WIDTH), np.uint8), start_time)
+
+    @staticmethod
+    def concat(tables, start_time=None):
+        tables = list(tables)
+        if start_time is None:
+            start_time = next((t.start_time for t in tables if t.start_time is not None), None)
+        if not tables:
+            return FrameTable.empty(start_time)
+        return FrameTable(np.concatenate([t.time for t in tables]),
+                          np.concatenate([t.channel for t in tables]),
+                          np.concatenate([t.id for t in tables]),
+                          np.concatenate([t.direction for t in tables]),
+                          np.concatenate([t.dlc for t in tables]),
+                          np.concatenate([t.data for t in tables]),
+                          start_time)
+
+'''
+    Parses the first header line of an .asc file.
+    Input: date Thu Dec 19 01:32:07.156 pm 2019
+    Output: datetime.datetime(2019, 12, 19, 13, 32, 7, 156000), None if the line is not a date line
+'''
+def parse_header_date(line):
+    if isinstance(line, bytes):
+        line = line.decode('ascii', 'replace')
+    try:
+        return datetime.datetime.strptime(line.rstrip('\r\n'), "date %a %b %d %I:%M:%S.%f %p %Y")
+    except ValueError:
+        return None
+
+# Reads the header lines, returns (start time, header lines as bytes)
+def read_header(file):
+    header = [file.readline() for _ in range(HEADER_LINES)]
+    return parse_header_date(header[0]), header
+
+# Decimal or hex token -> (value, valid), a token ends at the first byte <= 32 or at suffix
+def _integer(a, start, width, base, suffix=None):
+    value = np.zeros(len(start), np.int64)
+    ok = np.ones(len(start), bool)
+    alive = ok.copy()
+    for j in range(width + 1):
+        c = a[start + j]
+        alive &= c > 32
+        if suffix is not None:
+            alive &= c != suffix
+        if not alive.any():
+            break
+        digit = _HEX[c]
+        # no room left or not a digit of this base
+        ok &= ~alive | ((j < width) & (digit >= 0) & (digit < base))
+        value = np.where(alive, value * base + digit, value)
+    return value, ok
+
+# Timestamp token '12.940318' -> float seconds, decoded as one integer division so it rounds like float()
+def _timestamp(a, start):
+    whole = np.zeros(len(start), np.int64)
+    scale = np.ones(len(start), np.int64)
+    dot = np.zeros(len(start), bool)
+    ok = np.ones(len(start), bool)
+    alive = ok.copy()
+    for j in range(_TIME_CHARS + 1):
+        c = a[start + j]
+        alive &= c > 32
+        if not alive.any():
+            break
+        is_dot = c == ord('.')
+        digit = c - ord('0')
+        is_digit = digit <= 9
+        ok &= ~alive | ((j < _TIME_CHARS) & (is_digit | (is_dot & ~dot)))
+        is_digit &= alive
+        whole = np.where(is_digit, whole * 10 + digit, whole)
+        scale = np.where(is_digit & dot, scale * 10, scale)
+        dot |= is_dot & alive
+    return whole / scale, ok
+
+'''
+    Token starts of a block of complete lines.
+    Output: (bytes as uint8 array, whitespace mask, token starts, start offset of every line, first token of every line, token count of every line)
+'''
+def _tokenize(buf):
+    # Padding so the per-character token loops never run off the block
+    buf = buf + _PADDING if buf.endswith(b'\n') else buf + b'\n' + _PADDING
+    a = np.frombuffer(buf, dtype=np.uint8)
+    # space, tab, CR and LF
+    space = a <= 32
+    begins = ~space
+    begins[1:] &= space[:-1]
+    tok_start = np.flatnonzero(begins)
+    # First token and token count of every line
+    line_start = np.concatenate(([0], np.flatnonzero(a == ord('\n'))[:-1] + 1))
+    first = np.searchsorted(tok_start, line_start)
+    counts = np.diff(first, append=len(tok_start))
+    return a, space, tok_start, line_start, first, counts
+
+# Lines (indexes) that are CAN data frames: at least 6 tokens, 'd' at token 4 and Rx/Tx at token 3
+def _data_lines(a, space, tok_start, first, counts):
+    lines = np.flatnonzero(counts >= 6)
+    f = first[lines]
+    t3 = tok_start[f + 3]
+    t4 = tok_start[f + 4]
+    ok = (a[t4] == ord('d')) & space[t4 + 1]
+    ok &= ((a[t3] == ord('R')) | (a[t3] == ord('T'))) & (a[t3 + 1] == ord('x')) & space[t3 + 2]
+    return lines[ok]
+
+'''
+    Rows of width bytes of a starting at every start, bytes outside a read as '\n'.
+    One row gather of a sliding window view, so a field of every line costs about one copy of it. The rows are gathered
+    as single void items of width bytes, numpy copies those at once instead of byte by byte.
+'''
+def _windows(a, start, width):
+    size = len(a)
+    if size < width:
+        a = np.concatenate((a, np.full(width - size, ord('\n'), np.uint8)))
+    rows = sliding_window_view(a, width).view(np.dtype((np.void, width)))[:, 0]
+    rows = rows[np.clip(start, 0, len(a) - width)].view(np.uint8).reshape(-1, width)
+    # The first and last lines of the block
+    for i in np.flatnonzero((start < 0) | (start > size - width)):
+        first = int(start[i])
+        lo, hi = max(first, 0), min(first + width, size)
+        rows[i] = ord('\n')
+        if hi > lo:
+            rows[i, lo - first:hi - first] = a[lo:hi]
+    return rows
+
+'''
+    Offsets of the newlines of a, in order. The newline mask is packed into bits (_SCAN_BYTES at a time, so the mask
+    stays small) and searched 64 bytes at a time, in the words of lines longer than that the newline is the lowest set
+    bit. Words of several newlines (short lines) take their bits off one at a time into the slots after their first one.
+'''
+def _newlines(a):
+    words = np.zeros(-(-len(a) // 64), '<u8')
+    bits = words.view(np.uint8)
+    mask = np.empty(min(len(a), _SCAN_BYTES), bool)
+    for start in range(0, len(a), _SCAN_BYTES):
+        chunk = mask[:len(a) - start] if start + _SCAN_BYTES > len(a) else mask
+        np.equal(a[start:start + len(chunk)], ord('\n'), out=chunk)
+        bits[start // 8:start // 8 + -(-len(chunk) // 8)] = np.packbits(chunk, bitorder='little')
+    index = np.flatnonzero(words != 0)
+    x = words[index]
+    low = x & (~x + _ONE)
+    if np.all(x == low):
+        return 64 * index + _bit_number(low)
+    count = _popcount(x).astype(np.int64)
+    slot = np.cumsum(count) - count
+    found = np.empty(int(count.sum()), np.int64)
+    while len(index):
+        low = x & (~x + _ONE)
+        found[slot] = 64 * index + _bit_number(low)
+        x ^= low
+        more = np.flatnonzero(x)
+        index, x, slot = index[more], x[more], slot[more] + 1
+    return found
+
+# Set bits of every uint64 (np.bitwise_count needs NumPy 2)
+def _popcount(x):
+    x = x - ((x >> _ONE) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+# Bit number of every uint64 holding a single set bit (exponent of it as a float64)
+def _bit_number(x):
+    return (x.astype(np.float64).view(np.int64) >> 52) - 1023
+
+# Bits lo to hi - 1 of a python int
+def _bits(lo, hi):
+    return ((1 << (hi - lo)) - 1) << lo
+
+'''
+    Digit values in the bytes of words (chars ^ _DIGITS), the first (most significant) in the low byte: (number, bad),
+    bad has 0x80 set in the bytes that were not digits. Pairs, then quads, then the 8 digits are combined in place.
+'''
+def _decimal_words(x):
+    bad = ((x + _DIGIT_LIMIT) | x) & _HIGH_BITS
+    x = (x * np.uint64(10) + (x >> np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    x = (x * np.uint64(100) + (x >> np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    x = (x * np.uint64(10000) + (x >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+    return x, bad
+
+# Token starts (set -> clear steps of the whitespace words), the first 7 picked off one lowest bit at a time, -1 if missing
+def _token_starts(space):
+    begins = ~space & ((space << _ONE) | _ONE)
+    bits = np.empty((7, len(begins)), np.uint64)
+    for k in range(7):
+        bits[k] = begins & (~begins + _ONE)
+        begins ^= bits[k]
+    return list(np.maximum(_bit_number(bits), -1))
+
+'''
+    Whitespace words of window rows of lines of length (see parse_block), from the first 8 * k (up to _LAYOUT_CHARS) bytes.
+    Each 8 whitespace flags (0 / 1 bytes) of a uint64 gather into its top byte when multiplied by _GATHER.
+'''
+def _space(window, length):
+    chars = min(window.shape[1], _LAYOUT_CHARS) // 8 * 8
+    flags = (window[:, :chars] <= 32).view('<u8')
+    flags *= _GATHER
+    flags >>= np.uint64(56)
+    space = np.zeros((len(window), 8), np.uint8)
+    space[:, :chars // 8] = flags
+    space = space.view('<u8').ravel()
+    short = np.flatnonzero(length < _LAYOUT_CHARS)
+    space[short] |= ~((_ONE << length[short].astype(np.uint64)) - _ONE)
+    return space
+
+'''
+    Column layout of the first data frame line of rows, from its whitespace word, None if there is none:
+        ((end of the timestamp, start of the channel, ID, direction, 'd', dlc, first payload byte, fraction digits), word)
+'''
+def _find_layout(window, space, rows):
+    starts = _token_starts(space[rows])
+    for k, row in enumerate(rows.tolist()):
+        p = [int(s[k]) for s in starts]
+        if p[6] <= 0:
+            continue
+        word = int(space[row])
+        end = [s + ((word >> s) & -(word >> s)).bit_length() - 1 for s in p[:6]]
+        chars = window[row].tobytes()
+        token = chars[p[0]:end[0]]
+        if chars[p[3]] in b'RT' and chars[p[3] + 1] == ord('x') and end[3] == p[3] + 2 and chars[p[4]] == ord('d') and \
+                end[4] == p[4] + 1 and end[5] == p[5] + 1 and b'.' in token and len(token) <= 16:
+            return (end[0],) + tuple(p[1:]) + (len(token) - 1 - token.find(b'.'),), word
+    return None
+
+'''
+    Lines of whitespace words matching a layout: the same whitespace from the last timestamp byte to the first payload byte,
+    except that the channel and the ID are any run of non whitespace from their start. Before the timestamp there may be
+    any whitespace, so the timestamp starts where the run of set low bits ends.
+    Output: (match, start of the timestamp, end of the channel, end of the ID)
+'''
+def _match_layout(space, layout, word):
+    end, channel, id, direction, _, _, payload, _ = layout
+    mask = _bits(end - 1, channel + 1) | _bits(id - 1, id + 1) | _bits(direction - 1, payload)
+    match = (space & np.uint64(mask)) == np.uint64(word & mask)
+    runs = np.empty((3, len(space)), np.uint64)
+    runs[0] = space & np.uint64(_bits(0, end - 1))
+    runs[1] = (~space >> np.uint64(channel)) & np.uint64(_bits(0, id - 1 - channel))
+    runs[2] = (~space >> np.uint64(id)) & np.uint64(_bits(0, direction - 1 - id))
+    ends = runs + _ONE
+    match &= ((runs[0] & ends[0]) | (runs[1] & ends[1]) | (runs[2] & ends[2])) == 0
+    ends = _bit_number(ends)
+    return match, ends[0], channel + ends[1], id + ends[2]
+
+# Bytes from column c of every window row as little endian uint64, bytes before the row (c < 0) read as 0
+def _column(window, c):
+    if c <= -8:
+        return np.zeros(len(window), np.uint64)
+    if c < 0:
+        return _column(window, 0) << np.uint64(-8 * c)
+    return np.ascontiguousarray(window[:, c:c + 8].view('<u8')[:, 0])
+
+'''
+    Direction, dlc and ID of the lines matching a layout, the part of _parse_layout _other_ids needs too.
+    Output: (mask of the data frame lines, Tx mask, dlc, ID, mask of the valid IDs)
+'''
+def _frame_ids(window, match, id_end, layout):
+    _, _, id, direction, d, dlc, _, _ = layout
+    pair = window[:, direction:direction + 2].view('<u2')[:, 0]
+    tx = pair == _TX
+    frame = match & (tx | (pair == _RX)) & (window[:, d] == ord('d'))
+    size = window[:, dlc] - np.uint8(ord('0'))
+    # A bad dlc rejects the line on either path
+    frame &= size <= PAYLOAD_WIDTH
+
+    # ID is hex, extended IDs end with 'x' (the 9th byte of a 9 byte token), read as 4 char pairs right aligned with '0'
+    words = _column(window, id)
+    width = id_end - id
+    # Last byte of the token, the byte after a 1 byte token is whitespace and counts as no 'x'
+    last = _column(window, id + 1) >> (8 * np.clip(width - 2, 0, _ID_CHARS - 1)).astype(np.uint64)
+    digits = np.clip(width - ((last & np.uint64(0xFF)) == ord('x')), 0, _ID_CHARS + 1)
+    shift = 8 * (_ID_CHARS - np.clip(digits, 1, _ID_CHARS)).astype(np.uint64)
+    pairs = np.take(_PAIRS, ((words << shift) | (_DIGITS >> (np.uint64(64) - shift))).view('<u2'))
+    ok = (digits >= 1) & (digits <= _ID_CHARS) & ((pairs.view('<u8') & _PAIR_BITS) == 0)
+    value = pairs.astype(np.uint8).view('>u4').astype(np.uint32)
+    return frame, tx, size, value, ok
+
+'''
+    Frames of the lines matching a layout (_match_layout), every field is decoded from the window words at its column.
+    match, time_start, channel_end, id_end are per line, ids as for parse_block: the other lines are dropped right after
+    the ID is decoded, so only the wanted ones are decoded further.
+    Output: (FrameTable, timestamp offsets, mask of the lines for the general tokenizer)
+'''
+def _parse_layout(window, line_start, length, match, time_start, channel_end, id_end, layout, ids, start_time):
+    end, channel, id, direction, d, dlc, payload, frac = layout
+    frame, tx, size, value, ok = _frame_ids(window, match, id_end, layout)
+    general = frame & ~ok
+    ok &= frame
+    rows = slice(None)
+    if ids is not None:
+        wanted = np.isin(value, ids)
+        if instrumentation.ENABLED:
+            instrumentation.count_ids('dropped', value[ok & ~wanted])
+        rows = np.flatnonzero(ok & wanted)
+        window, tx, size, value = window[rows], tx[rows], size[rows], value[rows]
+        line_start, length, time_start, channel_end = line_start[rows], length[rows], time_start[rows], channel_end[rows]
+    ok = ok[rows]
+    if not len(window):
+        return FrameTable.empty(start_time), np.empty(0, np.int64), general
+
+    # Timestamp: digit values of the 16 bytes before its end, 0 in front of it and the dot taken out, as two 8 digit words
+    width = end - time_start
+    ok &= (width > frac) & (width <= 16) & (window[:, end - 1 - frac] == ord('.'))
+    shift = 8 * np.clip(16 - width, 0, 16).astype(np.uint64)
+    high = (_column(window, end - 16) ^ _DIGITS) & (_FULL << shift)
+    low = (_column(window, end - 8) ^ _DIGITS) & (_FULL << (np.maximum(shift, 64) - np.uint64(64)))
+    dot = 15 - frac
+    if dot >= 8:
+        below = np.uint64(_bits(0, 8 * (dot - 8)))
+        low = (low & ~np.uint64(_bits(0, 8 * (dot - 7)))) | ((low & below) << np.uint64(8)) | (high >> np.uint64(56))
+        high <<= np.uint64(8)
+    else:
+        below = np.uint64(_bits(0, 8 * dot))
+        high = (high & ~np.uint64(_bits(0, 8 * (dot + 1)))) | ((high & below) << np.uint64(8))
+    high, bad = _decimal_words(high)
+    low, low_bad = _decimal_words(low)
+    ok &= (bad | low_bad) == 0
+    time = (high * np.uint64(10 ** 8) + low).astype(np.float64) / 10.0 ** frac
+
+    width = channel_end - channel
+    if np.all(width == 1):
+        # Single digit channels, all of them in most logs
+        number = window[:, channel] - np.uint8(ord('0'))
+        ok &= number <= 9
+    else:
+        shift = 8 * (8 - np.clip(width, 0, 8)).astype(np.uint64)
+        number, bad = _decimal_words((_column(window, channel) ^ _DIGITS) << shift)
+        ok &= (width <= _CHANNEL_CHARS) & (bad == 0)
+
+    # Payload bytes at 3 byte steps from the first one: 2 hex digits and a whitespace each, within the line.
+    # _BAD_PAIR >> 1 is the 0x80 bit of a byte, as for the separators
+    used = _FULL >> (8 * (PAYLOAD_WIDTH - np.minimum(size, PAYLOAD_WIDTH))).astype(np.uint64)
+    step = (window.strides[0], 3)
+    pairs = np.take(_PAIRS, np.ndarray((len(window), PAYLOAD_WIDTH), '<u2', window, payload, step))
+    separator = np.ndarray((len(window), PAYLOAD_WIDTH), np.uint8, window, payload + 2, step).copy().view('<u8')[:, 0]
+    bad = (pairs >> np.uint16(1)).astype(np.uint8).view('<u8')[:, 0] | ((separator + _SPACE_LIMIT) | separator)
+    ok &= ((bad & _HIGH_BITS & used) == 0) & (payload + 3 * size.astype(np.int64) - 1 <= length)
+    data = pairs.astype(np.uint8).view('<u8')[:, 0] & used
+
+    if ids is None:
+        general |= frame & ~ok
+    else:
+        general[rows[~ok]] = True
+    frames = FrameTable(time, number.astype(np.uint8), value, tx.view(np.uint8), size,
+                        data.view(np.uint8).reshape(-1, PAYLOAD_WIDTH), start_time)
+    offsets = line_start + time_start
+    if ok.all():
+        return frames, offsets, general
+    return frames.take(ok), offsets[ok], general
+
+'''
+    Lines of line_start (of length) that match a layout (as found by _find_layout) and are data frames with an ID not
+    in ids. Only the bytes before the first payload byte are read, so parse_block with ids reads the whole line only
+    for the others.
+'''
+def _other_ids(a, line_start, length, found, ids):
+    layout, word = found
+    _, _, id, _, _, _, payload, _ = layout
+    window = _windows(a, line_start, 8 * -(-max(payload, id + 1 + _ID_CHARS) // 8))
+    match, _, _, id_end = _match_layout(_space(window, length), layout, word)
+    frame, _, _, value, ok = _frame_ids(window, match, id_end, layout)
+    other = frame & ok & ~np.isin(value, ids)
+    if instrumentation.ENABLED:
+        instrumentation.count_ids('dropped', value[other])
+    return other
+
+'''
+    Tokenizes a block of complete .asc lines (bytes) and returns a FrameTable of the CAN data frames in it.
+    Input:
+        12.940318 1  ###             Tx   d 6 00 00 00 00 00 00  Length = 205987 BitCount = 106 ID = ###X
+    Token layout: time, channel, id, direction, 'd', dlc, payload bytes...
+    Lines are cut at the newlines and the whitespace of the first _LAYOUT_CHARS bytes of each line is packed into one uint64
+    (bit j set: byte j is whitespace or past the line end). CANoe writes fixed width columns, so nearly all lines share the
+    column layout of the first data line (_find_layout, _match_layout): their fields are then decoded at fixed columns,
+    8 bytes at a time as uint64 words, and the payload is checked to be single spaced 2 digit bytes, as CANoe writes it.
+    Up to _LAYOUTS layouts are tried per block, on batches of _BATCH_LINES lines. Lines that fit none (other spacing, odd
+    timestamps, fields that fail) go through the general tokenizer (_parse_tokens), and all of them are merged in file
+    order, so the result is the same as tokenizing everything.
+    ids (array of arbitration IDs) keeps only those frames, the other lines are rejected right after their ID is read,
+    from the second batch on before the rest of the line is (_other_ids).
+    positions=True returns (FrameTable, offset of the timestamp of every row in buf) for the time index.
+'''
+def parse_block(buf, start_time=None, ids=None, positions=False):
+    a = np.frombuffer(buf, np.uint8)
+    line_end = _newlines(a)
+    if len(a) and a[-1] != ord('\n'):
+        line_end = np.append(line_end, len(a))
+    line_start = np.empty(len(line_end), np.int64)
+    line_start[:1] = 0
+    line_start[1:] = line_end[:-1] + 1
+    length = line_end - line_start
+
+    parts = []
+    general = []
+    layouts = []
+    for first in range(0, len(line_start), _BATCH_LINES):
+        rows = np.arange(first, min(first + _BATCH_LINES, len(line_start)))
+        if ids is not None and layouts:
+            # Frames of other IDs are dropped on their first bytes
+            rows = rows[~_other_ids(a, line_start[rows], length[rows], layouts[0], ids)]
+        found, other = _parse_batch(a, line_start[rows], length[rows], layouts, ids, start_time)
+        parts += found
+        general.append(rows[other])
+
+    general = np.sort(np.concatenate(general)) if general else np.empty(0, np.int64)
+    if len(general) or not parts:
+        parts.append(_parse_general(buf, line_start[general], line_end[general], start_time, ids))
+    if len(parts) == 1:
+        frames, offsets = parts[0]
+    else:
+        offsets = np.concatenate([offsets for _, offsets in parts])
+        frames = FrameTable.concat([frames for frames, _ in parts], start_time)
+        if not np.all(offsets[1:] > offsets[:-1]):
+            # Every part is in file order, a stable sort merges them
+            order = np.argsort(offsets, kind='stable')
+            frames = frames.take(order)
+            offsets = offsets[order]
+    if positions:
+        return frames, offsets
+    return frames
+
+'''
+    Layout path of parse_block for the lines line_start (with their length) of a.
+    layouts holds the ones found in the earlier batches, they are tried first and new ones are added to it.
+    Output: ([(FrameTable, timestamp offsets) per layout], lines (indexes in the batch) for the general tokenizer)
+'''
+def _parse_batch(a, line_start, length, layouts, ids, start_time):
+    window = _windows(a, line_start, _WINDOW_CHARS)
+    space = _space(window, length)
+
+    parts = []
+    general = []
+    taken = np.zeros(len(space), bool)
+    for k in range(_LAYOUTS):
+        if k == len(layouts):
+            found = _find_layout(window, space, np.flatnonzero(~taken)[:_SAMPLE_LINES])
+            if found is None:
+                break
+            layouts.append(found)
+        match, time_start, channel_end, id_end = _match_layout(space, *layouts[k])
+        match &= ~taken
+        frames, offsets, other = _parse_layout(window, line_start, length, match, time_start, channel_end, id_end,
+                                               layouts[k][0], ids, start_time)
+        parts.append((frames, offsets))
+        general.append(np.flatnonzero(other))
+        taken |= match
+    rest = np.flatnonzero(~taken)
+
+    # Lines of no layout with the tokens up to the dlc in the window are frames or not as _data_lines decides
+    p = _token_starts(space[rest])
+    seen = (p[5] >= 0) & (p[5] < _LAYOUT_CHARS - 1)
+    # Longer lines without them are left to the general path
+    general.append(rest[~seen & (length[rest] >= _LAYOUT_CHARS)])
+    flat = window.ravel()
+    t3 = rest[seen] * _WINDOW_CHARS + p[3][seen]
+    t4 = rest[seen] * _WINDOW_CHARS + p[4][seen]
+    c3 = flat[t3]
+    is_data = ((c3 == ord('R')) | (c3 == ord('T'))) & (flat[t3 + 1] == ord('x')) & (flat[t3 + 2] <= 32)
+    is_data &= (flat[t4] == ord('d')) & (flat[t4 + 1] <= 32)
+    general.append(rest[seen][is_data])
+    return parts, np.concatenate(general)
+
+# Frames of the general path lines starts to ends of buf, with their timestamp offsets in buf
+def _parse_general(buf, starts, ends, start_time, ids):
+    sub = b'\n'.join(buf[s:e] for s, e in zip(starts.tolist(), ends.tolist())) + b'\n'
+    frames, positions = _parse_tokens(sub, start_time, ids)
+    # Offsets in sub -> offsets in buf
+    sub_start = np.concatenate(([0], np.cumsum(ends - starts + 1)[:-1]))
+    line = np.searchsorted(sub_start, positions, side='right') - 1
+    return frames, starts[line] + positions - sub_start[line]
+
+'''
+    General tokenizer path of parse_block, for the lines the fixed layout path does not handle.
+    Token starts are found once for the whole block, every field after that is a gather over the lines.
+    Output: (FrameTable, offset of the timestamp of every row in buf)
+'''
+def _parse_tokens(buf, start_time=None, ids=None):
+    a, space, tok_start, _, first, counts = _tokenize(buf)
+    lines = _data_lines(a, space, tok_start, first, counts)
+    f = first[lines]
+    counts = counts[lines]
+    direction = (a[tok_start[f + 3]] == ord('T')).astype(np.uint8)
+
+    t5 = tok_start[f + 5]
+    dlc = _HEX[a[t5]]
+    ok = space[t5 + 1] & (dlc >= 0) & (dlc <= PAYLOAD_WIDTH) & (counts >= 6 + dlc)
+
+    # ID is hex, extended IDs end with 'x'
+    id, id_ok = _integer(a, tok_start[f + 2], _ID_CHARS, 16, ord('x'))
+    ok &= id_ok
+    if ids is not None:
+        # Unwanted IDs are dropped before the timestamp and payload are decoded
+        wanted = np.isin(id, ids)
+        if instrumentation.ENABLED:
+            instrumentation.count_ids('dropped', id[ok & ~wanted])
+        keep = np.flatnonzero(ok & wanted)
+        f, counts, direction, dlc, id = f[keep], counts[keep], direction[keep], dlc[keep], id[keep]
+        ok = np.ones(len(f), bool)
+
+    time, time_ok = _timestamp(a, tok_start[f])
+    ok &= time_ok
+    channel, channel_ok = _integer(a, tok_start[f + 1], _CHANNEL_CHARS, 10)
+    ok &= channel_ok
+
+    data = np.zeros((len(f), PAYLOAD_WIDTH), np.uint8)
+    for k in range(PAYLOAD_WIDTH):
+        m = np.flatnonzero(ok & (k < dlc))
+        if len(m) == 0:
+            break
+        s = tok_start[f[m] + 6 + k]
+        hi = _HEX[a[s]]
+        lo = _HEX[a[s + 1]]
+        valid = (hi >= 0) & (lo >= 0) & space[s + 2]
+        ok[m[~valid]] = False
+        data[m, k] = hi * 16 + lo
+
+    frames = FrameTable(time[ok], channel[ok].astype(np.uint8), id[ok].astype(np.uint32),
+                        direction[ok], dlc[ok].astype(np.uint8), data[ok], start_time)
+    return frames, tok_start[f[ok]]
+
+'''
+    Raw byte filter of a block of complete .asc lines, for trimming a log without decoding it (asciiCanTool.trim).
+    Only the ID and channel tokens of the data frame lines are read: a frame line is kept if its ID is in ids and its channel in
+    channels (None keeps every ID / channel). Lines that do not start with a timestamp (Begin/End Triggerblock, comments...)
+    are kept, the other timestamped lines (error frames, events) are dropped.
+    Output: the kept lines as bytes, unchanged and in order
+'''
+def filter_block(buf, ids=None, channels=None):
+    if not buf.endswith(b'\n'):
+        buf += b'\n'
+    a, space, tok_start, line_start, first, counts = _tokenize(buf)
+    size = len(buf)
+    # Lines of buf, without the empty lines of the padding
+    n = np.searchsorted(line_start, size)
+    line_start, first, counts = line_start[:n], first[:n], counts[:n]
+    line_end = np.append(line_start[1:], size)
+    timestamped = counts > 0
+    timestamped[timestamped] = (a[tok_start[first[timestamped]]] - ord('0')) <= 9
+    keep = ~timestamped
+    lines = _data_lines(a, space, tok_start, first, counts)
+    f = first[lines]
+    wanted = np.ones(len(lines), bool)
+    if ids is not None:
+        id, id_ok = _integer(a, tok_start[f + 2], _ID_CHARS, 16, ord('x'))
+        wanted &= id_ok & np.isin(id, ids)
+    if channels is not None:
+        channel, channel_ok = _integer(a, tok_start[f + 1], _CHANNEL_CHARS, 10)
+        wanted &= channel_ok & np.isin(channel, channels)
+    keep[lines[wanted]] = True
+    mask = np.repeat(keep, line_end - line_start)
+    return a[:size][mask].tobytes()
+
+'''
+    Reads an .asc file block by block and yields a FrameTable per block.
+    Blocks are cut at the last newline so a line is never split between two tables.
+    start/stop limit the read to a byte range of the body, both must sit on line boundaries (stop=None reads to the end).
+    ids is passed to parse_block. index (time_index.TimeIndexBuilder) collects the time index of the frames read.
+'''
+def iter_asc_blocks(filename, block_size=BLOCK_SIZE, start=None, stop=None, ids=None, index=None):
+    with open(filename, 'rb') as file:
+        start_time, _ = read_header(file)
+        if start is not None:
+            file.seek(start)
+        remaining = None if stop is None else stop - file.tell()
+        # File offset of the first byte of tail
+        offset = begin = file.tell()
+        tail = b''
+        buf = bytearray()
+        while remaining is None or remaining > 0:
+            size = block_size if remaining is None else min(block_size, remaining)
+            if len(buf) < len(tail) + size:
+                # Room for a tail of up to a quarter block, so the buffer is allocated once
+                buf = bytearray(len(tail) + size + size // 4)
+            # The block is read in after the tail of the last one, the frames parsed from the buffer do not refer to it
+            buf[:len(tail)] = tail
+            size = file.readinto(memoryview(buf)[len(tail):len(tail) + size])
+            if not size:
+                break
+            if remaining is not None:
+                remaining -= size
+            end = len(tail) + size
+            cut = buf.rfind(b'\n', 0, end) + 1
+            tail = bytes(buf[cut:end])
+            if instrumentation.ENABLED:
+                instrumentation.add_text(buf.count(b'\n', 0, cut), cut)
+            if cut:
+                yield _parse_indexed(memoryview(buf)[:cut], offset, begin, start_time, ids, index)
+            offset += cut
+        if tail:
+            if instrumentation.ENABLED:
+                instrumentation.add_text(1, len(tail))
+            yield _parse_indexed(tail, offset, begin, start_time, ids, index)
+
+# parse_block of the bytes at offset in the file, adding its frames to index (the read started at begin)
+def _parse_indexed(buf, offset, begin, start_time, ids, index):
+    if index is None:
+        return parse_block(buf, start_time, ids)
+    frames, positions = parse_block(buf, start_time, ids, positions=True)
+    if ids is None:
+        index.add(frames.time, positions + offset)
+    else:
+        index.add_filtered(frames.time, positions + offset, begin)
+    return frames
+
+'''
+    Splits the body of an .asc file (everything after the header) into count byte ranges that start and end on line boundaries.
+    Output: [(start, stop), ...]
+'''
+def split_ranges(filename, count):
+    with open(filename, 'rb') as file:
+        read_header(file)
+        body = file.tell()
+        size = os.fstat(file.fileno()).st_size
+        bounds = [body]
+        for i in range(1, count):
+            offset = body + (size - body) * i // count
+            if offset <= bounds[-1]:
+                continue
+            file.seek(offset - 1)
+            # Move forward to the start of the next line
+            file.readline()
+            if file.tell() >= size:
+                break
+            if file.tell() > bounds[-1]:
+                bounds.append(file.tell())
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+'''
+    collect=True also returns the instrumentation counters of the worker process,
+    every (seconds) the time index entries of the range, as (frames, counters, entries).
+'''
+def _read_range(filename, start, stop, block_size, ids, collect=False, every=None):
+    if not collect and every is None:
+        return FrameTable.concat(iter_asc_blocks(filename, block_size, start, stop, ids))
+    if collect:
+        instrumentation.enable()
+    index = None if every is None else TimeIndexBuilder(every)
+    frames = FrameTable.concat(iter_asc_blocks(filename, block_size, start, stop, ids, index))
+    return (frames, instrumentation.METRICS.counts() if collect else None,
+            index.entries() if index is not None else None)
+
+'''
+    Parallel version of iter_asc_blocks.
+    The body is cut at line boundaries into ranges of about RANGE_SIZE bytes (at least one per worker) that are tokenized in a process pool.
+    At most 2 * workers ranges are in flight and their tables are yielded in file order, so memory stays bounded whatever the file size.
+    On Windows the caller needs the usual if __name__ == '__main__': guard for multiprocessing.
+    index (time_index.TimeIndexBuilder) collects the time index, every worker indexes its range and the entries are merged in file order.
+'''
+def iter_asc_parallel(filename, workers=None, block_size=BLOCK_SIZE, ids=None, index=None):
+    workers = workers or os.cpu_count() or 1
+    ranges = split_ranges(filename, max(workers, os.path.getsize(filename) // RANGE_SIZE))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        collect = instrumentation.ENABLED
+        every = None if index is None else index.every
+        for start, stop in ranges:
+            pending.append(pool.submit(_read_range, filename, start, stop, block_size, ids, collect, every))
+            if len(pending) >= 2 * workers:
+                yield _range_result(pending.popleft().result(), collect, index)
+        while pending:
+            yield _range_result(pending.popleft().result(), collect, index)
+
+def _range_result(result, collect, index):
+    if not collect and index is None:
+        return result
+    frames, counts, entries = result
+    if collect:
+        instrumentation.METRICS.merge(counts)
+    if index is not None:
+        index.extend(*entries)
+    return frames
+
+'''
+    Parallel mode of read_asc, see iter_asc_parallel.
+    Ranges come back in file order and are merged into timestamp order, so the trip/engine logic that runs over the
+    merged table afterwards sees exactly the sequence a single-threaded read gives, and its state is never split at a range boundary.
+'''
+def read_asc_parallel(filename, workers=None, block_size=BLOCK_SIZE, ids=None, index=None):
+    with open(filename, 'rb') as file:
+        start_time, _ = read_header(file)
+    frames = FrameTable.concat(iter_asc_parallel(filename, workers, block_size, ids, index), start_time)
+    return sort_by_time(frames)
+
+# Stable sort into timestamp order, no copy if the table already is
+def sort_by_time(frames):
+    if len(frames) < 2 or np.all(frames.time[1:] >= frames.time[:-1]):
+        return frames
+    return frames.take(np.argsort(frames.time, kind='stable'))
+
+'''
+    Streaming version of sort_by_time over the tables of iter_asc_parallel.
+    Every table is held back until the next one arrives, the held rows up to the next table's earliest timestamp are yielded
+    in timestamp order and the rest is merged (stable) with the next table. Gives the same rows as sort_by_time over the
+    concatenated tables as long as no frame is earlier than the first timestamp of the range before its own, i.e. timestamps
+    are out of order across at most one range boundary. Memory: about two tables.
+'''
+def iter_by_time(tables):
+    held = None
+    for table in tables:
+        if len(table) == 0:
+            continue
+        if held is None:
+            held = sort_by_time(table)
+            continue
+        cut = int(np.searchsorted(held.time, table.time.min(), side='right'))
+        if cut == len(held):
+            # In order, the usual case
+            yield held
+            held = sort_by_time(table)
+            continue
+        if cut:
+            yield held.take(slice(0, cut))
+        held = sort_by_time(FrameTable.concat([held.take(slice(cut, None)), table]))
+    if held is not None:
+        yield held
+
+'''
+    Reads a whole .asc file into one FrameTable.
+    workers > 1 decodes the file in a process pool (read_asc_parallel), ids keeps only those arbitration IDs (parse_block),
+    index (time_index.TimeIndexBuilder) collects the time index on the way.
+'''
+def read_asc(filename, block_size=BLOCK_SIZE, workers=None, ids=None, index=None):
+    if workers is not None and workers > 1:
+        return read_asc_parallel(filename, workers, block_size, ids, index)
+    with open(filename, 'rb') as file:
+        start_time, _ = read_header(file)
+    return FrameTable.concat(iter_asc_blocks(filename, block_size, ids=ids, index=index), start_time)
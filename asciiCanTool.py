@@ -0,0 +1,98 @@
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from asc_parser import BLOCK_SIZE
+from asc_parser import HEADER_LINES
+from asc_parser import RANGE_SIZE
+from asc_parser import filter_block
+from asc_parser import read_asc
+from asc_parser import split_ranges
+
+'''
+    Trimmer for raw .asc logs.
+    Keeps the header and the frames of a few IDs (and channels) of a large log, e.g. the speed and engine messages of a 5 GB trace.
+    Lines are filtered on their raw bytes, only the ID and channel tokens are read (asc_parser.filter_block), and the output is
+    written block by block while the input is read, so memory stays at one block per process. Filtering is CPU bound at
+    100-150 MB/s per core, workers > 1 filters byte ranges of the log on that many processes so trimming keeps up with the disk.
+    When the trimmed log is only parsed afterwards, read_trimmed (or parse_file / save_to_csv, which drop the other IDs while
+    parsing) gives the frames without writing a trimmed copy.
+    Usage: python asciiCanTool.py raw.asc --ids 0x100 0x200 [--channels 1] [--output OUTPUT.asc]
+'''
+
+# Default output file, the one read_from_raw_asc used to expect
+OUTPUT = "OUTPUT.asc"
+
+# Filtered blocks of file from its current position to stop (None: the end), stop on a line boundary
+def _filtered(file, stop, ids, channels, block_size):
+    remaining = None if stop is None else stop - file.tell()
+    tail = b''
+    while remaining is None or remaining > 0:
+        chunk = file.read(block_size if remaining is None else min(block_size, remaining))
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        buf = tail + chunk
+        cut = buf.rfind(b'\n') + 1
+        tail = buf[cut:]
+        if cut:
+            yield filter_block(buf[:cut], ids, channels)
+    if tail:
+        yield filter_block(tail, ids, channels)
+
+# Worker side of trim, the kept lines of one byte range
+def _trim_range(filename, start, stop, ids, channels, block_size):
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        return b''.join(_filtered(file, stop, ids, channels, block_size))
+
+'''
+    Writes the header and the lines of filename with an ID in ids (and a channel in channels) to output, returns output.
+    ids / channels are lists of integers, None keeps every ID / channel.
+    Non frame lines without a timestamp (Begin/End Triggerblock, comments) are kept too, error frames and events are dropped.
+    workers > 1 filters ranges of about RANGE_SIZE bytes in a process pool, at most 2 * workers in flight, written in file order.
+'''
+def trim(filename, ids, channels=None, output=OUTPUT, block_size=BLOCK_SIZE, workers=None):
+    ids = None if ids is None else np.asarray(ids, np.int64)
+    channels = None if channels is None else np.asarray(channels, np.int64)
+    with open(filename, 'rb') as src, open(output, 'wb') as out:
+        # Header lines go through as they are
+        out.write(b''.join(src.readline() for _ in range(HEADER_LINES)))
+        if workers is None or workers <= 1:
+            for block in _filtered(src, None, ids, channels, block_size):
+                out.write(block)
+            return output
+        ranges = split_ranges(filename, max(workers, os.path.getsize(filename) // RANGE_SIZE))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for start, stop in ranges:
+                pending.append(pool.submit(_trim_range, filename, start, stop, ids, channels, block_size))
+                if len(pending) >= 2 * workers:
+                    out.write(pending.popleft().result())
+            while pending:
+                out.write(pending.popleft().result())
+    return output
+
+# The FrameTable trim + read_asc would give, without the intermediate file
+def read_trimmed(filename, ids, channels=None, workers=None):
+    frames = read_asc(filename, workers=workers, ids=None if ids is None else np.asarray(ids, np.uint32))
+    if channels is None:
+        return frames
+    return frames.take(np.isin(frames.channel, channels))
+
+def main():
+    parser = argparse.ArgumentParser(description="Keeps only the frames of some IDs / channels of an .asc log")
+    parser.add_argument('filename')
+    parser.add_argument('--ids', nargs='+', required=True, help="arbitration IDs to keep, hex (0x100) or decimal")
+    parser.add_argument('--channels', nargs='+', type=int, help="channels to keep (default: all)")
+    parser.add_argument('--output', default=OUTPUT)
+    parser.add_argument('--workers', type=int, default=None, help="filter on that many processes")
+    args = parser.parse_args()
+    trim(args.filename, [int(id, 0) for id in args.ids], args.channels, args.output, workers=args.workers)
+
+if __name__ == '__main__':
+    main()
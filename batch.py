@@ -0,0 +1,219 @@
+import argparse
+import glob
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+import driving_info_speed
+from accel_dist import ACCEL_BINS
+from accel_dist import trips_distribution
+
+'''
+    Batch analysis of many logs at once.
+    Every log of a directory (or glob) is analyzed in a process pool, one log per task, and the per-log results are merged into
+    fleet totals: files, trips, speed samples, driving time, speed histogram and acceleration distributions (accel_dist.py).
+    FleetStats.merge only adds counts, so the totals do not depend on the order or grouping the results come back in.
+    Memory: a worker holds one log at a time and only its speed/engine frames (split_trips reads those IDs only),
+    at most 2 * workers logs are queued.
+    A manifest (JSON lines, one entry per analyzed log) records the key (size, mtime) and the result of every log, logs
+    whose key did not change are not analyzed again and their recorded results are merged into the totals.
+    Usage: python batch.py logs/ --dbc vehicle.dbc --workers 8 --manifest logs/manifest.jsonl --output fleet.json
+'''
+
+# Speed histogram edges (speed units), counts[i] holds SPEED_BINS[i - 1] <= speed < SPEED_BINS[i]
+SPEED_BINS = tuple(range(5, 165, 5))
+# Log extensions picked up from a directory
+EXTENSIONS = ('.asc', '.blf')
+
+
+class FleetStats:
+    def __init__(self):
+        self.files = 0
+        self.failed = 0
+        self.trips = 0
+        self.samples = 0
+        self.seconds = 0.0
+        self.speed = np.zeros(len(SPEED_BINS) + 1, np.int64)
+        self.accel_mph = np.zeros(len(ACCEL_BINS) + 1, np.int64)
+        self.accel_kph = np.zeros(len(ACCEL_BINS) + 1, np.int64)
+
+    # Adds other into this one, returns self
+    def merge(self, other):
+        self.files += other.files
+        self.failed += other.failed
+        self.trips += other.trips
+        self.samples += other.samples
+        self.seconds += other.seconds
+        self.speed += other.speed
+        self.accel_mph += other.accel_mph
+        self.accel_kph += other.accel_kph
+        return self
+
+    def to_dict(self):
+        return {
+            'files': self.files,
+            'failed': self.failed,
+            'trips': self.trips,
+            'samples': self.samples,
+            'seconds': self.seconds,
+            'speed': self.speed.tolist(),
+            'accel_mph': self.accel_mph.tolist(),
+            'accel_kph': self.accel_kph.tolist()
+        }
+
+    @staticmethod
+    def from_dict(values):
+        stats = FleetStats()
+        for name, value in values.items():
+            if isinstance(getattr(stats, name), np.ndarray):
+                value = np.asarray(value, np.int64)
+            setattr(stats, name, value)
+        return stats
+
+    @staticmethod
+    def total(results):
+        stats = FleetStats()
+        for result in results:
+            stats.merge(result)
+        return stats
+
+'''
+    Analysis of one log, what a worker runs, raises RuntimeError for a log without speed / engine frames.
+    export_dir also writes its trips there as CSV (save_to_csv, <log name>_<trip>.csv).
+'''
+def analyze_file(filename, export_dir=None, use_cache=False):
+    frames, trips = driving_info_speed.split_trips(filename, use_cache=use_cache)
+    if len(frames) == 0:
+        # Not a log, or one without any speed / engine frame, reported as failed rather than as 0 trips
+        raise RuntimeError("No speed or engine frames in " + filename)
+    speeds = driving_info_speed.trip_speeds(frames, trips)
+    stats = FleetStats()
+    stats.files = 1
+    # Trips without a frame (the one before the first engine on) are not counted
+    stats.trips = int(np.sum(trips[:, 1] > trips[:, 0])) if len(trips) else 0
+    for delta, values in speeds:
+        stats.samples += len(values)
+        stats.seconds += float(np.sum(delta[1:])) / 1000
+        stats.speed += np.bincount(np.searchsorted(SPEED_BINS, values, side='right'), minlength=len(SPEED_BINS) + 1)
+    mph, kph = trips_distribution(speeds, driving_info_speed.KPH_TO_MPH)
+    stats.accel_mph += mph
+    stats.accel_kph += kph
+    if export_dir is not None:
+        prefix = os.path.join(export_dir, os.path.splitext(os.path.basename(filename))[0] + '_')
+        driving_info_speed.save_to_csv(filename, use_cache=use_cache, prefix=prefix)
+    return stats
+
+# Worker side of run_batch, a failing log is reported instead of stopping the batch
+def _analyze(filename, export_dir, use_cache):
+    try:
+        return analyze_file(filename, export_dir, use_cache).to_dict(), None
+    except Exception as error:
+        return None, type(error).__name__ + ": " + str(error)
+
+def _init_worker(dbc, names):
+    if dbc is not None:
+        driving_info_speed.use_dbc(dbc, names)
+
+# Logs of a directory (EXTENSIONS, sorted) or of a glob pattern (** matches subdirectories)
+def log_files(pattern):
+    if os.path.isdir(pattern):
+        names = sorted(os.listdir(pattern))
+        return [os.path.join(pattern, name) for name in names if os.path.splitext(name)[1].lower() in EXTENSIONS]
+    return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+# What decides whether a log has to be analyzed again
+def file_key(filename):
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+# Manifest entries by absolute path, the last entry of a path wins
+def read_manifest(path):
+    entries = {}
+    if path is None or not os.path.exists(path):
+        return entries
+    with open(path) as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Line cut short by an interrupted run
+                continue
+            entries[entry['path']] = entry
+    return entries
+
+'''
+    Analyzes every log of pattern (directory or glob) on workers processes and returns the fleet totals (FleetStats).
+    dbc/names are loaded in every worker (driving_info_speed.use_dbc) before the first log.
+    manifest (path of a JSON lines file) skips logs already analyzed with the same key and records the new ones as they finish,
+    so an interrupted batch continues where it stopped. Logs that failed are retried on the next run.
+    export_dir and use_cache are passed to analyze_file, log=True prints a line per log.
+'''
+def run_batch(pattern, workers=None, dbc=None, names=None, manifest=None, export_dir=None, use_cache=False, log=True):
+    workers = workers or os.cpu_count() or 1
+    files = [os.path.abspath(path) for path in log_files(pattern)]
+    done = read_manifest(manifest)
+    results = []
+    todo = []
+    for path in files:
+        entry = done.get(path)
+        if entry is not None and entry.get('stats') is not None and entry['key'] == file_key(path):
+            results.append(FleetStats.from_dict(entry['stats']))
+        else:
+            todo.append(path)
+    if log:
+        print(str(len(files)) + " logs, " + str(len(files) - len(todo)) + " already in the manifest")
+    if export_dir is not None:
+        os.makedirs(export_dir, exist_ok=True)
+    out = open(manifest, 'a') if manifest is not None else None
+    start = perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(dbc, names)) as pool:
+            pending = deque()
+            queue = deque(todo)
+            while queue or pending:
+                while queue and len(pending) < 2 * workers:
+                    path = queue.popleft()
+                    pending.append((path, file_key(path), pool.submit(_analyze, path, export_dir, use_cache)))
+                path, key, future = pending.popleft()
+                stats, error = future.result()
+                if error is None:
+                    results.append(FleetStats.from_dict(stats))
+                else:
+                    failed = FleetStats()
+                    failed.failed = 1
+                    results.append(failed)
+                if out is not None:
+                    out.write(json.dumps({'path': path, 'key': key, 'stats': stats, 'error': error}) + '\n')
+                    out.flush()
+                if log:
+                    print(path + ": " + (error if error is not None else str(stats['trips']) + " trips"))
+    finally:
+        if out is not None:
+            out.close()
+    total = FleetStats.total(results)
+    if log:
+        print("analyzed " + str(len(todo)) + " logs in " + format(perf_counter() - start, '.1f') + " s, "
+              + str(total.trips) + " trips, " + format(total.seconds / 3600, '.1f') + " h driving")
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyzes every log of a directory or glob on a process pool")
+    parser.add_argument('pattern', help="directory of .asc/.blf logs or glob pattern")
+    parser.add_argument('--dbc', help="DBC with the SIGNAL_NAMES of driving_info_speed.py")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--manifest', help="JSON lines file of analyzed logs, logs already in it are skipped")
+    parser.add_argument('--export', help="also write the trips of every log as CSV into that directory")
+    parser.add_argument('--cache', action='store_true', help="use / write the frame cache of every log")
+    parser.add_argument('--output', help="write the fleet totals there as JSON")
+    args = parser.parse_args()
+    total = run_batch(args.pattern, args.workers, args.dbc, None, args.manifest, args.export, args.cache)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(dict(total.to_dict(), speed_bins=SPEED_BINS, accel_bins=ACCEL_BINS), file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+import asc_generator
+import driving_info_speed
+import fake_canoe
+from Python_CANoe import use_backend
+from asc_parser import read_asc
+from frame_cache import load_frames
+from trip_segments import segment_trips
+
+'''
+    Benchmark suite for the analysis pipeline.
+    Generates a synthetic log (asc_generator.py), or takes an existing one, and times every stage:
+        parse       .asc text -> FrameTable (asc_parser.read_asc)
+        cache_miss  parse + cache write (frame_cache.load_frames)
+        cache_hit   the same call answered by the memory mapped cache
+        decode      DBC signal columns (driving_info_speed.decode_roles)
+        segment     engine state column + trip boundaries (trip_segments.segment_trips)
+        parse_file  frame by frame handler dispatch (process_frame path) over the cached frames
+        export      save_to_csv
+        delay       accuracy of delay() / the replay wait
+        replay      with --replay N: replay_trip of the first N speed samples against fake_canoe (no CANoe needed),
+                    lateness and COM calls/s at the given --latency per call and --speedup
+    The stages run on a link to the log in a temporary directory, so the frame cache and time index they write go there and
+    the cache / index next to the log are neither used nor touched.
+    Every stage reports seconds, lines/s, MB/s and the process peak RSS once it finished (peak so far, stages run in this order).
+    Results are printed and written as JSON so runs can be compared over time, --compare prints the throughput ratio to an older result
+    (seconds ratio for delay), so runs over different log sizes compare too.
+    Usage: python benchmark.py --lines 1000000 --output results.json [--compare old.json]
+'''
+
+# Waits measured by the delay stage
+DELAY_COUNT = 100
+DELAY_MS = 5
+
+# Peak resident set size of this process in MB, None where the resource module does not exist (Windows)
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+def count_lines(filename):
+    lines = 0
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 24), b''):
+            lines += block.count(b'\n')
+    return lines
+
+class Bench:
+    def __init__(self, lines, size):
+        self.lines = lines
+        self.size = size
+        self.stages = {}
+
+    # Times func, the stage result holds its throughput over the whole log
+    def stage(self, name, func, **extra):
+        start = perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func()
+        seconds = perf_counter() - start
+        self.stages[name] = dict({
+            'seconds': seconds,
+            'lines_per_s': self.lines / seconds if seconds else None,
+            'mb_per_s': self.size / (1 << 20) / seconds if seconds else None,
+            'peak_rss_mb': peak_rss_mb()
+        }, **extra)
+        return result
+
+def delay_stats():
+    late = []
+    for _ in range(DELAY_COUNT):
+        start = perf_counter()
+        driving_info_speed.delay(DELAY_MS)
+        late.append((perf_counter() - start) * 1000 - DELAY_MS)
+    return {'mean_late_ms': float(np.mean(late)), 'max_late_ms': float(np.max(late))}
+
+def replay_stats(frames, events, latency, speedup):
+    trips = segment_trips(driving_info_speed.engine_column(frames, True), True)
+    delta, speeds = driving_info_speed.trip_speeds(frames, trips)[0]
+    data = list(zip(delta[:events].tolist(), speeds[:events].tolist()))
+    app = fake_canoe.install(latency=latency)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            lateness = driving_info_speed.replay_trip(data, speedup)
+    finally:
+        use_backend(None)
+    com = app.stats()
+    return {'seconds': com['seconds'], 'events': len(data), 'mean_late_ms': lateness.mean() * 1000,
+            'max_late_ms': lateness.worst * 1000, 'com_calls': com['calls'], 'com_calls_per_s': com['calls_per_s']}
+
+# Link (copy where links are not allowed) of filename in directory
+def _link(filename, directory):
+    path = os.path.join(directory, os.path.basename(filename))
+    try:
+        os.symlink(os.path.abspath(filename), path)
+    except OSError:
+        shutil.copyfile(filename, path)
+    return path
+
+def run(filename, dbc, workers=None, export=True, replay=0, latency=0.0, speedup=1.0):
+    if dbc is not None:
+        driving_info_speed.use_dbc(dbc, asc_generator.BENCH_SIGNALS)
+    work = tempfile.mkdtemp()
+    try:
+        return _run(filename, _link(filename, work), workers, export, replay, latency, speedup)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+# run() on link, a link to filename in an empty directory, so the cache stage starts with a miss
+def _run(filename, link, workers, export, replay, latency, speedup):
+    bench = Bench(count_lines(link), os.path.getsize(link))
+
+    frames = bench.stage('parse', lambda: read_asc(link, workers=workers))
+    bench.stage('cache_miss', lambda: load_frames(link, workers))
+    bench.stage('cache_hit', lambda: load_frames(link, workers))
+    bench.stage('decode', lambda: driving_info_speed.decode_roles(frames))
+    initial = driving_info_speed.engine_status(driving_info_speed.FrameState())
+    bench.stage('segment', lambda: segment_trips(driving_info_speed.engine_column(frames, initial), initial))
+    bench.stage('parse_file', lambda: driving_info_speed.parse_file(link, workers))
+    if export:
+        directory = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        path = os.path.abspath(link)
+        try:
+            os.chdir(directory)
+            bench.stage('export', lambda: driving_info_speed.save_to_csv(path, workers))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory, ignore_errors=True)
+    start = perf_counter()
+    bench.stages['delay'] = dict(delay_stats(), seconds=perf_counter() - start)
+    if replay:
+        bench.stages['replay'] = replay_stats(frames, replay, latency, speedup)
+    return {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'log': {'filename': filename, 'lines': bench.lines, 'bytes': bench.size, 'frames': len(frames)},
+        'workers': workers,
+        'stages': bench.stages
+    }
+
+def report(results, previous=None):
+    print("log: " + str(results['log']['lines']) + " lines, " + format(results['log']['bytes'] / (1 << 20), '.1f') + " MB")
+    for name, stage in results['stages'].items():
+        line = "%-11s %8.3f s" % (name, stage['seconds'])
+        if stage.get('lines_per_s'):
+            line += "  %12.0f lines/s  %8.1f MB/s" % (stage['lines_per_s'], stage['mb_per_s'])
+        if stage.get('peak_rss_mb') is not None:
+            line += "  peak %7.1f MB" % stage['peak_rss_mb']
+        if 'mean_late_ms' in stage:
+            line += "  late mean %.3f ms max %.3f ms" % (stage['mean_late_ms'], stage['max_late_ms'])
+        if 'com_calls_per_s' in stage:
+            line += "  %d COM calls, %.0f calls/s" % (stage['com_calls'], stage['com_calls_per_s'])
+        old = previous['stages'].get(name) if previous is not None else None
+        if old is not None and stage.get('lines_per_s') and old.get('lines_per_s'):
+            line += "  x%.2f vs previous" % (stage['lines_per_s'] / old['lines_per_s'])
+        elif old is not None and stage['seconds']:
+            line += "  x%.2f vs previous" % (old['seconds'] / stage['seconds'])
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the parse / decode / segment / export pipeline")
+    parser.add_argument('--log', help="existing .asc log (default: generate one)")
+    parser.add_argument('--dbc', help="DBC of --log with the asc_generator.BENCH_SIGNALS roles")
+    parser.add_argument('--lines', type=int, default=1000000, help="frames of the generated log")
+    parser.add_argument('--trips', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-export', action='store_true', help="skip the save_to_csv stage")
+    parser.add_argument('--replay', type=int, default=0, help="replay that many speed samples against the fake CANoe")
+    parser.add_argument('--latency', type=float, default=0.0002, help="fake CANoe seconds per COM call")
+    parser.add_argument('--speedup', type=float, default=1.0, help="replay speed, times real time")
+    parser.add_argument('--output', help="write the results there as JSON")
+    parser.add_argument('--compare', help="earlier JSON results to compare with")
+    args = parser.parse_args()
+
+    directory = None
+    filename, dbc = args.log, args.dbc
+    if filename is None:
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'bench.asc')
+        dbc = os.path.join(directory, 'bench.dbc')
+        start = perf_counter()
+        asc_generator.generate_asc(filename, args.lines, args.trips)
+        asc_generator.write_dbc(dbc)
+        print("generated " + filename + " in " + format(perf_counter() - start, '.1f') + " s")
+    try:
+        results = run(filename, dbc, args.workers, not args.no_export, args.replay, args.latency, args.speedup)
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+    report(results, previous)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import datetime
+import struct
+import zlib
+
+import numpy as np
+
+import instrumentation
+from asc_parser import PAYLOAD_WIDTH
+from asc_parser import FrameTable
+
+'''
+    Streaming reader for Vector BLF (binary logging format) files.
+    Reads the file header, then every LOBJ object. Log containers (zlib compressed or stored) are inflated one at a time and the
+    objects inside are decoded into FrameTable batches, the same columns the .asc parser gives, so process_frame and everything
+    built on FrameTable works directly on .blf logs without the CANoe offline -> .asc export.
+    Classic CAN messages (CAN_MESSAGE, CAN_MESSAGE2) are decoded, every other object type is skipped.
+'''
+
+FILE_HEADER = struct.Struct('<4sLBBBBBBBBQQLL8H8H')
+OBJ_HEADER_BASE = struct.Struct('<4sHHLL')
+LOG_CONTAINER = struct.Struct('<H6xL4x')
+
+CAN_MESSAGE = 1
+LOG_CONTAINER_TYPE = 10
+CAN_MESSAGE2 = 86
+
+NO_COMPRESSION = 0
+ZLIB_DEFLATE = 2
+
+# Object header flags, timestamp unit
+TIME_TEN_MICS = 0x1
+TIME_ONE_NANS = 0x2
+
+# CAN message flags / ID bits
+CAN_DIR_TX = 0x1
+CAN_REMOTE = 0x80
+CAN_EXTENDED = 0x80000000
+
+# Rows collected before a FrameTable is yielded
+BATCH_ROWS = 1 << 18
+
+# Byte offsets inside a CAN object: object flags and timestamp are at the same place in v1 and v2 headers,
+# the message itself starts at header_size
+_OBJ_FLAGS = 16
+_OBJ_TIMESTAMP = 24
+_MSG_CHANNEL = 0
+_MSG_FLAGS = 2
+_MSG_DLC = 3
+_MSG_ID = 4
+_MSG_DATA = 8
+_MSG_SIZE = 16
+
+def _systemtime(fields):
+    year, month, _, day, hour, minute, second, millisecond = fields
+    try:
+        return datetime.datetime(year, month, day, hour, minute, second, millisecond * 1000)
+    except ValueError:
+        return None
+
+# Reads the file header, returns (measurement start time, header size)
+def read_blf_header(file):
+    header = file.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size or header[:4] != b'LOGG':
+        raise ValueError("Not a BLF file")
+    fields = FILE_HEADER.unpack(header)
+    header_size = fields[1]
+    return _systemtime(fields[14:22]), header_size
+
+# Little endian unsigned values of width bytes at every offset
+def _field(a, offsets, width, dtype):
+    raw = a[offsets[:, None] + np.arange(width)]
+    return np.ascontiguousarray(raw).view(dtype).ravel()
+
+'''
+    Decodes the CAN messages of a buffer of inflated objects.
+    Walks the object chain and returns (FrameTable, bytes not consumed), an object cut at the end of the buffer is left for the next container.
+'''
+def _parse_objects(data, start_time):
+    offsets = []
+    header_sizes = []
+    pos = 0
+    end = len(data)
+    while pos + OBJ_HEADER_BASE.size <= end:
+        signature, header_size, _, obj_size, obj_type = OBJ_HEADER_BASE.unpack_from(data, pos)
+        if signature != b'LOBJ':
+            # Objects are padded, the next one starts within a few bytes
+            pos = data.find(b'LOBJ', pos, pos + 8)
+            if pos < 0:
+                raise ValueError("BLF object chain is broken")
+            continue
+        if pos + obj_size > end:
+            break
+        if (obj_type == CAN_MESSAGE or obj_type == CAN_MESSAGE2) and header_size + _MSG_SIZE <= obj_size:
+            offsets.append(pos)
+            header_sizes.append(header_size)
+        pos += obj_size
+    rest = data[pos:]
+    if not offsets:
+        return FrameTable.empty(start_time), rest
+
+    a = np.frombuffer(data, np.uint8)
+    offsets = np.array(offsets, np.int64)
+    message = offsets + np.array(header_sizes, np.int64)
+    flags = _field(a, offsets + _OBJ_FLAGS, 4, '<u4')
+    ticks = _field(a, offsets + _OBJ_TIMESTAMP, 8, '<u8')
+    time = np.where(flags & TIME_ONE_NANS, ticks * 1e-9, ticks * 1e-5)
+    channel = _field(a, message + _MSG_CHANNEL, 2, '<u2')
+    msg_flags = a[message + _MSG_FLAGS]
+    dlc = np.minimum(a[message + _MSG_DLC], PAYLOAD_WIDTH)
+    id = _field(a, message + _MSG_ID, 4, '<u4') & ~np.uint32(CAN_EXTENDED)
+    payload = a[message[:, None] + _MSG_DATA + np.arange(PAYLOAD_WIDTH)]
+    # Remote frames carry no data, bytes past dlc are 0 like in the .asc parser
+    payload = np.where(np.arange(PAYLOAD_WIDTH) < np.where(msg_flags & CAN_REMOTE, 0, dlc)[:, None], payload, 0).astype(np.uint8)
+    direction = (msg_flags & CAN_DIR_TX).astype(np.uint8)
+    return FrameTable(time, channel.astype(np.uint8), id.astype(np.uint32), direction, dlc.astype(np.uint8), payload, start_time), rest
+
+'''
+    Reads a .blf file container by container and yields FrameTables of about BATCH_ROWS rows.
+    Only one inflated container plus the pending batch is held in memory.
+'''
+def iter_blf_blocks(filename):
+    with open(filename, 'rb') as file:
+        start_time, header_size = read_blf_header(file)
+        file.seek(header_size)
+        pending = b''
+        batch = []
+        rows = 0
+        while True:
+            base = file.read(OBJ_HEADER_BASE.size)
+            if len(base) < OBJ_HEADER_BASE.size:
+                break
+            signature, _, _, obj_size, obj_type = OBJ_HEADER_BASE.unpack(base)
+            if signature != b'LOBJ':
+                raise ValueError("BLF object chain is broken at offset " + str(file.tell() - len(base)))
+            body = file.read(obj_size - OBJ_HEADER_BASE.size)
+            # Skip padding
+            file.read(obj_size % 4)
+            if obj_type == LOG_CONTAINER_TYPE:
+                method, _ = LOG_CONTAINER.unpack_from(body)
+                content = body[LOG_CONTAINER.size:]
+                if method == ZLIB_DEFLATE:
+                    content = zlib.decompress(content)
+                elif method != NO_COMPRESSION:
+                    raise ValueError("Unknown BLF compression method " + str(method))
+            else:
+                # Objects written outside of containers
+                content = base + body
+            if instrumentation.ENABLED:
+                instrumentation.add_text(0, obj_size)
+            frames, pending = _parse_objects(pending + content, start_time)
+            if len(frames):
+                batch.append(frames)
+                rows += len(frames)
+            if rows >= BATCH_ROWS:
+                yield FrameTable.concat(batch, start_time)
+                batch = []
+                rows = 0
+        if batch:
+            yield FrameTable.concat(batch, start_time)
+
+# Reads a whole .blf file into one FrameTable
+def read_blf(filename):
+    with open(filename, 'rb') as file:
+        start_time, _ = read_blf_header(file)
+    return FrameTable.concat(iter_blf_blocks(filename), start_time)
@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+
+'''
+    Columnar export of decoded signals, used by save_to_columns.
+    Every writer takes batches of named columns (numpy arrays of equal length) and writes them every batch_rows rows,
+    so memory stays at one batch for any log length and readers can load only the columns they need:
+        NpyWriter       a directory with one .npy file per column (numpy only, np.load(mmap_mode='r') maps a single column)
+        ParquetWriter   one Parquet file, one row group per batch, zstd compressed (pip install pyarrow)
+        ArrowWriter     one Arrow IPC (Feather v2) file, one record batch per batch, zstd compressed (pip install pyarrow)
+    Columns are fixed by the first batch, later batches must have the same names and dtypes.
+'''
+
+# Rows per written batch / row group
+BATCH_ROWS = 1 << 20
+# Header bytes reserved in a .npy file, rewritten with the final shape on close
+NPY_HEADER = 128
+COMPRESSION = 'zstd'
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("Parquet / Arrow export needs pyarrow: pip install pyarrow, or use format='npy'")
+    return pyarrow
+
+
+class ColumnWriter:
+    def __init__(self, path, batch_rows=BATCH_ROWS):
+        self.path = path
+        self.batch_rows = batch_rows
+        self.rows = 0
+        self.names = None
+        self.buffered = []
+        self.buffered_rows = 0
+
+    # Adds a batch {name: column}, written once batch_rows rows are buffered
+    def add(self, columns):
+        if self.names is None:
+            self.open({name: np.asarray(column).dtype for name, column in columns.items()})
+            self.names = list(columns)
+        length = len(next(iter(columns.values()))) if columns else 0
+        if length == 0:
+            return
+        self.buffered.append(columns)
+        self.buffered_rows += length
+        if self.buffered_rows >= self.batch_rows:
+            self.flush(self.batch_rows)
+
+    # Writes the buffered rows in batches of size rows (all of them in one batch by default), keeps the rest buffered
+    def flush(self, size=None):
+        if not self.buffered:
+            return
+        columns = {name: np.concatenate([np.asarray(batch[name]) for batch in self.buffered]) for name in self.names}
+        size = size or self.buffered_rows
+        start = 0
+        while self.buffered_rows - start >= size:
+            self.write({name: column[start:start + size] for name, column in columns.items()})
+            start += size
+        self.rows += start
+        self.buffered_rows -= start
+        self.buffered = [{name: column[start:] for name, column in columns.items()}] if self.buffered_rows else []
+
+    def close(self):
+        if self.names is not None:
+            self.flush()
+            self.finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NpyWriter(ColumnWriter):
+    def open(self, dtypes):
+        os.makedirs(self.path, exist_ok=True)
+        self.dtypes = dtypes
+        self.files = {}
+        for name, dtype in dtypes.items():
+            file = open(os.path.join(self.path, name + '.npy'), 'wb')
+            file.write(self._header(dtype, 0))
+            self.files[name] = file
+
+    # .npy version 1.0 header, padded with spaces to NPY_HEADER bytes so the final one fits in the same place
+    @staticmethod
+    def _header(dtype, rows):
+        text = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (rows,)})
+        text = text.encode('latin1')
+        text += b' ' * (NPY_HEADER - 10 - len(text) - 1) + b'\n'
+        return b'\x93NUMPY\x01\x00' + np.uint16(len(text)).tobytes() + text
+
+    def write(self, columns):
+        for name, column in columns.items():
+            self.files[name].write(np.ascontiguousarray(column, self.dtypes[name]).tobytes())
+
+    def finish(self):
+        for name, file in self.files.items():
+            file.seek(0)
+            file.write(self._header(self.dtypes[name], self.rows))
+            file.close()
+
+
+class ParquetWriter(ColumnWriter):
+    def open(self, dtypes):
+        pa = _pyarrow()
+        import pyarrow.parquet as pq
+        self.schema = pa.schema([(name, pa.from_numpy_dtype(dtype)) for name, dtype in dtypes.items()])
+        self.writer = pq.ParquetWriter(self.path, self.schema, compression=COMPRESSION)
+
+    def write(self, columns):
+        pa = _pyarrow()
+        table = pa.Table.from_arrays([pa.array(columns[name]) for name in self.names], schema=self.schema)
+        self.writer.write_table(table, row_group_size=len(table))
+
+    def finish(self):
+        self.writer.close()
+
+
+class ArrowWriter(ColumnWriter):
+    def open(self, dtypes):
+        pa = _pyarrow()
+        self.schema = pa.schema([(name, pa.from_numpy_dtype(dtype)) for name, dtype in dtypes.items()])
+        self.sink = pa.OSFile(self.path, 'wb')
+        self.writer = pa.ipc.new_file(self.sink, self.schema, options=pa.ipc.IpcWriteOptions(compression=COMPRESSION))
+
+    def write(self, columns):
+        pa = _pyarrow()
+        self.writer.write_batch(pa.record_batch([pa.array(columns[name]) for name in self.names], schema=self.schema))
+
+    def finish(self):
+        self.writer.close()
+        self.sink.close()
+
+
+WRITERS = {'npy': NpyWriter, 'parquet': ParquetWriter, 'arrow': ArrowWriter}
+
+def column_writer(path, format='parquet', batch_rows=BATCH_ROWS):
+    writer = WRITERS.get(format)
+    if writer is None:
+        raise RuntimeError("Unknown column format " + str(format) + ", expected one of " + ", ".join(WRITERS))
+    if writer is not NpyWriter:
+        # Fails before the log is read
+        _pyarrow()
+    return writer(path, batch_rows)
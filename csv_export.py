@@ -0,0 +1,81 @@
+import numpy as np
+
+'''
+    Streaming per-trip CSV export used by save_to_csv.
+    Rows are buffered as (offset ms, speed) numbers and written in batches. Each batch formats its absolute timestamps with one
+    numpy datetime64 conversion from the measurement start time instead of a datetime + strftime per row.
+    A trip file is closed as soon as the next trip starts, so memory and open files stay constant for any log length.
+'''
+
+# Rows buffered before they are formatted and written
+BATCH_ROWS = 1 << 16
+# File buffer size
+BUFFER_SIZE = 1 << 20
+
+'''
+    Absolute timestamps for offsets from the measurement start, truncated to ms like strftime('%Y-%m-%d %H:%M:%S.%f')[:-3].
+    Input: datetime(2020, 1, 15, 10, 30, 1, 87000), array([100, 300])
+    Output: ['2020-01-15 10:30:01.187', '2020-01-15 10:30:01.387']
+'''
+def format_timestamps(start_time, offsets_ms):
+    stamps = np.datetime64(start_time, 'us') + np.asarray(offsets_ms, np.int64).astype('timedelta64[ms]')
+    return [stamp.replace('T', ' ') for stamp in np.datetime_as_string(stamps, unit='ms').tolist()]
+
+
+class TripCsvWriter:
+    def __init__(self, start_time, prefix="save_to_mph_", batch_rows=BATCH_ROWS):
+        self.start_time = start_time
+        self.prefix = prefix
+        self.batch_rows = batch_rows
+        # Trip the open file belongs to, -1 before the first row
+        self.trip = -1
+        self.file = None
+        self.offsets = []
+        self.speeds = []
+
+    def filename(self, trip):
+        return self.prefix + str(trip) + ".csv"
+
+    # Adds one row to trip, trips only move forward
+    def add(self, trip, offset_ms, speed):
+        if trip != self.trip:
+            self.open(trip)
+        self.offsets.append(offset_ms)
+        self.speeds.append(speed)
+        if len(self.offsets) >= self.batch_rows:
+            self.flush()
+
+    def open(self, trip):
+        self.close_file()
+        # Trips without speed rows still get their (empty) file
+        for skipped in range(self.trip + 1, trip):
+            open(self.filename(skipped), "w").close()
+        self.file = open(self.filename(trip), "w", buffering=BUFFER_SIZE)
+        self.trip = trip
+
+    def flush(self):
+        if not self.offsets:
+            return
+        stamps = format_timestamps(self.start_time, self.offsets)
+        self.file.write(''.join([stamp + "," + str(speed) + "\n" for stamp, speed in zip(stamps, self.speeds)]))
+        self.offsets = []
+        self.speeds = []
+
+    def close_file(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    # Flushes and closes, trips is the total trip count so trailing trips without rows get their file too
+    def close(self, trips=0):
+        self.close_file()
+        for skipped in range(self.trip + 1, trips):
+            open(self.filename(skipped), "w").close()
+        self.trip = max(self.trip, trips - 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close_file()
@@ -0,0 +1,237 @@
+import re
+
+import numpy as np
+
+from asc_parser import PAYLOAD_WIDTH
+
+'''
+    DBC signal decoding.
+    load_dbc reads the messages (BO_), signals (SG_) and value tables (VAL_) of a DBC file.
+    Every signal is compiled once into a shift and a mask over the 8 byte payload seen as one 64 bit word
+    (little endian word for Intel signals, big endian word for Motorola signals), so decoding is:
+        raw = (word >> shift) & mask -> sign extend -> raw * factor + offset
+    Signal.decode works on a single frame, Signal.decode_column / Message.decode_columns on a whole FrameTable payload matrix.
+    A multiplexed signal (m<value>) decodes to NaN on frames whose multiplexer switch (M) holds another value.
+    Message.decode_columns builds the two 64 bit word columns once and every signal of the message is a couple of vector operations on them.
+'''
+
+_MESSAGE = re.compile(r'^BO_\s+(\d+)\s+(\w+)\s*:\s*(\d+)\s+(\w+)')
+_SIGNAL = re.compile(r'^SG_\s+(\w+)\s*(M|m\d+)?\s*:\s*(\d+)\|(\d+)@([01])([+-])\s*'
+                     r'\(([^,]+),([^)]+)\)\s*\[([^|]*)\|([^\]]*)\]\s*"([^"]*)"\s*(.*)$')
+_VALUES = re.compile(r'^VAL_\s+(\d+)\s+(\w+)\s+(.*);')
+_CHOICE = re.compile(r'(-?\d+)\s+"([^"]*)"')
+
+# Bit 31 of a DBC message ID marks an extended frame
+EXTENDED_FLAG = 0x80000000
+
+INTEL = 1
+MOTOROLA = 0
+
+_PADDING = bytes(PAYLOAD_WIDTH)
+
+
+class Signal:
+    def __init__(self, name, start, length, byte_order, signed, factor, offset,
+                 minimum=None, maximum=None, unit='', multiplex=None, receivers=None):
+        self.name = name
+        self.start = start
+        self.length = length
+        self.byte_order = byte_order
+        self.signed = signed
+        self.factor = factor
+        self.offset = offset
+        self.minimum = minimum
+        self.maximum = maximum
+        self.unit = unit
+        # None, 'M' for the multiplexer switch, or the multiplexer value this signal belongs to
+        self.multiplex = multiplex
+        self.receivers = receivers or []
+        # Switch signal of a multiplexed signal, set by Message.add_signal
+        self.switch = None
+        # raw value -> text from VAL_
+        self.choices = {}
+        # Set by Message.add_signal
+        self.message_id = None
+        self.compile()
+
+    # Precomputes the shift and mask for the 64 bit payload word
+    def compile(self):
+        if self.byte_order == INTEL:
+            self.shift = self.start
+        else:
+            # Motorola start bit is the MSB in DBC 'sawtooth' numbering, count from the MSB of byte 0 instead
+            msb = (self.start // 8) * 8 + (7 - self.start % 8)
+            self.shift = PAYLOAD_WIDTH * 8 - (msb + self.length)
+        if self.shift < 0 or self.shift + self.length > PAYLOAD_WIDTH * 8:
+            raise ValueError("Signal " + self.name + " does not fit in " + str(PAYLOAD_WIDTH) + " bytes")
+        self.mask = (1 << self.length) - 1
+        self.sign_bit = 1 << (self.length - 1)
+
+    # Raw (unscaled) value from one frame, frame is anything bytes() accepts (bytes, uint8 array, list of ints)
+    def raw(self, frame):
+        data = bytes(frame)
+        data = data + _PADDING[len(data):]
+        word = int.from_bytes(data, 'little' if self.byte_order == INTEL else 'big')
+        value = (word >> self.shift) & self.mask
+        if self.signed and value & self.sign_bit:
+            value -= self.mask + 1
+        return value
+
+    # False if the signal is multiplexed and the frame carries another multiplexer value
+    def active(self, frame):
+        return self.switch is None or self.switch.raw(frame) == self.multiplex
+
+    # Physical value from one frame, NaN if the frame does not carry the signal (multiplexer)
+    def decode(self, frame):
+        if not self.active(frame):
+            return float('nan')
+        return self.raw(frame) * self.factor + self.offset
+
+    # Raw values from the 64 bit word columns, see payload_words (int64, uint64 for unsigned 64 bit signals)
+    def raw_column(self, words):
+        word = words[0] if self.byte_order == INTEL else words[1]
+        raw = (word >> np.uint64(self.shift)) & np.uint64(self.mask)
+        if self.signed:
+            # Sign bit moved to bit 63, the arithmetic shift back extends it
+            unused = np.uint64(64 - self.length)
+            return (raw << unused).view(np.int64) >> unused.astype(np.int64)
+        return raw if self.length == 64 else raw.astype(np.int64)
+
+    # Rows of the word columns that carry the signal, see active
+    def active_column(self, words):
+        if self.switch is None:
+            return np.ones(len(words[0]), bool)
+        return self.switch.raw_column(words) == self.multiplex
+
+    # Physical values of every row of a (n, PAYLOAD_WIDTH) payload matrix, NaN on rows of other multiplexer values
+    def decode_column(self, data, words=None):
+        if words is None:
+            words = payload_words(data)
+        column = self.raw_column(words) * self.factor + self.offset
+        if self.switch is not None:
+            column = np.where(self.active_column(words), column, np.nan)
+        return column
+
+
+class Message:
+    def __init__(self, id, name, dlc, sender=None, extended=False):
+        self.id = id
+        self.name = name
+        self.dlc = dlc
+        self.sender = sender
+        self.extended = extended
+        self.signals = {}
+
+    def add_signal(self, signal):
+        signal.message_id = self.id
+        self.signals[signal.name] = signal
+        # Links multiplexed signals to the switch, whichever comes first in the DBC
+        switch = next((s for s in self.signals.values() if s.multiplex == 'M'), None)
+        for other in self.signals.values():
+            if other.multiplex is not None and other.multiplex != 'M':
+                other.switch = switch
+
+    # {signal name: physical value} of one frame
+    def decode(self, frame):
+        return {name: signal.decode(frame) for name, signal in self.signals.items()}
+
+    # {signal name: column} for a (n, PAYLOAD_WIDTH) payload matrix, names=None decodes every signal
+    def decode_columns(self, data, names=None):
+        words = payload_words(data)
+        names = self.signals.keys() if names is None else names
+        return {name: self.signals[name].decode_column(data, words) for name in names}
+
+
+class Database:
+    def __init__(self):
+        self.messages = {}
+        self.messages_by_name = {}
+
+    def add_message(self, message):
+        self.messages[message.id] = message
+        self.messages_by_name[message.name] = message
+
+    # Message by name or ID
+    def message(self, key):
+        if isinstance(key, str):
+            return self.messages_by_name[key]
+        return self.messages[key]
+
+    def signal(self, message, name):
+        return self.message(message).signals[name]
+
+'''
+    Payload matrix -> (little endian words, big endian words), one uint64 per row each.
+    Rows are zero padded past the dlc (FrameTable guarantees it), so short frames decode like the padded single frame path.
+'''
+def payload_words(data):
+    data = np.ascontiguousarray(data, dtype=np.uint8).reshape(-1, PAYLOAD_WIDTH)
+    return data.view('<u8').ravel().astype(np.uint64, copy=False), data.view('>u8').ravel().astype(np.uint64)
+
+def _number(text):
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+# Parses DBC text into a Database
+def parse_dbc(text):
+    db = Database()
+    message = None
+    for line in text.splitlines():
+        line = line.strip()
+        match = _MESSAGE.match(line)
+        if match:
+            raw_id = int(match.group(1))
+            message = Message(raw_id & ~EXTENDED_FLAG, match.group(2), int(match.group(3)), match.group(4),
+                              bool(raw_id & EXTENDED_FLAG))
+            db.add_message(message)
+            continue
+        match = _SIGNAL.match(line)
+        if match and message is not None:
+            multiplex = match.group(2)
+            if multiplex is not None and multiplex != 'M':
+                multiplex = int(multiplex[1:])
+            receivers = [r for r in re.split(r'[\s,]+', match.group(12)) if r]
+            message.add_signal(Signal(match.group(1), int(match.group(3)), int(match.group(4)), int(match.group(5)),
+                                      match.group(6) == '-', _number(match.group(7)), _number(match.group(8)),
+                                      _number(match.group(9)), _number(match.group(10)), match.group(11),
+                                      multiplex, receivers))
+            continue
+        if not line.startswith('SG_'):
+            # Signals only follow their BO_ line
+            message = None
+        match = _VALUES.match(line)
+        if match:
+            id = int(match.group(1)) & ~EXTENDED_FLAG
+            if id in db.messages and match.group(2) in db.messages[id].signals:
+                signal = db.messages[id].signals[match.group(2)]
+                signal.choices = {int(value): text for value, text in _CHOICE.findall(match.group(3))}
+    return db
+
+def load_dbc(filename):
+    # DBC files are usually written by Windows tools in cp1252, latin-1 reads any byte
+    with open(filename, encoding='latin-1') as file:
+        return parse_dbc(file.read())
+
+'''
+    Decodes several signals over a FrameTable in one vectorized pass per message.
+    Input: frames, {key: Signal}
+    Output: {key: float64 column aligned with frames}, NaN on rows of other messages (and of other multiplexer values)
+'''
+def decode_signals(frames, signals):
+    columns = {}
+    by_message = {}
+    for key, signal in signals.items():
+        by_message.setdefault(signal.message_id, []).append(key)
+    for message_id, keys in by_message.items():
+        rows = np.flatnonzero(frames.id == message_id)
+        words = payload_words(frames.data[rows])
+        for key in keys:
+            column = np.full(len(frames), np.nan)
+            column[rows] = signals[key].decode_column(None, words)
+            columns[key] = column
+    return columns
@@ -1,19 +1,43 @@
-from time import sleep
 from time import time
 from time import perf_counter
 import datetime
 import threading
 
+import numpy as np
+
+import instrumentation
+from accel_dist import accel_distribution
+from accel_dist import add_sample
+from accel_dist import trips_distribution
+from asc_parser import FrameTable
+from columnar_export import BATCH_ROWS
+from columnar_export import column_writer
+from csv_export import TripCsvWriter
+from dbc import decode_signals
+from dbc import load_dbc
+from frame_cache import iter_frames
+from frame_cache import iter_window
+from frame_cache import load_frames
+from frame_cache import load_window
+from frame_router import FrameRouter
+from replay_scheduler import ReplayScheduler
+from replay_scheduler import decimate
+from replay_scheduler import sleep_until
+from signal_replay import MultiSignalReplay
+from signal_replay import signal_timelines
+from trip_segments import forward_fill
+from trip_segments import segment_trips
+
 '''
     This file is used for acceleration distribution per driving info spec.
     This file can be used for other CAN log analysis, the framework can be reused.
-    Input files MUST BE in .asc format. If there is .blf format then it needs to be converted.
-    To convert:
+    Input files can be .asc or .blf. .blf logs are read natively (blf_reader.py), no conversion needed.
+    Other formats CANoe can replay offline can still be converted to .asc:
         1. Open CANoe (doesn't need specific simulator type, i.e. can be default configuration)
         2. Go to measurement setup.
         3. Make a trace for all CAN lines (filter a CAN trace to allow all CAN lines i.e. 1 through 3)
         4. Change simulation from 'Simulated' to 'Offline'
-        5. Configure offline data and add the .blf file
+        5. Configure offline data and add the log file
         6. Open the CAN trace window
         7. Start replaying the offline data (lightning bolt symbol)
         8. After completed replaying, right click and export from the trace window
@@ -30,12 +54,73 @@ MI = 1
 
 KPH_TO_MPH = 1.609
 
-TIME_MULT = 0.641
-
 ENG_MSG_STD = 0x000
 ENG_MSG_EV = 0x000
 SPD_MSG_1 = 0x000
 
+# Signals decoded by the getters, role -> (message name, signal name) in the DBC given to use_dbc()
+SIGNAL_NAMES = {
+    'speed': ('XXX_XXX', 'XX_XXX_XXXXXXX'),
+    'speed_unit': ('XXX_XXX', 'XX_XXX_XXXXXXX'),
+    'rpm': ('XXX_XXX', 'XX_XXX_XXXXXXX'),
+    'ign': ('XXX_XXX', 'XX_XXX_XXXXXXX'),
+    'on': ('XXX_XXX', 'XX_XXX_XXXXXXX')
+}
+# role -> compiled dbc.Signal, filled in by use_dbc()
+SIGNALS = {}
+
+'''
+    Loads a DBC file and compiles the signals in names (default SIGNAL_NAMES) for the getters.
+    The message IDs SPD_MSG_1, ENG_MSG_STD and ENG_MSG_EV are taken from the DBC instead of the constants above.
+    Returns the dbc.Database so other signals can be looked up from it.
+'''
+def use_dbc(filename, names=None):
+    global SPD_MSG_1, ENG_MSG_STD, ENG_MSG_EV
+    db = load_dbc(filename)
+    names = SIGNAL_NAMES if names is None else names
+    SIGNALS.clear()
+    for role, (message, signal) in names.items():
+        SIGNALS[role] = db.signal(message, signal)
+    if 'speed' in SIGNALS:
+        SPD_MSG_1 = SIGNALS['speed'].message_id
+    if 'rpm' in SIGNALS:
+        ENG_MSG_STD = SIGNALS['rpm'].message_id
+    if 'on' in SIGNALS:
+        ENG_MSG_EV = SIGNALS['on'].message_id
+    return db
+
+'''
+    Per-frame state of the parsing pipeline, this used to be the string keyed 'context' dict.
+    Fixed set of slots so the hot loop reads and writes attributes instead of doing dictionary lookups.
+'''
+class FrameState:
+    __slots__ = ('time', 'old_time', 'trips', 'engine', 'time_speed', 'first_time', 'time_s', 'time_ms',
+                 'speed', 'speed_unit', 'rpm', 'ign', 'on', 'writer')
+
+    def __init__(self, first_time=None):
+        # Current offset time in ms
+        self.time = 0
+        # Used to determine event delta time
+        self.old_time = 0.0
+        # assume there was at least one trip
+        self.trips = 0
+        # Assume initial state is engine off
+        self.engine = False
+        # This is the output array
+        self.time_speed = [[]]
+        # Measurement start time, current offset time in seconds and millisecond (save_to_csv)
+        self.first_time = first_time
+        self.time_s = 0
+        self.time_ms = 0
+        # Decoded signals, None until their frame has been seen
+        self.speed = None
+        self.speed_unit = None
+        self.rpm = None
+        self.ign = None
+        self.on = None
+        # csv_export.TripCsvWriter the speed rows are streamed to (save_to_csv), None keeps them in time_speed
+        self.writer = None
+
 '''
     This function translates .asc formatted data as below:
     Input:
@@ -52,40 +137,41 @@ SPD_MSG_1 = 0x000
         [(time1 ms, speed1 kph/mph), (time2 ms, speed2 kph/mph), ...]  # trip 2
     ]
     The parser assumes initial state is engine off, but it works recognizing that engine is on, it just might miss the first speed values before first engine on signal.
+    workers > 1 decodes the log on that many processes (see asc_parser.read_asc_parallel), trips are then split over the merged frames in one pass.
+    The decoded frames are cached next to the log (see frame_cache.py), use_cache=False always re-parses the text.
+    router defaults to default_router(speed_events_logic), only frames with an ID it has handlers for are decoded.
+    window=(t0, t1) only parses the frames between those offsets in seconds, seeking to them (frame_cache.load_window).
 '''
-def parse_file(filename):
-    file = open(filename)
-    # Count is used because .asc format file has a header, first line is the measurement start time
-    count = 0
+def parse_file(filename, workers=None, use_cache=True, router=None, window=None):
+    if router is None:
+        router = default_router(speed_events_logic)
+    frames = _load(filename, workers, use_cache, router.ids(), window)
     
-    # this stores our variables for lookup. In a class based system context is 'self', so this could be changed to a class (class ParseDrivingData:)
-    context = {
-        # Used to determine event delta time
-        'old_time': 0.0,
-        # assume there was at least one trip
-        'trips': 0,
-        # Assume initial state is engine off
-        'engine': False,
-        # This is the output array
-        'time_speed': [[]]
-    }
+    state = FrameState()
+    if window is not None:
+        # The first delta of a window is from its start, not from the measurement start
+        state.old_time = int(window[0] * 1000)
     # Initialize engine status (in case if vehicle is not defined then engine status will alwaysb be on)
-    context['engine'] = engine_status(context)
-    for line in file:
-        # This is the case that we are past the header, but can be delayed by engine on condition or speed condition.
-        if count < 3:
-            count += 1
-            continue
+    state.engine = engine_status(state)
+    dispatch = router.dispatch
+    # IDs without handlers, for instrumentation
+    unknown = []
+    with instrumentation.stage('dispatch'):
+        # Same as int(float(offset) * 1000) per line
+        time_ms = (frames.time * 1000).astype(np.int64)
+        for i, (time_offset, id) in enumerate(zip(time_ms.tolist(), frames.id.tolist())):
+            state.time = time_offset
+            if not dispatch(id, frames.frame(i), state):
+                unknown.append(id)
+    instrumentation.count_ids('unknown', unknown)
         
-        #   12.940318 1  XXX             Tx   d 6 00 00 00 00 00 00  Length = 205987 BitCount = 106 ID = XXXX
-        split = line.split()
-        # [ 12.94, 1, XXX, Tx, d, 6, 00, 00, 00, 00, 00, 00, ...]
-        context['time'] = get_offset_ms(split)
-        id = int(split[2], 16)
-        frame = get_frame(split)
-        process_frame(id, frame, speed_events_logic, context)
-        
-    return context['time_speed']
+    return state.time_speed
+
+# load_frames of the whole log or load_window of window=(t0, t1)
+def _load(filename, workers, use_cache, ids, window):
+    if window is None:
+        return load_frames(filename, workers, use_cache, ids=ids)
+    return load_window(filename, window[0], window[1], workers, use_cache, ids=ids)
 
 # Get time offset in ms from CAN log
 # Input: 12.034905
@@ -93,97 +179,88 @@ def parse_file(filename):
 def get_offset_ms(offset):
     return int(float(offset[0]) * 1000)
 
+# Signal decoding handlers, see default_router
+def decode_speed_frame(id, frame, state):
+    state.speed = get_speed_signal_a(frame)
+    state.speed_unit = get_speed_signal_b(frame)
+
+def decode_engine_frame(id, frame, state):
+    state.rpm = get_engine_signal_a(frame)
+    state.ign = get_engine_signal_b(frame)
+
+def decode_engine_ev_frame(id, frame, state):
+    state.on = get_engine_signal_EV_a(frame)
+
 '''
-    CAN data parser.
-    Updates context based on new data.
-    Input function is called at each ID so that you can apply your own business logic.
+    Router with the signal decoding handlers for SPD_MSG_1, ENG_MSG_STD and ENG_MSG_EV, each followed by the business logic.
     Business logic ex.: format data and save to file, or make event array, or collect diagnostic data.
-    
+    func is called as func(id, state) once per frame. More handlers (other IDs, other analyses) can be registered on the result.
+'''
+def default_router(func):
+    router = FrameRouter()
+    router.register(SPD_MSG_1, decode_speed_frame)
+    router.register(ENG_MSG_STD, decode_engine_frame)
+    router.register(ENG_MSG_EV, decode_engine_ev_frame)
+    for id in dict.fromkeys((SPD_MSG_1, ENG_MSG_STD, ENG_MSG_EV)):
+        router.register(id, lambda id, frame, state: func(id, state))
+    return router
+
+_routers = {}
+
+'''
+    CAN data parser for a single frame.
+    Updates state based on new data, then calls func so that you can apply your own business logic.
+    Frame is the payload row of a FrameTable (asc_parser.py) trimmed to its dlc, a numpy uint8 array.
     Input:
-    0x###, [00, 00, 00, 00], speed_events_logic(), {'old_time': 0.0, ...}
+    0x###, array([0, 0, 0, 0], dtype=uint8), speed_events_logic(), FrameState()
     Output:
-    None # No need for output, the updated values will exist in context
+    None # No need for output, the updated values will exist in state
 '''
-def process_frame(id, frame, func, context):
-    if id == SPD_MSG_1:
-        context['speed'] = get_speed_signal_a(frame)
-        context['speed_unit'] = get_speed_signal_b(frame)
-        
-        # this is business logic
-        func(id, context)
-    elif id == ENG_MSG_STD:
-        context['rpm'] = get_engine_signal_a(frame)
-        context['ign'] = get_engine_signal_b(frame)
-        
-        # this is business logic
-        func(id, context)
-    elif id == ENG_MSG_EV:
-        context['on'] = get_engine_signal_EV_a(frame)
-        
-        # this is business logic
-        func(id, context)
-    else:
-        pass
+def process_frame(id, frame, func, state):
+    key = (func, SPD_MSG_1, ENG_MSG_STD, ENG_MSG_EV)
+    router = _routers.get(key)
+    if router is None:
+        router = _routers[key] = default_router(func)
+    router.dispatch(id, frame, state)
 
-def speed_events_logic(id, context):
+def speed_events_logic(id, state):
     if id == SPD_MSG_1:
-        if not context['engine']:
+        if not state.engine:
             return
-        context['time_speed'][context['trips']].append((context['time'] - context['old_time'], context['speed']))
-        context['old_time'] = context['time']
-    elif id == ENG_MSG_STD:
-        engine = engine_status(context)
-        if not engine and context['engine']:
-            # Engine on -> off
-            context['trips'] += 1
-            context['time_speed'].append([])
-            context['engine'] = False
-            print("Engine off at " + str(context['time'] / 1000.0))
-        elif engine and not context['engine']:
-            context['engine'] = True
-            print("Engine on at " + str(context['time'] / 1000.0))
-    elif id == ENG_MSG_EV:
-        engine = engine_status(context)
-        if not engine and context['engine']:
+        state.time_speed[state.trips].append((state.time - state.old_time, state.speed))
+        state.old_time = state.time
+    elif id == ENG_MSG_STD or id == ENG_MSG_EV:
+        engine = engine_status(state)
+        if not engine and state.engine:
             # Engine on -> off
-            context['trips'] += 1
-            context['time_speed'].append([])
-            context['engine'] = False
-            print("Engine off at " + str(context['time'] / 1000.0))
-        elif engine and not context['engine']:
-            context['engine'] = True
-            print("Engine on at " + str(context['time'] / 1000.0))
-    else:
-        pass
+            state.trips += 1
+            state.time_speed.append([])
+            state.engine = False
+            print("Engine off at " + str(state.time / 1000.0))
+        elif engine and not state.engine:
+            state.engine = True
+            print("Engine on at " + str(state.time / 1000.0))
 
-def save_to_file_logic(id, context):
+def save_to_file_logic(id, state):
     if id == SPD_MSG_1:
-        if not context['engine']:
+        if not state.engine:
             return
-        curr = context['first_time'] + datetime.timedelta(seconds=context['time_s'], milliseconds=context['time_ms'])
-        context['time_speed'][context['trips']].append((curr.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3], float(context['speed'])))
-    elif id == ENG_MSG_STD:
-        engine = engine_status(context)
-        if not engine and context['engine']:
-            # Engine on -> off
-            context['trips'] += 1
-            context['time_speed'].append([])
-            context['engine'] = False
-        elif engine and not context['engine']:
-            context['engine'] = True
-    elif id == ENG_MSG_EV:
-        engine = engine_status(context)
-        if not engine and context['engine']:
+        if state.writer is not None:
+            state.writer.add(state.trips, state.time_s * 1000 + state.time_ms, float(state.speed))
+            return
+        curr = state.first_time + datetime.timedelta(seconds=state.time_s, milliseconds=state.time_ms)
+        state.time_speed[state.trips].append((curr.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3], float(state.speed)))
+    elif id == ENG_MSG_STD or id == ENG_MSG_EV:
+        engine = engine_status(state)
+        if not engine and state.engine:
             # Engine on -> off
-            context['trips'] += 1
-            context['time_speed'].append([])
-            context['engine'] = False
-        elif engine and not context['engine']:
-            context['engine'] = True
-    else:
-        pass
+            state.trips += 1
+            state.time_speed.append([])
+            state.engine = False
+        elif engine and not state.engine:
+            state.engine = True
 
-def engine_status(context):
+def engine_status(state):
     if EV:
         return True
     elif PHEV:
@@ -195,42 +272,109 @@ def engine_status(context):
     else:
         return True
 
-def speed(context, unit):
-    if 'speed' not in context['speed'] or 'speed_unit' not in context['speed_unit']:
+'''
+    Vectorized engine_status over the engine frames rows of frames, one bool per row.
+    Same placeholder as engine_status, a vehicle specific version decodes rpm/ign/on with decode_roles(frames.take(rows)).
+'''
+def engine_status_column(frames, rows):
+    return np.full(len(rows), engine_status(FrameState()), bool)
+
+# Engine state after every frame, initial before the first one
+def engine_column(frames, initial):
+    engine_rows = np.isin(frames.id, [ENG_MSG_STD, ENG_MSG_EV]) & (frames.id != SPD_MSG_1)
+    return forward_fill(engine_rows, engine_status_column(frames, np.flatnonzero(engine_rows)), initial)
+
+'''
+    Vectorized trip split of a log, the engine state is computed for every frame at once instead of in speed_events_logic.
+    Output: (frames, trips), trips is an array of (start, stop) row pairs into frames, frames.take(slice(start, stop)) is trip i.
+    log=True prints the engine on/off transitions like parse_file does. window=(t0, t1) works as in parse_file,
+    trip_speeds(*split_trips(filename, window=(t0, t1)), start=t0)[i] is replay_trip data of that window only.
+'''
+def split_trips(filename, workers=None, use_cache=True, log=False, window=None):
+    ids = np.unique([SPD_MSG_1, ENG_MSG_STD, ENG_MSG_EV]).astype(np.uint32)
+    frames = _load(filename, workers, use_cache, ids, window)
+    initial = engine_status(FrameState())
+    time_ms = (frames.time * 1000).astype(np.int64)
+    with instrumentation.stage('segment'):
+        trips = segment_trips(engine_column(frames, initial), initial, time_ms, log)
+    return frames, trips
+
+'''
+    parse_file output as arrays, from split_trips.
+    Output: [(delta ms array, speed array), ...] one per trip, delta is from the previous speed frame of any trip.
+    The first delta is from start seconds, the measurement start, or t0 for the frames of a window=(t0, t1).
+    parse_file also keeps an empty list after the last engine off, there is no trip for it here.
+'''
+def trip_speeds(frames, trips, start=0.0):
+    rows = np.flatnonzero(frames.id == SPD_MSG_1)
+    starts = trips[:, 0]
+    trip = np.searchsorted(starts, rows, side='right') - 1
+    inside = trip >= 0
+    inside[inside] = rows[inside] < trips[trip[inside], 1]
+    rows = rows[inside]
+    trip = trip[inside]
+    time_ms = (frames.time[rows] * 1000).astype(np.int64)
+    delta = np.diff(time_ms, prepend=int(start * 1000))
+    if 'speed' in SIGNALS:
+        values = SIGNALS['speed'].decode_column(frames.data[rows])
+    else:
+        values = np.zeros(len(rows))
+    bounds = np.searchsorted(trip, np.arange(len(trips) + 1))
+    return [(delta[bounds[i]:bounds[i + 1]], values[bounds[i]:bounds[i + 1]]) for i in range(len(trips))]
+
+def speed(state, unit):
+    if state.speed is None or state.speed_unit is None:
         return 0.0
     if unit == KM:
-        if context['speed_unit'] == KM:
-            return context['speed']
+        if state.speed_unit == KM:
+            return state.speed
         else:
-            return context['speed'] / KPH_TO_MPH
+            return state.speed / KPH_TO_MPH
     elif unit == MI:
-        if context['speed_unit'] == MI:
-            return context['speed']
+        if state.speed_unit == MI:
+            return state.speed
         else:
-            return context['speed'] * KPH_TO_MPH
+            return state.speed * KPH_TO_MPH
     else:
         return 0.0
 
-def get_engine_ev_a(frame):
-    return 0
-
 # get CAN frame
 # Input: [ 12.94, 1, XXX, Tx, d, 6, 00, 00, 00, 00, 00, 00, ...]
 # Output: [00, 00, 00, 00, 00, 00]
 def get_frame(line):
     return line[6:int(line[5]) + 6]
 
+# Physical value of a signal role from one frame, 0 while no DBC is loaded
+def decode_signal(role, frame):
+    signal = SIGNALS.get(role)
+    if signal is None:
+        return 0
+    return signal.decode(frame)
+
 def get_speed_signal_a(frame):
-    return 0
+    return decode_signal('speed', frame)
 
 def get_speed_signal_b(frame):
-    return 0
+    return decode_signal('speed_unit', frame)
 
 def get_engine_signal_a(frame):
-    return 0
+    return decode_signal('rpm', frame)
 
 def get_engine_signal_b(frame):
-    return 0
+    return decode_signal('ign', frame)
+
+def get_engine_signal_EV_a(frame):
+    return decode_signal('on', frame)
+
+'''
+    Vectorized version of the getters, decodes whole columns of a FrameTable at once.
+    Input: frames, ['speed', 'rpm'] (None for every loaded role)
+    Output: {'speed': array([...]), 'rpm': array([...])}, aligned with frames, NaN on rows of other messages
+'''
+def decode_roles(frames, roles=None):
+    roles = SIGNALS.keys() if roles is None else roles
+    with instrumentation.stage('decode'):
+        return decode_signals(frames, {role: SIGNALS[role] for role in roles})
 
 '''
     Used to export speed events. (Verisk wants to analyze)
@@ -240,53 +384,107 @@ def get_engine_signal_b(frame):
     Output (save_to_mph_0.csv):
         2020-01-15 10:30:01.187, 0.0
         2020-01-15 10:30:01.387, 0.1
+    workers and use_cache work the same as in parse_file.
+    The log is read block by block (frame_cache.iter_frames) and every trip is written to its file while parsing,
+    so memory use does not depend on the log length.
+    window=(t0, t1) only exports the frames between those offsets in seconds (frame_cache.iter_window).
+    prefix names the trip files (prefix + trip + ".csv"), it can hold a directory.
 '''
-def save_to_csv(filename):
-    file = open(filename)
-    # Count is used because .asc format file has a header, first line is the measurement start time
-    count = 0
+def save_to_csv(filename, workers=None, use_cache=True, window=None, prefix="save_to_mph_"):
+    router = default_router(save_to_file_logic)
+    dispatch = router.dispatch
+    state = FrameState()
+    if window is None:
+        batches = iter_frames(filename, workers, use_cache, ids=router.ids())
+    else:
+        batches = iter_window(filename, window[0], window[1], workers, use_cache, ids=router.ids())
+    for frames in batches:
+        if state.writer is None:
+            state.first_time = frames.start_time
+            state.writer = TripCsvWriter(frames.start_time, prefix)
+        unknown = []
+        with instrumentation.stage('export'):
+            time_s = np.floor(frames.time)
+            time_ms = ((frames.time - time_s) * 1000).astype(np.int64)
+            for i, (s, ms, id) in enumerate(zip(time_s.astype(np.int64).tolist(), time_ms.tolist(), frames.id.tolist())):
+                state.time_s = s
+                state.time_ms = ms
+                if not dispatch(id, frames.frame(i), state):
+                    unknown.append(id)
+        instrumentation.count_ids('unknown', unknown)
     
-    context = {
-        # Used to determine event delta time
-        'first_time': None,
-        # assume there was at least one trip
-        'trips': 0,
-        # Assume initial state is engine off
-        'engine': False,
-        # This is the output array
-        'time_speed': [[]],
-        # This is current offset time in seconds
-        'time_s': 0,
-        # This is current offset time millisecond
-        'time_ms': 0
+    with instrumentation.stage('export'):
+        if state.writer is None:
+            # No frames, still one (empty) trip file
+            state.writer = TripCsvWriter(None, prefix)
+        state.writer.close(state.trips + 1)
+
+'''
+    Columnar version of save_to_csv (columnar_export.py), one row per speed frame of the log:
+        time      datetime64[ms] absolute timestamp like the CSV ones (NaT if the log has no header date)
+        offset    float64 seconds from measurement start
+        trip      int32 trip number, row of save_to_mph_<trip>.csv, -1 while the engine is off (rows save_to_csv skips)
+        engine    bool engine state
+        speed     float64 speed, unit float64 speed unit signal (0 without the 'speed' / 'speed_unit' role, like the getters)
+        + one float64 column per signals entry ({name: dbc.Signal}), its last value at or before the row, NaN before the first one
+    format is 'parquet' or 'arrow' (output is one file, needs pyarrow) or 'npy' (output is a directory of .npy columns).
+    The log is streamed block by block like save_to_csv (window=(t0, t1) through frame_cache.iter_window), engine state, trip
+    count and last signal values carry over between blocks, and rows are written in row groups of batch_rows.
+    Returns the number of rows written.
+'''
+def save_to_columns(filename, output, format='parquet', signals=None, workers=None, use_cache=True, window=None,
+                    batch_rows=BATCH_ROWS):
+    signals = signals or {}
+    ids = np.unique([SPD_MSG_1, ENG_MSG_STD, ENG_MSG_EV] + [signal.message_id for signal in signals.values()]).astype(np.uint32)
+    if window is None:
+        batches = iter_frames(filename, workers, use_cache, ids=ids)
+    else:
+        batches = iter_window(filename, window[0], window[1], workers, use_cache, ids=ids)
+    # Carried between blocks: engine state (off at the start, like save_to_csv), trip count and last value of every signal
+    carry = {'engine': False, 'trips': 0, 'last': {name: np.nan for name in signals}}
+    with column_writer(output, format, batch_rows) as writer:
+        for frames in batches:
+            with instrumentation.stage('export'):
+                writer.add(signal_columns(frames, signals, carry))
+        if writer.names is None:
+            # No frames, the output still gets its columns
+            writer.add(signal_columns(FrameTable.empty(), signals, carry))
+    return writer.rows
+
+# save_to_columns columns of one block, carry holds the state before it and is updated to the state after it
+def signal_columns(frames, signals, carry):
+    on = engine_column(frames, carry['engine'])
+    before = np.concatenate([[carry['engine']], on[:-1]])
+    # Trips are counted at engine off, like speed_events_logic / save_to_file_logic
+    trip = carry['trips'] + np.cumsum(before & ~on)
+    rows = np.flatnonzero(frames.id == SPD_MSG_1)
+    speed_frames = frames.take(rows)
+    time_s = np.floor(speed_frames.time)
+    offset_ms = time_s.astype(np.int64) * 1000 + ((speed_frames.time - time_s) * 1000).astype(np.int64)
+    if frames.start_time is not None:
+        stamps = (np.datetime64(frames.start_time, 'us') + offset_ms.astype('timedelta64[ms]')).astype('datetime64[ms]')
+    else:
+        stamps = np.full(len(rows), np.datetime64('NaT'), 'datetime64[ms]')
+    roles = {name: SIGNALS[role] for name, role in (('speed', 'speed'), ('unit', 'speed_unit')) if role in SIGNALS}
+    decoded = decode_signals(speed_frames, roles)
+    columns = {
+        'time': stamps,
+        'offset': speed_frames.time.astype(np.float64),
+        'trip': np.where(on[rows], trip[rows], -1).astype(np.int32),
+        'engine': on[rows],
+        'speed': decoded.get('speed', np.zeros(len(rows))),
+        'unit': decoded.get('unit', np.zeros(len(rows)))
     }
-    
-    for line in file:
-        # This is the case that we are past the header, but can be delayed by engine on condition or speed condition.
-        if count < 3:
-            if count == 0:
-                # date Thu Dec 19 01:32:07.156 pm 2019
-                context['first_time'] = datetime.datetime.strptime(line[:-1], "date %a %b %d %I:%M:%S.%f %p %Y")
-            count += 1
-            continue
-        
-        #   12.940318 1  XXX             Tx   d 6 00 00 00 00 00 00  Length = 205987 BitCount = 106 ID = XXXX
-        split = line.split()
-        # [ 12.94, 1, XXX, Tx, d, 6, 00, 00, 00, 00, 00, 00, ...]
-        
-        split_time = split[0].split('.')
-        context['time_s'] = int(split_time[0])
-        context['time_ms'] = int((float(split[0]) - context['time_s']) * 1000)
-        id = int(split[2], 16)
-        frame = get_frame(split)
-        process_frame(id, frame, save_to_file_logic, context)
-    file.close()
-    
-    for i in range(0, len(context['time_speed'])):
-        file = open("save_to_mph_" + str(i) + ".csv", "w")
-        for row in context['time_speed'][i]:
-            file.write(row[0] + "," + str(row[1]) + "\n")
-    
+    for name, column in decode_signals(frames, signals).items():
+        seen = frames.id == signals[name].message_id
+        filled = forward_fill(seen, column[seen], carry['last'][name])
+        columns[name] = filled[rows]
+        if len(filled):
+            carry['last'][name] = filled[-1]
+    if len(on):
+        carry['engine'] = bool(on[-1])
+        carry['trips'] = int(trip[-1])
+    return columns
 
 class Speed:
     def __init__(self):
@@ -314,11 +512,13 @@ class ReplayThread(threading.Thread):
     def run(self):
         self.replay_speed(self.time_speed)
     
+    # Deadlines are absolute from the thread start, lateness per event ends up in self.scheduler.stats
     def replay_speed(self, time_speed):
-        for speed in time_speed:
-            delay(speed[0])
-            self.shared.set_speed(speed[1])
+        self.scheduler = ReplayScheduler()
+        for speed in self.scheduler.replay(time_speed):
+            self.shared.set_speed(speed)
         self.shared.end()
+        instrumentation.add_lateness(self.scheduler.stats)
 
 
 class ParseThread(threading.Thread):
@@ -338,8 +538,12 @@ class ParseThread(threading.Thread):
         accel_mph = []
         accel_kph = []
         old_speed = 0.0
+        # Sample on a fixed 1 s grid so the samples do not drift against the replay
+        scheduler = ReplayScheduler()
+        second = 0
         while self.shared.get_end():
-            delay(1000)
+            second += 1
+            scheduler.wait_until(second)
             speed = self.shared.get_speed()
             # Assumes speed unit is MPH
             ParseThread.process_accel_mph(accel_mph, speed - old_speed)
@@ -347,11 +551,12 @@ class ParseThread(threading.Thread):
             old_speed = speed
         return (accel_mph, accel_kph)
             
+    # Counts the speed difference of the last second in the accel_dist.ACCEL_BINS bins
     def process_accel_mph(accel, speed_diff):
-        pass
+        add_sample(accel, speed_diff)
             
     def process_accel_kph(accel, speed_diff):
-        pass
+        add_sample(accel, speed_diff)
     
 def start_dist(time_speed, name):
     shared = Speed()
@@ -360,28 +565,42 @@ def start_dist(time_speed, name):
     replay.start()
     parse.start()
 
+'''
+    Same distribution as start_dist without replaying the trip in real time (accel_dist.py), returns (mph, kph).
+    Input: one trip of parse_file or trip_speeds
+'''
+def offline_dist(time_speed, name):
+    start = time()
+    accel = accel_distribution(time_speed, KPH_TO_MPH)
+    end = time()
+    print("[" + name + "] duration: " + str(end - start) + " mph: " + str(accel[0]) + ", kph: " + str(accel[1]))
+    return accel
+
+# Distribution summed over every trip of a log, returns (mph, kph)
+def log_dist(filename, workers=None, use_cache=True):
+    frames, trips = split_trips(filename, workers, use_cache)
+    return trips_distribution(trip_speeds(frames, trips), KPH_TO_MPH)
+
 '''
     This will use the other file asciiCanTool.py to reduce the amount of data to consider.
-    Parses for CAN ID XXX XXX XXX for speed, engine, engine respectively
+    Keeps CAN ID SPD_MSG_1, ENG_MSG_STD, ENG_MSG_EV for speed, engine, engine respectively, returns the trimmed log (output).
 '''
-def read_from_raw_asc(filename):
+def read_from_raw_asc(filename, output="OUTPUT.asc", workers=None):
     from asciiCanTool import trim
-    trim(filename, [])
+    return trim(filename, [SPD_MSG_1, ENG_MSG_STD, ENG_MSG_EV], output=output, workers=workers)
 
 '''
     Raw logs collected (.asc) are converted to a .csv file with event time, speed value.
-    To process speed events we need to process the raw ascii before we can use it.
+    The raw log is parsed directly, save_to_csv only decodes the speed/engine IDs and drops the other lines while reading,
+    so no trimmed copy is written (read_from_raw_asc writes one when it is wanted on disk).
 '''
-def raw_ascii_to_speed_event(filename):
-    from asciiCanTool import trim
-    trim(filename, [])
-    save_to_csv("OUTPUT.asc")
+def raw_ascii_to_speed_event(filename, workers=None, use_cache=True):
+    save_to_csv(filename, workers, use_cache)
 
-# Because Python time.sleep is innaccurate then define as such
+# Because Python time.sleep is innaccurate then define as such, sleeps coarsely and only spins for the last part (see replay_scheduler.py)
+# Relative, so delays add up, use replay_scheduler.ReplayScheduler for a sequence of events
 def delay(millis):
-    _ = perf_counter() + millis / 1000
-    while perf_counter() < _:
-        pass
+    sleep_until(perf_counter() + millis / 1000)
 
 '''
     SO WE CAN REPLAY THE LOGS
@@ -389,19 +608,60 @@ def delay(millis):
     NEED TO HAVE SIMULATOR ALREADY OPEN.
     This is designed to replay speed, but it can be for anything.
     Also start simulator and turn engine on so all signals are populated.
+    Writes happen at absolute deadlines from the replay start (replay_scheduler.py) so the trip does not run late over time,
+    the lateness statistics are printed at the end and returned.
+    speedup replays N times faster than real time (2.0 -> a 1 h trip takes 30 min).
+    By default every sample is written. tolerance skips samples within that many speed units of the last written one
+    (0.0 skips unchanged ones), max_rate caps the writes per (wall) second, a skipped value is written at the next allowed time
+    (replay_scheduler.decimate). The last sample is always written at its own time.
+    data is one trip of parse_file or trip_speeds.
 '''
-def replay_trip(data):
+def replay_trip(data, speedup=1.0, tolerance=None, max_rate=None):
+    if isinstance(data, tuple):
+        # (delta ms array, speed array) of trip_speeds
+        data = list(zip(data[0].tolist(), data[1].tolist()))
     from Python_CANoe import CANoe
     app = CANoe()
     # speed_signal has property Value which can be get/set
     unit_signal = app.set_GetSigVal(1, "XXX_XXX", "XX_XXX_XXXXXXX")
     unit_signal.Value = MI
     speed_signal = app.set_GetSigVal(1, "XXX_XXX", "XX_XXX_XXXXXXX")
-    length = len(data)
-    per = int(length / 100)
-    for i in range(0, len(data)):
-        delay(data[i][0])
-        speed_signal.Value = int(data[i][1] * 2.0)
-        if i % per == 0:
-            print(str(int(i / length * 100)) + "%\r", end='')
+    if tolerance is None and max_rate is None:
+        events = list(data)
+    else:
+        max_interval_ms = 0.0 if max_rate is None else 1000.0 * speedup / max_rate
+        events = list(decimate(data, tolerance or 0.0, max_interval_ms))
+    print("Writing " + str(len(events)) + " of " + str(len(data)) + " samples")
+    length = len(events)
+    per = max(int(length / 100), 1)
+    scheduler = ReplayScheduler(speedup=speedup)
+    with instrumentation.stage('replay'):
+        for i, speed in enumerate(scheduler.replay(events)):
+            speed_signal.Value = int(speed * 2.0)
+            if i % per == 0:
+                print(str(int(i / length * 100)) + "%\r", end='')
+    app.stop_Measurement()
+    print("Replay lateness: " + str(scheduler.stats))
+    instrumentation.add_lateness(scheduler.stats)
+    # Unit write + one write per event
+    instrumentation.count_com('signal.set', length + 1)
+    return scheduler.stats
+
+'''
+    Replays any number of signals of a log at once, in one thread (signal_replay.py).
+    Same requirements as replay_trip.
+    Input: "trip.asc", "vehicle.dbc", [(1, 'XXX_XXX', 'XX_XXX_XXXXXXX'), (2, 'YYY_YYY', 'YY_YYY_YYYYYYY')]
+    raw=True writes the raw signal values instead of the physical ones. Returns the lateness statistics.
+    window=(t0, t1) replays only that part of the log, as in parse_file.
+'''
+def replay_signals(filename, dbc_filename, signals, raw=False, workers=None, use_cache=True, window=None):
+    from Python_CANoe import CANoe
+    db = load_dbc(dbc_filename)
+    ids = np.unique([db.message(message).id for _, message, _ in signals]).astype(np.uint32)
+    frames = _load(filename, workers, use_cache, ids, window)
+    app = CANoe()
+    replay = MultiSignalReplay(app, signal_timelines(frames, db, signals, raw))
+    replay.run()
     app.stop_Measurement()
+    print("Replay lateness: " + str(replay.scheduler.stats) + ", writes: " + str(replay.writes) + ", coalesced: " + str(replay.coalesced))
+    return replay.scheduler.stats
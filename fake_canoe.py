@@ -0,0 +1,202 @@
+import threading
+from collections import Counter
+from time import perf_counter
+
+from replay_scheduler import sleep_until
+
+'''
+    In-process stand-in for the CANoe.Application COM server.
+    Implements the part of the object model Python_CANoe.CANoe uses: Version, Measurement (Running, Start, Stop),
+    GetBus().GetSignal(), Environment.GetVariable, System.Namespaces(ns).Variables(name) and Open / Quit.
+    Every COM access (method call, property read or write) is counted in calls and takes latency seconds, like a cross
+    process round trip. Every value write is logged as (perf_counter time, kind, key, value) in writes.
+    write_delay makes a written value read back only that many seconds later, like CANoe applying it on the next cycle.
+    Signals and variables are created on first use with value 0.
+    Usage, to replay or monitor without CANoe (any OS):
+        app = fake_canoe.install(latency=0.0002)
+        driving_info_speed.replay_trip(trip)
+        print(app.stats())
+'''
+
+class _Version:
+    def __init__(self):
+        self.major = 0
+        self.minor = 0
+        self.Build = 0
+
+
+class FakeValue:
+    def __init__(self, app, kind, key, name, value=0):
+        self._app = app
+        self._kind = kind
+        self._key = key
+        self.Name = name
+        self._value = value
+        self._previous = value
+        self._written = None
+
+    @property
+    def Value(self):
+        self._app._call(self._kind + '.get')
+        if self._written is not None and perf_counter() - self._written < self._app.write_delay:
+            return self._previous
+        return self._value
+
+    @Value.setter
+    def Value(self, value):
+        self._app._call(self._kind + '.set')
+        now = perf_counter()
+        with self._app.lock:
+            self._previous = self._value
+            self._value = value
+            self._written = now
+            self._app.writes.append((now, self._kind, self._key, value))
+
+
+class _Measurement:
+    def __init__(self, app, running):
+        self._app = app
+        self._running = running
+
+    @property
+    def Running(self):
+        self._app._call('Measurement.Running')
+        return self._running
+
+    def Start(self):
+        self._app._call('Measurement.Start')
+        self._running = True
+
+    def Stop(self):
+        self._app._call('Measurement.Stop')
+        self._running = False
+
+
+class _Bus:
+    def __init__(self, app, bus_type):
+        self._app = app
+        self._bus_type = bus_type
+
+    def GetSignal(self, channel_num, msg_name, sig_name):
+        self._app._call('GetSignal')
+        key = (self._bus_type, channel_num, msg_name, sig_name)
+        return self._app._value('signal', key, sig_name)
+
+
+class _Environment:
+    def __init__(self, app):
+        self._app = app
+
+    def GetVariable(self, name):
+        self._app._call('GetVariable')
+        return self._app._value('envvar', name, name)
+
+
+class _Variables:
+    def __init__(self, app, ns_name):
+        self._app = app
+        self._ns_name = ns_name
+
+    def __call__(self, name):
+        self._app._call('Variables')
+        return self._app._value('sysvar', (self._ns_name, name), name)
+
+    def __iter__(self):
+        self._app._call('Variables')
+        return iter([value for (kind, key), value in list(self._app.values.items())
+                     if kind == 'sysvar' and key[0] == self._ns_name])
+
+
+class _Namespace:
+    def __init__(self, app, ns_name):
+        self._app = app
+        self.Name = ns_name
+
+    @property
+    def Variables(self):
+        self._app._call('Namespace.Variables')
+        return _Variables(self._app, self.Name)
+
+
+class _System:
+    def __init__(self, app):
+        self._app = app
+
+    def Namespaces(self, ns_name):
+        self._app._call('Namespaces')
+        return _Namespace(self._app, ns_name)
+
+
+class FakeApplication:
+    def __init__(self, latency=0.0, write_delay=0.0, running=True, values=None):
+        self.latency = latency
+        self.write_delay = write_delay
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.writes = []
+        # (kind, key) -> FakeValue, kind is 'signal', 'envvar' or 'sysvar'
+        self.values = {}
+        self.start_time = perf_counter()
+        self.Version = _Version()
+        self.Measurement = _Measurement(self, running)
+        self.Environment = _Environment(self)
+        self.System = _System(self)
+        self.configuration = None
+        # Initial values, {(kind, key): value}, keys as in write_log
+        for (kind, key), value in (values or {}).items():
+            self._value(kind, key, key[-1] if isinstance(key, tuple) else key, value)
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        if self.latency:
+            sleep_until(perf_counter() + self.latency)
+
+    def _value(self, kind, key, name, initial=0):
+        with self.lock:
+            value = self.values.get((kind, key))
+            if value is None:
+                value = self.values[(kind, key)] = FakeValue(self, kind, key, name, initial)
+        return value
+
+    def GetBus(self, bus_type):
+        self._call('GetBus')
+        return _Bus(self, bus_type)
+
+    def Open(self, cfgname):
+        self._call('Open')
+        self.configuration = cfgname
+
+    def Quit(self):
+        self._call('Quit')
+
+    # Write log of one signal/variable as ([perf_counter times], [values]),
+    # keys: signal (bus_type, channel, message, signal), envvar name, sysvar (namespace, name)
+    def write_log(self, kind, key):
+        rows = [(time, value) for time, k, written, value in self.writes if k == kind and written == key]
+        return [row[0] for row in rows], [row[1] for row in rows]
+
+    # Call counts and rates since creation (or reset)
+    def stats(self):
+        elapsed = perf_counter() - self.start_time
+        total = sum(self.calls.values())
+        return {
+            'seconds': elapsed,
+            'calls': total,
+            'calls_per_s': total / elapsed if elapsed else None,
+            'writes': len(self.writes),
+            'by_call': dict(self.calls)
+        }
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.writes = []
+            self.start_time = perf_counter()
+
+# Makes every CANoe() use one shared FakeApplication(**kwargs), returns it
+def install(**kwargs):
+    from Python_CANoe import use_backend
+    app = FakeApplication(**kwargs)
+    use_backend(lambda: app)
+    return app
@@ -0,0 +1,340 @@
+import datetime
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import instrumentation
+from asc_parser import FrameTable
+from asc_parser import iter_asc_blocks
+from asc_parser import iter_asc_parallel
+from asc_parser import iter_by_time
+from asc_parser import read_asc
+from asc_parser import read_header
+from blf_reader import iter_blf_blocks
+from blf_reader import read_blf
+from time_index import TimeIndexBuilder
+from time_index import index_path
+from time_index import read_index
+from time_index import write_index
+
+'''
+    Binary cache of decoded logs.
+    The FrameTable of a log (.asc or .blf) is stored next to it (log.asc -> log.asc.frames) so later runs memory map it instead of parsing text.
+    File layout:
+        magic (4 bytes) | header length (uint32) | JSON header | padding | column | padding | column ...
+    The JSON header holds the cache key (path, size, mtime, content hash), the row count and the offset/dtype/shape of every column.
+    Columns are aligned to ALIGN bytes so np.memmap can map them directly.
+    Caches are kept under CACHE_MAX_BYTES per directory, least recently used files are removed first.
+    Every full .asc parse (with or without ids) also leaves a time index next to the log (time_index.py), load_window /
+    iter_window use it to read a [t0, t1] window without parsing the log from the start.
+'''
+
+MAGIC = b'VRFC'
+VERSION = 1
+SUFFIX = '.frames'
+ALIGN = 64
+CACHE_MAX_BYTES = 8 << 30
+
+# Content hash samples: head, tail and HASH_SAMPLES evenly spaced blocks in between
+HASH_BLOCK = 1 << 20
+HASH_SAMPLES = 16
+
+# Rows per table yielded from a cached log by iter_frames
+BATCH_ROWS = 1 << 20
+
+_COLUMNS = ('time', 'channel', 'id', 'direction', 'dlc', 'data')
+
+def cache_path(filename, cache_dir=None):
+    if cache_dir is None:
+        return filename + SUFFIX
+    return os.path.join(cache_dir, os.path.basename(filename) + SUFFIX)
+
+'''
+    Hash of a sample of the file content.
+    Hashing every byte of a multi-GB log would cost as much as parsing it, so only the head, the tail and evenly spaced blocks are read.
+    Together with size and mtime this catches logs that were rewritten or replaced.
+'''
+def content_hash(filename):
+    digest = hashlib.blake2b(digest_size=16)
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as file:
+        if size <= HASH_BLOCK * (HASH_SAMPLES + 2):
+            digest.update(file.read())
+        else:
+            step = (size - HASH_BLOCK) // (HASH_SAMPLES + 1)
+            for i in range(HASH_SAMPLES + 2):
+                file.seek(min(i * step, size - HASH_BLOCK))
+                digest.update(file.read(HASH_BLOCK))
+    return digest.hexdigest()
+
+def cache_key(filename):
+    stat = os.stat(filename)
+    return {
+        'path': os.path.abspath(filename),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'hash': content_hash(filename)
+    }
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+# Writes frames to path, through a temporary file so a reader never sees a half written cache
+def write_cache(path, frames, key):
+    columns = {}
+    offset = 0
+    arrays = []
+    for name in _COLUMNS:
+        array = np.ascontiguousarray(getattr(frames, name))
+        columns[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        arrays.append(array)
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({
+        'version': VERSION,
+        'key': key,
+        'rows': len(frames),
+        'start_time': frames.start_time.isoformat() if frames.start_time is not None else None,
+        'columns': columns
+    }).encode()
+    body = _aligned(len(MAGIC) + 4 + len(header))
+    temp = path + '.tmp'
+    try:
+        with open(temp, 'wb') as file:
+            file.write(MAGIC)
+            file.write(np.uint32(len(header)).tobytes())
+            file.write(header)
+            for name, array in zip(_COLUMNS, arrays):
+                file.seek(body + columns[name]['offset'])
+                file.write(array.tobytes())
+            file.truncate(body + offset)
+        os.replace(temp, path)
+    except OSError:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+# Returns the header of a cache file, None if it is missing or not a cache file
+def read_cache_header(path):
+    try:
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                return None
+            length = int(np.frombuffer(file.read(4), np.uint32)[0])
+            header = json.loads(file.read(length))
+    except (OSError, ValueError, IndexError):
+        return None
+    if header.get('version') != VERSION:
+        return None
+    header['body'] = _aligned(len(MAGIC) + 4 + length)
+    return header
+
+# Memory maps the columns of a cache file into a FrameTable
+def map_cache(path, header):
+    arrays = []
+    for name in _COLUMNS:
+        column = header['columns'][name]
+        shape = tuple(column['shape'])
+        if header['rows'] == 0:
+            arrays.append(np.empty(shape, column['dtype']))
+        else:
+            arrays.append(np.memmap(path, column['dtype'], 'r', header['body'] + column['offset'], shape))
+    start_time = header['start_time']
+    if start_time is not None:
+        start_time = datetime.datetime.fromisoformat(start_time)
+    return FrameTable(*arrays, start_time)
+
+'''
+    Removes the least recently used cache files in directory until they use at most max_bytes.
+    A cache hit touches its file, so mtime is the last use.
+'''
+def evict(directory, max_bytes=CACHE_MAX_BYTES, keep=None):
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(SUFFIX):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(entry[1] for entry in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def _is_blf(filename):
+    return os.path.splitext(filename)[1].lower() == '.blf'
+
+'''
+    Decodes a log into a FrameTable, .blf files are read natively (blf_reader.py), anything else is parsed as .asc.
+    workers only applies to .asc (see asc_parser.read_asc), ids keeps only frames with those arbitration IDs.
+    An .asc read writes the time index of the log too.
+'''
+def read_log(filename, workers=None, ids=None):
+    with instrumentation.stage('parse'):
+        if _is_blf(filename):
+            return _select(read_blf(filename), ids)
+        index = TimeIndexBuilder()
+        frames = read_asc(filename, workers=workers, ids=ids, index=index)
+    save_index(filename, index)
+    return frames
+
+'''
+    Stores the index a full parse collected, a read-only location just goes without.
+    An index already written for the same path, size and mtime is kept, so repeated parses do not hash the log again.
+'''
+def save_index(filename, index):
+    stored = read_index(index_path(filename))
+    try:
+        stat = os.stat(filename)
+        if stored is not None and stored[0].get('path') == os.path.abspath(filename) \
+                and stored[0].get('size') == stat.st_size and stored[0].get('mtime') == stat.st_mtime_ns:
+            return
+        write_index(index_path(filename), index.build(), cache_key(filename))
+    except OSError:
+        pass
+
+# Time index of a log (time_index.TimeIndex), None if there is none or the log changed since it was built
+def load_index(filename):
+    stored = read_index(index_path(filename))
+    if stored is None or _is_blf(filename):
+        return None
+    key, index = stored
+    if key != cache_key(filename):
+        return None
+    return index
+
+# Rows of frames with one of ids (all if None), the others are counted as dropped
+def _select(frames, ids):
+    if ids is None:
+        return frames
+    wanted = np.isin(frames.id, ids)
+    if instrumentation.ENABLED:
+        instrumentation.count_ids('dropped', frames.id[~wanted])
+    return frames.take(wanted)
+
+# Counts the frames handed to the caller per ID
+def _delivered(frames):
+    if instrumentation.ENABLED:
+        instrumentation.count_ids('frames', frames.id)
+    return frames
+
+'''
+    Returns the FrameTable of a log, from its cache when the cache key still matches, parsing and caching it otherwise.
+    use_cache=False always parses and leaves the cache alone.
+    workers is passed to read_log. ids keeps only frames with those arbitration IDs, the cache itself always holds every frame
+    so analyses with other IDs can reuse it; without the cache the other lines are rejected while parsing.
+'''
+def load_frames(filename, workers=None, use_cache=True, cache_dir=None, max_bytes=CACHE_MAX_BYTES, ids=None):
+    if not use_cache:
+        return _delivered(read_log(filename, workers, ids))
+    return _delivered(_select(_cached_frames(filename, workers, cache_dir, max_bytes), ids))
+
+# Every frame of a log, from a valid cache or parsed and cached
+def _cached_frames(filename, workers, cache_dir, max_bytes):
+    path = cache_path(filename, cache_dir)
+    key = cache_key(filename)
+    header = read_cache_header(path)
+    if header is not None and header['key'] == key:
+        os.utime(path)
+        with instrumentation.stage('cache_map'):
+            return map_cache(path, header)
+    frames = read_log(filename, workers)
+    try:
+        with instrumentation.stage('cache_write'):
+            write_cache(path, frames, key)
+            evict(os.path.dirname(os.path.abspath(path)), max_bytes, keep=path)
+    except OSError:
+        # Read-only location, the parse result is still good
+        pass
+    return frames
+
+'''
+    Streaming version of load_frames, yields the log as a sequence of FrameTables so memory does not grow with the log.
+    A valid cache is mapped and yielded in BATCH_ROWS slices, otherwise the log is parsed block by block (in parallel when workers > 1)
+    and the cache is left alone, writing it would need the whole table in memory. Parallel ranges are merged into timestamp
+    order (asc_parser.iter_by_time), like read_asc_parallel. Parsing an .asc writes the time index.
+'''
+def iter_frames(filename, workers=None, use_cache=True, cache_dir=None, ids=None):
+    return instrumentation.timed(_iter_frames(filename, workers, use_cache, cache_dir, ids), 'parse')
+
+def _iter_frames(filename, workers, use_cache, cache_dir, ids):
+    if use_cache:
+        path = cache_path(filename, cache_dir)
+        header = read_cache_header(path)
+        if header is not None and header['key'] == cache_key(filename):
+            os.utime(path)
+            frames = map_cache(path, header)
+            for start in range(0, len(frames), BATCH_ROWS):
+                yield _delivered(_select(frames.take(slice(start, start + BATCH_ROWS)), ids))
+            return
+    index = None
+    if _is_blf(filename):
+        batches = (_select(batch, ids) for batch in iter_blf_blocks(filename))
+    else:
+        index = TimeIndexBuilder()
+        if workers is not None and workers > 1:
+            # Ranges in timestamp order like read_asc_parallel gives them
+            batches = iter_by_time(iter_asc_parallel(filename, workers, ids=ids, index=index))
+        else:
+            batches = iter_asc_blocks(filename, ids=ids, index=index)
+    for batch in batches:
+        yield _delivered(batch)
+    if index is not None:
+        save_index(filename, index)
+
+# Rows of frames with t0 <= time <= t1
+def _between(frames, t0, t1):
+    return frames.take(np.flatnonzero((frames.time >= t0) & (frames.time <= t1)))
+
+'''
+    Frames with t0 <= time <= t1 (seconds from measurement start) of a log, as a sequence of FrameTables in file order.
+    A valid cache answers from its memory mapped time column. Otherwise an .asc with a valid time index is read only from the
+    index entry before t0 to the one after t1 (time_index.TimeIndex.range), in one process whatever workers is.
+    Without either the whole log is loaded once through load_frames (workers, use_cache, cache_dir), which leaves the cache
+    and the time index behind for the next window.
+    ids keeps only frames with those arbitration IDs.
+'''
+def iter_window(filename, t0, t1, workers=None, use_cache=True, cache_dir=None, ids=None):
+    return instrumentation.timed(_iter_window(filename, t0, t1, workers, use_cache, cache_dir, ids), 'parse')
+
+def _iter_window(filename, t0, t1, workers, use_cache, cache_dir, ids):
+    frames = None
+    if use_cache:
+        path = cache_path(filename, cache_dir)
+        header = read_cache_header(path)
+        if header is not None and header['key'] == cache_key(filename):
+            os.utime(path)
+            frames = map_cache(path, header)
+    if frames is None:
+        index = load_index(filename)
+        if index is not None:
+            start, stop = index.range(t0, t1)
+            for batch in iter_asc_blocks(filename, start=start, stop=stop, ids=ids):
+                yield _delivered(_between(batch, t0, t1))
+            return
+        if use_cache:
+            frames = _cached_frames(filename, workers, cache_dir, CACHE_MAX_BYTES)
+        else:
+            frames = read_log(filename, workers)
+    rows = np.flatnonzero((frames.time >= t0) & (frames.time <= t1))
+    for start in range(0, len(rows), BATCH_ROWS):
+        yield _delivered(_select(frames.take(rows[start:start + BATCH_ROWS]), ids))
+
+# iter_window as one FrameTable
+def load_window(filename, t0, t1, workers=None, use_cache=True, cache_dir=None, ids=None):
+    start_time = None
+    if not _is_blf(filename):
+        with open(filename, 'rb') as file:
+            start_time, _ = read_header(file)
+    return FrameTable.concat(iter_window(filename, t0, t1, workers, use_cache, cache_dir, ids), start_time)
@@ -0,0 +1,36 @@
+import numpy as np
+
+'''
+    Arbitration ID -> handlers registry.
+    Any number of handlers (signal decoding, business logic, statistics...) can be attached to any number of IDs.
+    A handler is called as handler(id, frame, state), in registration order, for every frame with its ID.
+    ids() gives the IDs with at least one handler so the readers can drop every other line before decoding it
+    (see asc_parser.parse_block ids=).
+'''
+class FrameRouter:
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, id, handler):
+        self.handlers.setdefault(id, []).append(handler)
+        return handler
+
+    def unregister(self, id, handler):
+        handlers = self.handlers.get(id)
+        if handlers is None or handler not in handlers:
+            return
+        handlers.remove(handler)
+        if not handlers:
+            del self.handlers[id]
+
+    def ids(self):
+        return np.array(sorted(self.handlers), np.uint32)
+
+    # Runs the handlers of id, returns False if there are none
+    def dispatch(self, id, frame, state):
+        handlers = self.handlers.get(id)
+        if handlers is None:
+            return False
+        for handler in handlers:
+            handler(id, frame, state)
+        return True
@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from time import perf_counter
+from time import time
+
+import numpy as np
+
+from replay_scheduler import LatenessStats
+
+'''
+    Hot path instrumentation.
+    Off by default. The pipeline checks ENABLED once per block / stage / replay, never per frame, so the disabled cost is a
+    global lookup per block. enable() starts collecting into METRICS:
+        frames per ID           frames frame_cache delivered (after the ids filter), per arbitration ID
+        dropped per ID          frames rejected by the ids filter, while parsing or on cached / .blf frames
+        unknown per ID          frames handed to a FrameRouter without handlers for their ID
+        lines, bytes            .asc text read, with lines/s and bytes/s over the parse stage time
+        stages                  seconds and calls per pipeline stage (parse, cache, decode, segment, dispatch, export, replay...)
+        lateness                replay lateness histogram (replay_scheduler.LatenessStats) over every replay
+        com                     CANoe COM calls per method
+    snapshot() is a JSON ready dict, enable(path, interval) also writes it to path every interval seconds.
+    Usage:
+        instrumentation.enable('metrics.json', interval=10)
+        parse_file('trip.asc')
+        print(instrumentation.snapshot())
+'''
+
+ENABLED = False
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time()
+        self.frames = Counter()
+        self.dropped = Counter()
+        self.unknown = Counter()
+        self.lines = 0
+        self.bytes = 0
+        self.stage_seconds = Counter()
+        self.stage_calls = Counter()
+        self.lateness = LatenessStats()
+        self.com = Counter()
+
+    # Counts an ID column into counter (frames, dropped or unknown)
+    def count_ids(self, counter, ids):
+        if len(ids) == 0:
+            return
+        values, counts = np.unique(ids, return_counts=True)
+        with self.lock:
+            counter.update(dict(zip(values.tolist(), counts.tolist())))
+
+    def add_text(self, lines, nbytes):
+        with self.lock:
+            self.lines += lines
+            self.bytes += nbytes
+
+    def add_stage(self, name, seconds):
+        with self.lock:
+            self.stage_seconds[name] += seconds
+            self.stage_calls[name] += 1
+
+    # Counters a worker process collected, see counts()
+    def merge(self, counts):
+        with self.lock:
+            self.frames.update(counts['frames'])
+            self.dropped.update(counts['dropped'])
+            self.lines += counts['lines']
+            self.bytes += counts['bytes']
+
+    # Picklable parse counters, what a worker process sends back
+    def counts(self):
+        return {'frames': dict(self.frames), 'dropped': dict(self.dropped), 'lines': self.lines, 'bytes': self.bytes}
+
+    def snapshot(self):
+        with self.lock:
+            parse = self.stage_seconds.get('parse', 0.0)
+            return {
+                'time': time(),
+                'uptime': time() - self.started,
+                'frames': {hex(id): count for id, count in sorted(self.frames.items())},
+                'dropped': {hex(id): count for id, count in sorted(self.dropped.items())},
+                'unknown': {hex(id): count for id, count in sorted(self.unknown.items())},
+                'lines': self.lines,
+                'bytes': self.bytes,
+                'lines_per_s': self.lines / parse if parse else None,
+                'bytes_per_s': self.bytes / parse if parse else None,
+                'stages': {name: {'seconds': seconds, 'calls': self.stage_calls[name]}
+                           for name, seconds in self.stage_seconds.items()},
+                'lateness': self.lateness.summary(),
+                'com': dict(self.com)
+            }
+
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        METRICS.add_stage(self.name, perf_counter() - self.start)
+
+
+METRICS = Metrics()
+_NULL = nullcontext()
+_writer = None
+
+# Context manager timing a pipeline stage, a shared no-op when disabled
+def stage(name):
+    return _Stage(name) if ENABLED else _NULL
+
+def count_ids(kind, ids):
+    if ENABLED:
+        METRICS.count_ids(getattr(METRICS, kind), ids)
+
+def add_text(lines, nbytes):
+    if ENABLED:
+        METRICS.add_text(lines, nbytes)
+
+# Yields from iterable, timing the time spent producing the items as stage name (for generators consumed piecewise)
+def timed(iterable, name):
+    if not ENABLED:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        start = perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            METRICS.add_stage(name, perf_counter() - start)
+            return
+        METRICS.add_stage(name, perf_counter() - start)
+        yield item
+
+def add_lateness(stats):
+    if ENABLED:
+        with METRICS.lock:
+            METRICS.lateness.merge(stats)
+
+def count_com(name, calls=1):
+    if ENABLED:
+        with METRICS.lock:
+            METRICS.com[name] += calls
+
+def snapshot():
+    return METRICS.snapshot()
+
+# Writes snapshot() to path through a temporary file, readers never see a partial file
+def write_snapshot(path):
+    temp = path + '.tmp'
+    with open(temp, 'w') as file:
+        json.dump(snapshot(), file, indent=2)
+    os.replace(temp, path)
+
+
+class _SnapshotWriter(threading.Thread):
+    def __init__(self, path, interval):
+        threading.Thread.__init__(self, daemon=True)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            write_snapshot(self.path)
+        write_snapshot(self.path)
+
+'''
+    Starts collecting (and clears what was collected before unless reset=False).
+    path and interval write a JSON snapshot there every interval seconds until disable(), and once more on disable().
+'''
+def enable(path=None, interval=None, reset=True):
+    global ENABLED, METRICS, _writer
+    if reset:
+        METRICS = Metrics()
+    ENABLED = True
+    if path is not None:
+        _stop_writer()
+        _writer = _SnapshotWriter(path, interval or 10.0)
+        _writer.start()
+
+def disable():
+    global ENABLED
+    ENABLED = False
+    _stop_writer()
+
+def _stop_writer():
+    global _writer
+    if _writer is not None:
+        _writer.stopped.set()
+        _writer.join()
+        _writer = None
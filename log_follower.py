@@ -0,0 +1,214 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+import driving_info_speed
+from asc_parser import BLOCK_SIZE
+from asc_parser import parse_block
+from asc_parser import read_header
+from driving_info_speed import FrameState
+
+'''
+    Follow mode for an .asc log that is still being written (endurance runs).
+    update() reads what was appended since the last call, up to the last complete line, and runs those frames through the
+    router (process_frame path, default_router(speed_events_logic) like parse_file) with the same FrameState, so trips and engine
+    state carry over between reads. A read costs the bytes appended, whatever the size of the file.
+    With a checkpoint path, every update that read something also saves the byte offset and the frame state:
+        checkpoint          JSON, offset + state scalars + row count, replaced atomically
+        checkpoint.rows     the time_speed rows, one JSON line [trip, delta ms, speed] each, only new rows are appended
+    so a restarted follower resumes where the last one stopped. The checkpoint is dropped if the log was replaced (other header
+    line, or shorter than the offset) and the log is followed from its start again.
+    The business logic has to keep its output in state.time_speed (speed_events_logic does, a CSV writer is not checkpointed).
+    Usage:
+        follower = LogFollower('endurance.asc', checkpoint='endurance.follow')
+        follower.follow(on_update=lambda f: print(len(f.time_speed), "trips"))
+'''
+
+# Seconds between two reads of follow()
+POLL_SECONDS = 1.0
+
+# FrameState slots saved in the checkpoint (time_speed goes to the rows file)
+_STATE_SLOTS = ('time', 'old_time', 'trips', 'engine', 'speed', 'speed_unit', 'rpm', 'ign', 'on')
+
+# numpy scalars -> Python values for JSON
+def _plain(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+class LogFollower:
+    def __init__(self, filename, router=None, checkpoint=None, block_size=BLOCK_SIZE):
+        self.filename = filename
+        self.router = router if router is not None else driving_info_speed.default_router(driving_info_speed.speed_events_logic)
+        self.ids = self.router.ids()
+        self.checkpoint = checkpoint
+        self.block_size = block_size
+        # Frames processed since the start of the log
+        self.frames = 0
+        self.start_time = None
+        self.header = None
+        self.offset = None
+        self.state = None
+        # Rows of state.time_speed already in the rows file: every trip before saved_trip and saved_len rows of it
+        self.saved_trip = 0
+        self.saved_len = 0
+        self.saved_rows = 0
+        if checkpoint is None or not self._restore():
+            self.reset()
+
+    @property
+    def time_speed(self):
+        return self.state.time_speed
+
+    # Starts over from the start of the log, with a fresh state and an empty rows file
+    def reset(self):
+        self.frames = 0
+        self.offset = None
+        self.header = None
+        self.state = FrameState()
+        self.state.engine = driving_info_speed.engine_status(self.state)
+        self.saved_trip = 0
+        self.saved_len = 0
+        self.saved_rows = 0
+        if self.checkpoint is not None:
+            open(self.checkpoint + '.rows', 'w').close()
+
+    # Header line of the log, b'' while the log has no complete header yet
+    def _read_header(self, file):
+        start_time, header = read_header(file)
+        if not all(line.endswith(b'\n') for line in header):
+            return None, b''
+        return start_time, header[0]
+
+    '''
+        Processes the complete lines appended since the last update, returns the number of frames handed to the router.
+        The log is started over (reset) if it was replaced or truncated since.
+    '''
+    def update(self):
+        if not os.path.exists(self.filename):
+            # Not created yet
+            return 0
+        with open(self.filename, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            start_time, header = self._read_header(file)
+            if not header:
+                return 0
+            if self.offset is not None and (header.decode('ascii', 'replace') != self.header or size < self.offset):
+                self.reset()
+            if self.offset is None:
+                self.start_time, self.header, self.offset = start_time, header.decode('ascii', 'replace'), file.tell()
+                self.state.first_time = start_time
+            file.seek(self.offset)
+            count = 0
+            while True:
+                chunk = file.read(self.block_size)
+                cut = chunk.rfind(b'\n') + 1
+                if cut == 0:
+                    # Nothing or only a partial line, it is read again once it is complete
+                    break
+                count += self._dispatch(parse_block(chunk[:cut], self.start_time, self.ids))
+                self.offset += cut
+                file.seek(self.offset)
+        if count or (self.checkpoint is not None and not os.path.exists(self.checkpoint)):
+            self.save()
+        return count
+
+    def _dispatch(self, frames):
+        state = self.state
+        dispatch = self.router.dispatch
+        # Same as int(float(offset) * 1000) per line, like parse_file
+        time_ms = (frames.time * 1000).astype(np.int64)
+        for i, (time_offset, id) in enumerate(zip(time_ms.tolist(), frames.id.tolist())):
+            state.time = time_offset
+            dispatch(id, frames.frame(i), state)
+        self.frames += len(frames)
+        return len(frames)
+
+    '''
+        Calls update() every poll seconds until stop (threading.Event) is set, on_update(self) after every update that read frames.
+        Runs in the calling thread, run it in a threading.Thread to follow in the background.
+    '''
+    def follow(self, stop=None, poll=POLL_SECONDS, on_update=None):
+        stop = stop if stop is not None else threading.Event()
+        while not stop.is_set():
+            if self.update() and on_update is not None:
+                on_update(self)
+            stop.wait(poll)
+
+    # Appends the new time_speed rows to the rows file, then replaces the checkpoint
+    def save(self):
+        if self.checkpoint is None:
+            return
+        time_speed = self.state.time_speed
+        rows = []
+        for trip in range(self.saved_trip, len(time_speed)):
+            first = self.saved_len if trip == self.saved_trip else 0
+            rows.extend(json.dumps([trip, _plain(delta), _plain(speed)]) + '\n' for delta, speed in time_speed[trip][first:])
+        with open(self.checkpoint + '.rows', 'a') as file:
+            file.write(''.join(rows))
+        self.saved_rows += len(rows)
+        self.saved_trip = len(time_speed) - 1
+        self.saved_len = len(time_speed[-1])
+        checkpoint = {
+            'path': os.path.abspath(self.filename),
+            'header': self.header,
+            'offset': self.offset,
+            'frames': self.frames,
+            'rows': self.saved_rows,
+            'state': {slot: _plain(getattr(self.state, slot)) for slot in _STATE_SLOTS}
+        }
+        temp = self.checkpoint + '.tmp'
+        with open(temp, 'w') as file:
+            json.dump(checkpoint, file)
+        os.replace(temp, self.checkpoint)
+
+    # Loads the checkpoint if it belongs to this log, False if there is none to resume from
+    def _restore(self):
+        try:
+            with open(self.checkpoint) as file:
+                checkpoint = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if checkpoint.get('path') != os.path.abspath(self.filename) or checkpoint.get('offset') is None:
+            return False
+        try:
+            with open(self.filename, 'rb') as file:
+                start_time, header = self._read_header(file)
+                size = os.fstat(file.fileno()).st_size
+        except OSError:
+            # Log rotated away, update() waits for the new one
+            return False
+        if header.decode('ascii', 'replace') != checkpoint['header'] or size < checkpoint['offset']:
+            return False
+        state = FrameState(start_time)
+        for slot, value in checkpoint['state'].items():
+            setattr(state, slot, value)
+        state.time_speed = [[] for _ in range(state.trips + 1)]
+        # Rows past the checkpoint count were written by an update whose checkpoint never made it, they are read again
+        rows = 0
+        position = 0
+        try:
+            with open(self.checkpoint + '.rows', 'rb') as file:
+                for line in file:
+                    if rows == checkpoint['rows']:
+                        break
+                    trip, delta, speed = json.loads(line)
+                    state.time_speed[trip].append((delta, speed))
+                    rows += 1
+                    position += len(line)
+        except OSError:
+            pass
+        if rows != checkpoint['rows']:
+            return False
+        with open(self.checkpoint + '.rows', 'ab') as file:
+            file.truncate(position)
+        self.start_time = start_time
+        self.header = checkpoint['header']
+        self.offset = checkpoint['offset']
+        self.frames = checkpoint['frames']
+        self.state = state
+        self.saved_rows = rows
+        self.saved_trip = len(state.time_speed) - 1
+        self.saved_len = len(state.time_speed[-1])
+        return True
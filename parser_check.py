@@ -0,0 +1,122 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+import numpy as np
+
+import asc_parser
+import asc_generator
+from asc_parser import parse_block
+
+'''
+    Equivalence check of the .asc parser: the fixed layout path of parse_block against the general tokenizer (_parse_tokens),
+    which is what parse_block has to return for any block.
+    Runs on a synthetic log (asc_generator.py) or --log, on blocks of randomly mutated lines (extra / missing spaces, tabs,
+    odd digits and IDs, leading blanks, cut lines) and on a few hand written edge cases, every block with and without ids
+    and with tiny batches (_BATCH_LINES) so the layout reuse and the batch merge are covered too.
+    Prints the first mismatching blocks and exits with 1 if any differs, run it after every change to asc_parser.py.
+    Usage: python parser_check.py [--log some.asc] [--blocks 1000] [--seed 0]
+'''
+
+FIELDS = ('time', 'channel', 'id', 'direction', 'dlc', 'data')
+# ids given to the filtered runs, the speed and engine messages of asc_generator plus IDs of the edge cases
+IDS = np.array([asc_generator.SPEED_ID, asc_generator.ENGINE_ID, 0x1, 0x7, 0x18FEF100], np.uint32)
+# Batch sizes the blocks are parsed with, the default one and a tiny one
+BATCHES = (asc_parser._BATCH_LINES, 7)
+# Bytes a mutation puts in or over a line
+_NOISE = b' \t\rxX.0123456789abcdefGdRT\x00\xff'
+_INSERTS = [b' ', b'  ', b'1', b'.', b'x', b'0' * 20]
+
+EDGE_CASES = [
+    b"   0.000340 1  100             Rx   d 8 00 00 01 01 AD 03 8C D4  Length = 0\r\n"
+    b" 12.5 12  18FEF100x       Tx   d 3 0a Bb cC\r\n",
+    b"   0.000340 1  100             Rx   d 8 00 00 01 01 AD 03 8C D4\n12345.1234567 1 1 Rx d 0\n0.1 1 1x Rx d 1 ff\n",
+    b"1.000001 1  100 Rx d 2 00  11\n1.000002 1  100 Rx d 2 00 1\n.123456 1 7 Tx d 1 7f",
+    b"   0.000340 1  100             Rx   d 8 00 00 01 01 AD 03 8C D4",
+    b"",
+    b"\n\n\n",
+    b"1.5 1 100 Rx d 9 00 00 00 00 00 00 00 00 00\n1.5 1 100 Rx d A 00\n 2.000000 1 x Rx d 1 00\n",
+    b" " * 70 + b"1.000000 1 100 Rx d 1 00\n" + b"1.000000 1 100" + b" " * 60 + b"Rx d 1 01\n",
+    b"9999999999999.999999 1 100 Rx d 1 00\n999999999.999999 1 100 Rx d 1 00\n",
+    b"   12345678901.123456789 1  100 Rx d 8 00 11 22 33 44 55 66 77\n",
+]
+
+# First field where parse_block and _parse_tokens differ on buf, None if they agree
+def compare(buf, ids=None):
+    frames, offsets = parse_block(buf, None, ids, positions=True)
+    expected, expected_offsets = asc_parser._parse_tokens(buf, None, ids)
+    for field in FIELDS:
+        a, b = getattr(frames, field), getattr(expected, field)
+        if a.dtype != b.dtype or not np.array_equal(a, b):
+            return field
+    if not np.array_equal(offsets, expected_offsets):
+        return 'offsets'
+    return None
+
+def _mutate(line, rng):
+    line = bytearray(line)
+    for _ in range(rng.randint(0, 3)):
+        op = rng.random()
+        i = rng.randint(0, max(len(line) - 1, 0))
+        if op < 0.3 and line:
+            line[i] = rng.choice(_NOISE)
+        elif op < 0.5:
+            line[i:i] = rng.choice(_INSERTS)
+        elif op < 0.7 and line:
+            del line[i]
+        elif op < 0.8:
+            line = bytearray(b' ' * rng.randint(0, 70)) + line
+        elif op < 0.9:
+            line = bytearray(line.replace(b'  ', b' ', rng.randint(0, 3)))
+    return bytes(line)
+
+# Blocks of up to 30 lines of lines, about half of them mutated, some without the last newline
+def fuzz_blocks(lines, count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        block = [_mutate(line, rng) if rng.random() < 0.5 else line for line in rng.sample(lines, min(rng.randint(0, 30), len(lines)))]
+        yield b'\n'.join(block) + (b'\n' if rng.random() < 0.7 else b'')
+
+# Compares every block with and without IDS for every batch size, returns [(batch lines, ids given, field, block)]
+def check(blocks):
+    default = asc_parser._BATCH_LINES
+    failed = []
+    try:
+        for batch in BATCHES:
+            asc_parser._BATCH_LINES = batch
+            for buf in blocks:
+                for ids in (None, IDS):
+                    field = compare(buf, ids)
+                    if field is not None:
+                        failed.append((batch, ids is not None, field, buf))
+    finally:
+        asc_parser._BATCH_LINES = default
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the fixed layout .asc parser against the general tokenizer")
+    parser.add_argument('--log', help="log to check and to take the fuzzed lines from (default: a synthetic one)")
+    parser.add_argument('--blocks', type=int, default=1000, help="fuzzed blocks")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.log:
+        with open(args.log, 'rb') as file:
+            log = file.read()
+    else:
+        with tempfile.TemporaryDirectory() as temp:
+            path = os.path.join(temp, 'check.asc')
+            asc_generator.generate_asc(path, 20000, channels=3, seed=args.seed)
+            with open(path, 'rb') as file:
+                log = file.read()
+    lines = log.split(b'\n')[:2000]
+    blocks = [log] + EDGE_CASES + list(fuzz_blocks(lines, args.blocks, args.seed))
+    failed = check(blocks)
+    for batch, filtered, field, buf in failed[:3]:
+        print("Mismatch in " + field + " (batch " + str(batch) + ", ids " + str(filtered) + "):\n" + repr(buf[:2000]))
+    print(str(len(blocks)) + " blocks, " + str(len(failed)) + " mismatches")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
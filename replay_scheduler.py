@@ -0,0 +1,167 @@
+from bisect import bisect_right
+from time import perf_counter
+from time import sleep
+
+'''
+    Deadline scheduler for replaying logged events in real time.
+    Every event has an absolute deadline (start + offset) instead of a delay relative to the previous one, so the time spent
+    in Python and in COM writes between events is absorbed by the next wait instead of adding up over the whole trip.
+    A wait sleeps until SPIN_SECONDS before the deadline and only busy-waits for that last part, so a replay uses almost no CPU.
+    The lateness (actual time - deadline) of every event is collected in LatenessStats.
+    speedup replays N times faster than real time, decimate drops samples within a deadband and caps the write rate.
+    On Windows before Python 3.11 time.sleep has a ~15 ms resolution, give spin=0.016 there to keep sub-millisecond accuracy.
+'''
+
+# Busy-wait this long before each deadline
+SPIN_SECONDS = 0.001
+
+# Upper bounds of the lateness histogram buckets in seconds, the last bucket holds everything later
+LATENESS_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1)
+
+
+class LatenessStats:
+    def __init__(self, buckets=LATENESS_BUCKETS):
+        self.buckets = buckets
+        self.histogram = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+    def add(self, lateness):
+        self.count += 1
+        self.total += lateness
+        if lateness > self.worst:
+            self.worst = lateness
+        self.histogram[bisect_right(self.buckets, lateness)] += 1
+
+    # Adds the events of other (same buckets)
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.worst = max(self.worst, other.worst)
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # Smallest bucket bound below which at least fraction of the events are, None if it is past the last bound
+    def percentile(self, fraction):
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    # Histogram keys are bucket upper bounds in ms, inf for the last one. p99_ms is None without events or past the last bound
+    def summary(self):
+        p99 = self.percentile(0.99) if self.count else None
+        bounds = [bound * 1000 for bound in self.buckets] + [float('inf')]
+        return {
+            'events': self.count,
+            'mean_ms': self.mean() * 1000,
+            'max_ms': self.worst * 1000,
+            'p99_ms': None if p99 is None else p99 * 1000,
+            'histogram': dict(zip(bounds, self.histogram))
+        }
+
+    def __str__(self):
+        summary = self.summary()
+        if summary['p99_ms'] is not None:
+            p99 = "p99 <= " + str(summary['p99_ms']) + " ms"
+        elif self.count:
+            p99 = "p99 > " + str(self.buckets[-1] * 1000) + " ms"
+        else:
+            p99 = "p99 n/a"
+        return ("events: " + str(summary['events']) + ", mean late: " + format(summary['mean_ms'], '.3f') + " ms, max late: "
+                + format(summary['max_ms'], '.3f') + " ms, " + p99)
+
+# Waits until perf_counter() reaches deadline, returns how late it woke up in seconds
+def sleep_until(deadline, spin=SPIN_SECONDS):
+    remaining = deadline - perf_counter()
+    if remaining > spin:
+        sleep(remaining - spin)
+    now = perf_counter()
+    while now < deadline:
+        now = perf_counter()
+    return now - deadline
+
+
+class ReplayScheduler:
+    def __init__(self, spin=SPIN_SECONDS, speedup=1.0):
+        self.spin = spin
+        # Log seconds per wall second
+        self.speedup = speedup
+        self.start_time = None
+        self.stats = LatenessStats()
+
+    # Sets time 0 of the replay, called by the first wait if not called before
+    def start(self, start_time=None):
+        self.start_time = perf_counter() if start_time is None else start_time
+        return self.start_time
+
+    # Waits until offset log seconds (offset / speedup wall seconds) after start, returns the lateness in seconds
+    def wait_until(self, offset):
+        if self.start_time is None:
+            self.start()
+        lateness = sleep_until(self.start_time + offset / self.speedup, self.spin)
+        self.stats.add(lateness)
+        return lateness
+
+    # Seconds since start
+    def elapsed(self):
+        return perf_counter() - self.start_time
+
+    '''
+        Iterates (delay ms, value) pairs with relative delays (parse_file output) and yields each value at its absolute deadline.
+        Input: [(20, 0.0), (20, 1.0)]
+        Output: 0.0 at 20 ms, 1.0 at 40 ms after start
+    '''
+    def replay(self, time_values):
+        offset_ms = 0
+        for delay_ms, value in time_values:
+            offset_ms += delay_ms
+            self.wait_until(offset_ms / 1000)
+            yield value
+
+'''
+    Drops the samples a replay does not need to write, on (delay ms, value) pairs like ReplayScheduler.replay takes.
+    A sample is written only if it differs from the last written value by more than tolerance (0 drops unchanged values only),
+    so the replayed signal is always within tolerance of the log.
+    max_interval_ms is the minimum log time between two writes: a sample that comes too early is held and written at the
+    next allowed time, unless a later one replaces it, so values are at most max_interval_ms late.
+    The last sample is always written, at its own time (or max_interval_ms after the previous write), so the replay lasts
+    as long as the log even if its tail does not change.
+    Output: the kept (delay ms, value) pairs, delays relative to the previous kept sample
+    Input: [(10, 1.0), (10, 1.0), (10, 1.05), (10, 2.0)], tolerance=0.1
+    Output: [(10, 1.0), (30, 2.0)]
+'''
+def decimate(time_values, tolerance=0.0, max_interval_ms=0.0):
+    offset = 0.0
+    written = 0.0
+    last = None
+    pending = None
+    final = None
+    for delay_ms, value in time_values:
+        offset += delay_ms
+        final = value
+        if pending is not None and written + max_interval_ms <= offset:
+            at = max(pending[0], written + max_interval_ms)
+            yield at - written, pending[1]
+            written, last, pending = at, pending[1], None
+        if last is not None and abs(value - last) <= tolerance:
+            # Back within the deadband of what was written, a held sample is obsolete
+            pending = None
+        elif last is not None and offset - written < max_interval_ms:
+            pending = (offset, value)
+        else:
+            yield offset - written, value
+            written, last = offset, value
+    if pending is not None:
+        at = max(pending[0], written + max_interval_ms)
+        yield at - written, pending[1]
+        written = at
+    if final is not None and written < offset:
+        # Unchanged tail, the last sample keeps the replay as long as the log, still max_interval_ms after the last write
+        yield max(offset, written + max_interval_ms) - written, final
@@ -0,0 +1,193 @@
+import asyncio
+import threading
+
+import numpy as np
+
+import instrumentation
+from replay_scheduler import ReplayScheduler
+
+'''
+    Live signal monitoring with asyncio.
+    SignalMonitor samples a set of (channel, message, signal) triples at a fixed rate. The COM reads run on one worker thread,
+    never on the event loop. Every tick reads all signals through their cached handles and appends one row to a preallocated
+    RingBuffer: a timestamp column plus one value column per signal.
+    Ticks follow absolute deadlines (replay_scheduler.py). A tick missed by more than one period is skipped and counted in
+    overruns, so the monitor never falls further and further behind.
+    Consumers either take a snapshot with window() or iterate subscribe(), which yields a fresh window every few samples:
+        async with SignalMonitor([(1, 'XXX_XXX', 'XX_XXX_XXXXXXX')], rate=100) as monitor:
+            async for times, values in monitor.subscribe(seconds=1.0, every=100):
+                ...
+    COM objects belong to the thread that created them, so the worker creates its own CANoe connection with app_factory
+    (default Python_CANoe.CANoe). The application is a single instance, so this is the same CANoe.
+'''
+
+# Seconds of samples kept by default
+HISTORY_SECONDS = 60.0
+
+
+class RingBuffer:
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.time = np.zeros(capacity, np.float64)
+        self.values = np.full((capacity, width), np.nan)
+        # Rows written since creation, the next row goes to count % capacity
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, time, row):
+        with self.lock:
+            i = self.count % self.capacity
+            self.time[i] = time
+            self.values[i] = row
+            self.count += 1
+
+    # Copy of the last rows (all by default) in time order, as (times, values)
+    def last(self, rows=None):
+        with self.lock:
+            size = len(self)
+            rows = size if rows is None else min(rows, size)
+            index = np.arange(self.count - rows, self.count) % self.capacity
+            return self.time[index], self.values[index]
+
+    # Rows with a time within the last seconds
+    def since(self, seconds):
+        times, values = self.last()
+        start = np.searchsorted(times, times[-1] - seconds, side='left') if len(times) else 0
+        return times[start:], values[start:]
+
+
+class SignalMonitor:
+    def __init__(self, signals, rate=100.0, seconds=HISTORY_SECONDS, app_factory=None, bus_type="CAN"):
+        self.signals = list(signals)
+        self.rate = rate
+        self.bus_type = bus_type
+        self.app_factory = app_factory
+        self.buffer = RingBuffer(max(int(seconds * rate), 1), len(self.signals))
+        self.scheduler = None
+        # Ticks skipped because the previous one ran past their deadline
+        self.overruns = 0
+        self.error = None
+        self.loop = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.subscribers = set()
+
+    # Column of a signal in the value rows
+    def column(self, signal):
+        return self.signals.index(tuple(signal))
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped.clear()
+        ready = self.loop.create_future()
+        self.thread = threading.Thread(target=self._run, args=(ready,), daemon=True)
+        self.thread.start()
+        # Wait until the worker is connected, so errors show up here
+        await ready
+
+    async def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            await self.loop.run_in_executor(None, self.thread.join)
+            self.thread = None
+        self._publish()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def _connect(self):
+        if self.app_factory is not None:
+            return self.app_factory()
+        from Python_CANoe import CANoe
+        return CANoe()
+
+    def _run(self, ready):
+        try:
+            import pythoncom
+            pythoncom.CoInitialize()
+        except ImportError:
+            pythoncom = None
+        try:
+            app = self._connect()
+            handles = [app.set_GetSigVal(*signal, bus_type=self.bus_type) for signal in self.signals]
+        except Exception as error:
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+            self.loop.call_soon_threadsafe(ready.set_exception, error)
+            return
+        self.loop.call_soon_threadsafe(ready.set_result, None)
+        try:
+            self._sample(handles)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.stopped.set()
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+            self.loop.call_soon_threadsafe(self._publish)
+
+    def _sample(self, handles):
+        period = 1.0 / self.rate
+        self.scheduler = ReplayScheduler()
+        self.scheduler.start()
+        row = np.empty(len(handles))
+        tick = 0
+        first = self.buffer.count
+        try:
+            self._ticks(handles, period, row, tick)
+        finally:
+            # One read per signal per tick
+            instrumentation.count_com('signal.get', (self.buffer.count - first) * len(handles))
+
+    def _ticks(self, handles, period, row, tick):
+        while not self.stopped.is_set():
+            self.scheduler.wait_until(tick * period)
+            time = self.scheduler.elapsed()
+            for i, handle in enumerate(handles):
+                row[i] = handle.Value
+            self.buffer.append(time, row)
+            self.loop.call_soon_threadsafe(self._publish)
+            # Next deadline in the future, skipping the ticks already missed
+            behind = int(self.scheduler.elapsed() / period) - tick
+            self.overruns += max(behind, 0)
+            tick += max(behind, 0) + 1
+
+    # On the event loop, wakes every subscriber
+    def _publish(self):
+        for event in self.subscribers:
+            event.set()
+
+    # Snapshot of the last seconds (everything by default), (times, values) with one column per signal
+    def window(self, seconds=None):
+        if seconds is None:
+            return self.buffer.last()
+        return self.buffer.since(seconds)
+
+    '''
+        Yields window(seconds) every `every` new samples until the monitor stops.
+        A slow consumer does not queue windows, it gets the latest one when it comes back.
+    '''
+    async def subscribe(self, seconds=None, every=1):
+        event = asyncio.Event()
+        self.subscribers.add(event)
+        seen = self.buffer.count
+        try:
+            while True:
+                await event.wait()
+                event.clear()
+                if self.buffer.count - seen >= every:
+                    seen = self.buffer.count
+                    yield self.window(seconds)
+                if self.stopped.is_set():
+                    if self.error is not None:
+                        raise self.error
+                    return
+        finally:
+            self.subscribers.discard(event)
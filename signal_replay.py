@@ -0,0 +1,115 @@
+import heapq
+import threading
+
+import numpy as np
+
+import instrumentation
+from dbc import payload_words
+from replay_scheduler import ReplayScheduler
+
+'''
+    Multi-signal replay from one merged timeline.
+    Every signal to replay is a Timeline (time and value columns, usually decoded from a log with signal_timelines).
+    One thread keeps a heap with the next event of every timeline, pops everything due at the same instant, waits for that
+    deadline once (replay_scheduler.py) and writes the batch through the CANoe signal handles (CANoe.set_GetSigVal).
+    Several values of the same signal in one batch are coalesced, only the last one is written.
+    Thread count stays at one whatever the number of signals, messages and channels.
+'''
+
+# Events less than this many seconds after the first event of a batch are written with it
+COALESCE_SECONDS = 0.0005
+
+
+class Timeline:
+    def __init__(self, key, time, value):
+        # (channel, message name, signal name), as given to CANoe.set_GetSigVal
+        self.key = key
+        # Seconds, same time base as FrameTable.time, increasing
+        self.time = np.asarray(time, np.float64)
+        self.value = np.asarray(value)
+
+    def __len__(self):
+        return len(self.time)
+
+'''
+    Decodes the signals to replay from a FrameTable.
+    Input: frames, dbc.Database, [(1, 'XXX_XXX', 'XX_XXX_XXXXXXX'), (2, 'YYY_YYY', 'YY_YYY_YYYYYYY')]
+    Output: [Timeline, Timeline], one per triple with the rows of its message on its channel (and multiplexer value)
+    raw=True keeps the raw (unscaled) signal values, like replay_trip writes.
+'''
+def signal_timelines(frames, db, signals, raw=False):
+    timelines = []
+    for channel, message_name, signal_name in signals:
+        message = db.message(message_name)
+        signal = message.signals[signal_name]
+        rows = np.flatnonzero((frames.id == message.id) & (frames.channel == channel))
+        data = frames.data[rows]
+        if signal.switch is not None:
+            # Multiplexed, only the frames that carry the signal
+            keep = signal.active_column(payload_words(data))
+            rows, data = rows[keep], data[keep]
+        if raw:
+            value = signal.raw_column(payload_words(data))
+        else:
+            value = signal.decode_column(data)
+        timelines.append(Timeline((channel, message_name, signal_name), frames.time[rows], value))
+    return timelines
+
+'''
+    Iterates the merged timelines as (offset seconds, [(timeline index, value), ...]) batches in time order.
+    Offsets are relative to start (default: the first event of all timelines).
+    A batch holds every event within coalesce seconds of its first one, with at most one (the last) value per timeline.
+'''
+def merge_timelines(timelines, coalesce=COALESCE_SECONDS, start=None):
+    times = [timeline.time.tolist() for timeline in timelines]
+    values = [timeline.value.tolist() for timeline in timelines]
+    heap = [(column[0], i, 0) for i, column in enumerate(times) if column]
+    heapq.heapify(heap)
+    if start is None:
+        start = heap[0][0] if heap else 0.0
+    while heap:
+        first = heap[0][0]
+        batch = {}
+        while heap and heap[0][0] - first <= coalesce:
+            _, i, pos = heapq.heappop(heap)
+            batch[i] = values[i][pos]
+            pos += 1
+            if pos < len(times[i]):
+                heapq.heappush(heap, (times[i][pos], i, pos))
+        yield first - start, list(batch.items())
+
+
+class MultiSignalReplay(threading.Thread):
+    def __init__(self, app, timelines, bus_type="CAN", coalesce=COALESCE_SECONDS, speedup=1.0):
+        threading.Thread.__init__(self)
+        self.timelines = timelines
+        self.coalesce = coalesce
+        # Resolved once, every write is then a single COM property set
+        self.handles = [app.set_GetSigVal(*timeline.key, bus_type=bus_type) for timeline in timelines]
+        self.scheduler = ReplayScheduler(speedup=speedup)
+        self.stopped = threading.Event()
+        # Values written and values dropped by coalescing
+        self.writes = 0
+        self.coalesced = 0
+
+    def run(self):
+        self.replay()
+
+    def stop(self):
+        self.stopped.set()
+
+    def replay(self):
+        events = sum(len(timeline) for timeline in self.timelines)
+        handles = self.handles
+        for offset, batch in merge_timelines(self.timelines, self.coalesce):
+            if self.stopped.is_set():
+                break
+            self.scheduler.wait_until(offset)
+            for i, value in batch:
+                handles[i].Value = value
+            self.writes += len(batch)
+        if not self.stopped.is_set():
+            self.coalesced = events - self.writes
+        instrumentation.add_lateness(self.scheduler.stats)
+        instrumentation.count_com('signal.set', self.writes)
+        return self.scheduler.stats
@@ -0,0 +1,131 @@
+import json
+import os
+
+import numpy as np
+
+'''
+    Sparse time index of an .asc log, so a [t0, t1] window can be read without scanning the log from the start.
+    Log time is cut into buckets of `every` seconds. For every bucket the index holds the byte offset of the first line
+    (in file order) whose timestamp reaches it, every line before that offset is earlier than the bucket start.
+    Offsets point at the timestamp token of the line, reading from there parses the same as reading from the line start.
+    The index is a side product of a full parse (asc_parser.iter_asc_blocks(index=TimeIndexBuilder())), frame_cache.py
+    stores it next to the log (log.asc -> log.asc.tindex) together with the cache key of the log.
+    A parse that keeps only some IDs indexes too (add_filtered), its entries point one kept frame earlier.
+    Usage:
+        index = frame_cache.load_index('trip.asc')
+        start, stop = index.range(300.0, 600.0)
+        frames = asc_parser.iter_asc_blocks('trip.asc', start=start, stop=stop)
+'''
+
+VERSION = 1
+SUFFIX = '.tindex'
+# Seconds of log time per index entry
+INDEX_SECONDS = 10.0
+
+
+class TimeIndex:
+    def __init__(self, every, buckets, offsets):
+        self.every = every
+        # Strictly increasing bucket numbers (time // every) and the byte offset each one starts at
+        self.buckets = np.asarray(buckets, np.int64)
+        self.offsets = np.asarray(offsets, np.int64)
+
+    def __len__(self):
+        return len(self.buckets)
+
+    '''
+        Byte range (start, stop) of the log holding every frame with t0 <= time <= t1, None for the start/end of the body.
+        start is exact (or a little early, see add_filtered), stop is one bucket past t1 so timestamps out of order by less than
+        `every` seconds are still included.
+        The range can hold frames outside [t0, t1], the caller filters on time.
+    '''
+    def range(self, t0, t1):
+        first = np.searchsorted(self.buckets, np.floor(t0 / self.every), side='right') - 1
+        last = np.searchsorted(self.buckets, np.floor(t1 / self.every) + 1, side='right')
+        start = int(self.offsets[first]) if first >= 0 else None
+        stop = int(self.offsets[last]) if last < len(self.offsets) else None
+        return start, stop
+
+
+'''
+    Collects the index entries while a log is parsed.
+    add() takes the frames of every block in file order, with the byte offset of each frame.
+    Ranges parsed in parallel each use their own builder, extend() appends their entries() in file order.
+'''
+class TimeIndexBuilder:
+    def __init__(self, every=INDEX_SECONDS):
+        self.every = every
+        # Highest bucket seen so far
+        self.last = -1
+        self.buckets = []
+        self.offsets = []
+        # Offset of the last frame add_filtered took
+        self.previous = None
+
+    def add(self, time, offsets):
+        self.extend(np.floor(time / self.every).astype(np.int64), offsets)
+
+    '''
+        add() for frames of a parse that kept only some IDs. The lines of the other IDs were not read, any of them after the
+        kept frame before can reach the bucket first, so an entry points at that frame (at start, the offset the read began at,
+        for the first frame). The lines before it are earlier unless the log is out of order across a kept frame.
+    '''
+    def add_filtered(self, time, offsets, start):
+        offsets = np.asarray(offsets, np.int64)
+        if len(offsets) == 0:
+            return
+        before = np.concatenate(([start if self.previous is None else self.previous], offsets[:-1]))
+        self.previous = int(offsets[-1])
+        self.add(time, before)
+
+    # Keeps the entries that reach a bucket no earlier line reached
+    def extend(self, buckets, offsets):
+        if len(buckets) == 0:
+            return
+        highest = np.maximum.accumulate(np.concatenate(([self.last], buckets)))
+        new = np.flatnonzero(highest[1:] > highest[:-1])
+        self.buckets.append(highest[1:][new])
+        self.offsets.append(np.asarray(offsets, np.int64)[new])
+        self.last = int(highest[-1])
+
+    # (buckets, offsets) arrays collected so far
+    def entries(self):
+        if not self.buckets:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        return np.concatenate(self.buckets), np.concatenate(self.offsets)
+
+    def build(self):
+        return TimeIndex(self.every, *self.entries())
+
+
+def index_path(filename):
+    return filename + SUFFIX
+
+# Writes index and the cache key of its log to path, through a temporary file like the frame cache
+def write_index(path, index, key):
+    temp = path + '.tmp'
+    try:
+        with open(temp, 'w') as file:
+            json.dump({
+                'version': VERSION,
+                'key': key,
+                'every': index.every,
+                'buckets': index.buckets.tolist(),
+                'offsets': index.offsets.tolist()
+            }, file)
+        os.replace(temp, path)
+    except OSError:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+# Returns (key, TimeIndex) of an index file, None if it is missing or not readable
+def read_index(path):
+    try:
+        with open(path) as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('version') != VERSION:
+        return None
+    return data['key'], TimeIndex(data['every'], data['buckets'], data['offsets'])
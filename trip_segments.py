@@ -0,0 +1,49 @@
+import numpy as np
+
+'''
+    Vectorized trip segmentation.
+    A trip is the span between engine on and engine off. Instead of following the engine state frame by frame,
+    the state column is built in one pass and the transitions are found with a shifted comparison.
+    Trips are returned as (start, stop) row index pairs into the frame arrays, so frames.take(slice(start, stop)) is a view.
+'''
+
+'''
+    Per-row value of the last event at or before each row.
+    Input: rows = array([False, True, False, True, False]), values = array([1, 0]), initial = 5
+    Output: array([5, 1, 1, 0, 0])
+'''
+def forward_fill(rows, values, initial):
+    return np.concatenate([[initial], values])[np.cumsum(rows)]
+
+'''
+    Trip boundaries of an engine state column.
+    Input: on = engine state after each row, initial = engine state before the first row
+        on = array([False, True, True, False, True]), initial = False
+    Output: array([[1, 3], [4, 5]]), one (start, stop) row per engine on period, stop is the engine off row (exclusive)
+    A trip still running at the end stops at len(on). With initial=True the first trip starts at 0, and is (0, 0) if the
+    engine is off at row 0, so trip i is always the i-th engine on period.
+    time (ms per row) and log=True print the transitions like speed_events_logic does.
+'''
+def segment_trips(on, initial=False, time=None, log=False):
+    on = np.asarray(on, bool)
+    before = np.concatenate([[initial], on[:-1]])
+    starts = np.flatnonzero(on & ~before)
+    stops = np.flatnonzero(~on & before)
+    if initial:
+        starts = np.concatenate([[0], starts])
+    if on[-1] if len(on) else initial:
+        stops = np.concatenate([stops, [len(on)]])
+    if log:
+        log_transitions(starts[starts > 0] if initial else starts, stops[stops < len(on)], time)
+    return np.stack([starts, stops], axis=1).astype(np.int64)
+
+# Prints the engine on/off transitions in row order, time in ms per row (row index if None)
+def log_transitions(on_rows, off_rows, time=None):
+    rows = np.concatenate([on_rows, off_rows])
+    order = np.argsort(rows, kind='stable')
+    at = (rows if time is None else np.asarray(time)[rows]).tolist()
+    lines = []
+    for i in order.tolist():
+        lines.append(("Engine on at " if i < len(on_rows) else "Engine off at ") + str(at[i] / 1000.0))
+    if lines:
+        print("\n".join(lines))